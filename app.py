@@ -1,134 +1,439 @@
+import sqlite3
+import sys
+from datetime import timedelta
+from pathlib import Path
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # CSV export đọc bằng pandas (chậm hơn, RAM đỉnh cao hơn)
+    pa = pa_csv = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "src"))
+from anomaly import WINDOW_MINUTES, Z_THRESHOLD, detect_series  # noqa: E402
+from live_panels import PanelState  # noqa: E402
+from partitions import fact_source  # noqa: E402
+from queries import ANOMALY_QUERY, ATTACKS_QUERY, MINUTE_QUERY, RAW_QUERY, marks  # noqa: E402
+from sketches import merge_status, quantile_frame, range_sketches, top_frame  # noqa: E402
+
 st.set_page_config(page_title="Mini SIEM – Dashboard", layout="wide")
 
+DB_PATH     = Path("data/dwh/mini_dwh.db")
+CSV_PATH    = Path("data/dwh/dwh_requests_balanced_big.csv")
+PARQUET_DIR = Path("data/dwh/parquet/requests")
+
 # ============================
-# LOAD DATA (Cố định 1 dataset)
+# LOAD DATA
 # ============================
-
-@st.cache_data
-def load_data():
-    df = pd.read_csv("data/dwh/dwh_requests_balanced_big.csv", parse_dates=["time"])
+# Mặc định đọc thẳng DWH: rollup theo phút / path (ETL cập nhật sẵn) và query
+# fact có filter thời gian + status đẩy xuống SQL, nên thời gian load không
+# phụ thuộc số request. "Parquet export" chỉ đọc các partition ngày được chọn
+# (etl.py --export parquet). "CSV export" giữ cách cũ: đọc file CSV đã export.
+
+# Cột các panel dùng (url cho phân loại tấn công + bảng raw); date/hour/minute,
+# domain, query không đọc
+PARQUET_COLUMNS = [
+    "request_id", "time", "url", "path", "status_code", "status_type", "method", "mime_type", "wait_ms",
+]
+CSV_DTYPES = {
+    "url": "category",
+    "path": "category",
+    "status_type": "category",
+    "method": "category",
+    "mime_type": "category",
+    "status_code": "int16",
+    "wait_ms": "float32",
+}
+
+
+def _read_csv_arrow(path):
+    """pyarrow đọc thẳng thành dictionary (-> categorical), không tạo cột chuỗi trung gian.
+
+    Đọc stream từng block (open_csv) chứ không đọc cả file vào RAM như read_csv.
+    """
+    types = {
+        col: pa.dictionary(pa.int32(), pa.string()) if dtype == "category" else pa.from_numpy_dtype(dtype)
+        for col, dtype in CSV_DTYPES.items()
+    }
+    types["time"] = pa.timestamp("us", tz="UTC")
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(block_size=16 << 20),
+        convert_options=pa_csv.ConvertOptions(include_columns=PARQUET_COLUMNS, column_types=types),
+    )
+    # mỗi block có dictionary riêng -> gộp về 1 dictionary / cột trước khi sang pandas
+    return pa.Table.from_batches(list(reader), reader.schema).unify_dictionaries().to_pandas()
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_data(mtime_ns):
+    """Đọc CSV export 1 lần, dùng chung cho mọi session và mọi lần rerun.
+
+    Chỉ đọc PARQUET_COLUMNS, chuỗi lặp lại thành categorical, số downcast.
+    cache_resource trả về chính frame đã cache (cache_data pickle rồi copy ra
+    mỗi lần gọi). Panel chỉ đọc / tạo frame mới, và pandas copy-on-write nên
+    không session nào sửa được frame dùng chung. mtime_ns: file export đổi thì đọc lại.
+    """
+    if pa_csv is not None:
+        df = _read_csv_arrow(CSV_PATH)
+    else:
+        df = pd.read_csv(CSV_PATH, usecols=PARQUET_COLUMNS, dtype=CSV_DTYPES, parse_dates=["time"])
+    df["request_id"] = pd.to_numeric(df["request_id"], downcast="unsigned")
     return df
 
-df = load_data()
 
-# ============================
-# KPI SECTION
-# ============================
+@st.cache_data(max_entries=8)
+def load_parquet(start_date, end_date):
+    """Đọc các partition date=... trong [start_date, end_date], chỉ các cột dashboard cần"""
+    return pd.read_parquet(
+        PARQUET_DIR,
+        columns=PARQUET_COLUMNS,
+        filters=[("date", ">=", start_date), ("date", "<=", end_date)],
+    )
 
-st.title("MINI-SIEM – Dashboard Giám Sát An Ninh Hệ Thống TMĐT")
 
-col1, col2, col3, col4 = st.columns(4)
+def parquet_dates():
+    return sorted(p.name.split("=", 1)[1] for p in PARQUET_DIR.glob("date=*"))
 
-total_req = len(df)
-error_4xx = len(df[df["status_type"] == "4xx"])
-error_5xx = len(df[df["status_type"] == "5xx"])
-avg_wait = df["wait_ms"].mean()
 
-col1.metric("Tổng Request", f"{total_req:,}")
-col2.metric("Tỷ lệ lỗi 4xx", f"{error_4xx / total_req:.2%}")
-col3.metric("Tỷ lệ lỗi 5xx", f"{error_5xx / total_req:.2%}")
-col4.metric("Wait Time trung bình (ms)", f"{avg_wait:.1f} ms")
+def panels_from_frame(df):
+    """Tính số liệu cho các panel từ raw rows (qua PanelState, cùng code với chế độ live)"""
+    panels = PanelState.from_frame(df).panels()
+    # file export không có bảng anomalies: chạy detector trên chuỗi global
+    panels["df_anomalies"] = detect_series(panels["df_time"].set_index("time")["count"])
+    return panels
 
-st.markdown("---")
 
-# ============================
-# TRAFFIC OVER TIME
-# ============================
+@st.cache_resource(max_entries=1, show_spinner=False)
+def csv_panels(mtime_ns):
+    """Panel của CSV export: tính 1 lần cho mỗi phiên bản file, rerun dùng lại kết quả"""
+    return panels_from_frame(load_data(mtime_ns))
 
-st.subheader("Traffic theo thời gian")
 
-df_time = df.groupby(pd.Grouper(key="time", freq="1min")).size().reset_index(name="count")
+def has_rollups():
+    if not DB_PATH.exists():
+        return False
+    with sqlite3.connect(DB_PATH) as conn:
+        try:
+            return conn.execute("SELECT 1 FROM rollup_minute_status LIMIT 1").fetchone() is not None
+        except sqlite3.OperationalError:
+            return False
 
-fig_traffic = px.line(
-    df_time, x="time", y="count",
-    title="Lưu lượng Request theo phút",
-    markers=True
-)
-st.plotly_chart(fig_traffic, use_container_width=True)
 
-# ============================
-# STATUS BREAKDOWN
-# ============================
+def _meta(conn, key, default):
+    row = conn.execute("SELECT value FROM etl_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
 
-st.subheader("Trạng thái trả về (Status Breakdown)")
 
-fig_status = px.bar(
-    df.groupby("status_type").size().reset_index(name="count"),
-    x="status_type", y="count",
-    color="status_type",
-    title="Phân bố status"
-)
-st.plotly_chart(fig_status, use_container_width=True)
+def dwh_version():
+    """load_version trong etl_meta: đổi mỗi lần ETL nạp xong, dùng làm khoá cache"""
+    with sqlite3.connect(DB_PATH) as conn:
+        return _meta(conn, "load_version", "0")
 
-col5, col6 = st.columns(2)
 
-# ============================
-# TOP SUSPICIOUS URL (4xx)
-# ============================
+@st.cache_data(ttl=600, max_entries=64, show_spinner=False)
+def query_dwh(sql, params, version):
+    """Chạy 1 query trên DWH. Cache theo (sql, params, version): giới hạn số entry,
+    hết hạn sau TTL và tự mất hiệu lực khi ETL nạp lần mới (version đổi)."""
+    with sqlite3.connect(DB_PATH) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+def _epoch_minute(dt):
+    """datetime naive (UTC) của slider -> epoch minute, tức time_id của dim_time"""
+    return pd.Timestamp(dt, tz="UTC").value // 60_000_000_000
+
+
+@st.cache_data(ttl=600, max_entries=64, show_spinner=False)
+def sketch_panels(lo, hi, status_types, version):
+    """Top path 4xx, phân vị wait_ms theo path và wait tổng cho [lo, hi) (epoch minute).
+
+    Merge sketch theo ngày / giờ trọn trong khoảng (sketches.py), chỉ phần giờ lẻ
+    ở 2 đầu mới đọc fact.
+    """
+    with sqlite3.connect(DB_PATH) as conn:
+        sketches = range_sketches(conn, lo, hi, status_types)
+    top = merge_status(sketches, "top_path", ["4xx"]).get("")
+    waits = merge_status(sketches, "wait_ms")
+    wait_count = sum(sketch.count for sketch in waits.values())
+    wait_sum = sum(sketch.sum for sketch in waits.values())
+    return top_frame(top), quantile_frame(waits), wait_count, wait_sum
+
+
+def panels_from_dwh(start, end, status_types, version):
+    """Số liệu panel từ DWH, filter thời gian [start, end) và status đẩy xuống SQL.
+
+    Traffic / status đọc từ rollup theo phút; top path và wait_ms theo path từ
+    sketch (sketch_panels); tấn công / raw query fact và chỉ lấy dòng cần vẽ.
+    """
+    status_marks, status_params = marks(status_types), list(status_types)
+    minute_params = (start.strftime("%Y-%m-%d %H:%M"), end.strftime("%Y-%m-%d %H:%M"), *status_params)
+
+    df_minute = query_dwh(MINUTE_QUERY.format(marks=status_marks), minute_params, version)
+
+    # filter trên fact theo time_id; chỉ join các partition ngày trong khoảng
+    lo, hi = _epoch_minute(start), _epoch_minute(end)
+    fact_params = (lo, hi, *status_params)
+    with sqlite3.connect(DB_PATH) as conn:
+        source = fact_source(conn, lo, hi)
+
+    top_susp, df_slow, wait_count, wait_sum = sketch_panels(lo, hi, status_types, version)
+
+    df_attacks = query_dwh(ATTACKS_QUERY.format(source=source, marks=status_marks), fact_params, version)
+    df_attacks["time"] = pd.to_datetime(df_attacks["minute"], utc=True)
 
-with col5:
-    st.subheader("URL nghi ngờ – nhiều lỗi 4xx")
+    df_raw = query_dwh(RAW_QUERY.format(source=source, marks=status_marks), fact_params, version)
 
-    df_susp = df[df["status_type"] == "4xx"]
-    top_susp = df_susp["path"].value_counts().reset_index()
-    top_susp.columns = ["path", "count"]
+    df_anomalies = query_dwh(ANOMALY_QUERY.format(marks=status_marks), minute_params, version)
 
-    fig_susp = px.bar(
-        top_susp.head(10),
-        x="count", y="path",
-        orientation="h",
-        title="Top 10 suspicious URL (4xx)"
+    df_minute["time"] = pd.to_datetime(df_minute["minute"], utc=True)
+    # resample để các phút không có request vẫn có điểm = 0 (giống Grouper trên raw rows)
+    df_time = (
+        df_minute.groupby("time")["requests"].sum()
+                 .resample("1min").sum()
+                 .reset_index(name="count")
     )
-    st.plotly_chart(fig_susp, use_container_width=True)
+    by_status = df_minute.groupby("status_type")["requests"].sum()
+
+    return {
+        "total": int(by_status.sum()),
+        "n_4xx": int(by_status.get("4xx", 0)),
+        "n_5xx": int(by_status.get("5xx", 0)),
+        "avg_wait": wait_sum / wait_count if wait_count else float("nan"),
+        "df_time": df_time,
+        "df_status": by_status.reset_index(name="count"),
+        "top_susp": top_susp,
+        "df_slow": df_slow,
+        "df_raw": df_raw,
+        "df_attacks": df_attacks,
+        "df_anomalies": df_anomalies,
+    }
+
 
 # ============================
-# SLOW ENDPOINTS
+# LIVE (SOC screen)
 # ============================
+# Toàn bộ lịch sử DWH, tự refresh: PanelState dùng chung mọi session, mỗi lần
+# refresh chỉ cộng các fact nạp sau watermark request_id (live_panels.py).
+
+REFRESH_SECONDS = 10
+
+
+@st.cache_resource(max_entries=1, show_spinner="Đang khởi tạo aggregate từ rollup...")
+def live_state(dwh_id):
+    """dwh_id đổi khi DWH được tạo lại (full refresh) -> khởi tạo state mới"""
+    with sqlite3.connect(DB_PATH) as conn:
+        return PanelState.from_dwh(conn)
 
-with col6:
-    st.subheader("Endpoint chậm – Wait Time cao")
 
-    df_slow = (
-        df.groupby("path")["wait_ms"]
-          .mean()
-          .sort_values(ascending=False)
-          .reset_index()
+def live_panels():
+    with sqlite3.connect(DB_PATH) as conn:
+        state = live_state(_meta(conn, "dwh_id", ""))
+        state.refresh(conn)
+        version = _meta(conn, "load_version", "0")
+    panels = state.panels()
+    panels["df_anomalies"] = query_dwh(
+        "SELECT minute, dimension, key, count, baseline, zscore FROM anomalies ORDER BY minute, zscore DESC",
+        (), version,
     )
+    return panels
+
+
+ALL_STATUS_TYPES = ["2xx", "3xx", "4xx", "5xx"]
+
+source = st.sidebar.radio("Nguồn dữ liệu", ["DWH (rollup)", "Parquet export", "CSV export"])
 
-    fig_slow = px.bar(
-        df_slow.head(10),
-        x="wait_ms", y="path",
-        orientation="h",
-        title="Top 10 slow endpoints"
+live = False
+if source == "DWH (rollup)" and has_rollups():
+    live = st.sidebar.toggle(
+        f"Live – tự refresh mỗi {REFRESH_SECONDS}s",
+        help="Toàn bộ lịch sử; mỗi lần refresh chỉ cộng thêm các request mới nạp",
     )
-    st.plotly_chart(fig_slow, use_container_width=True)
+if live:
+    panels = None  # tính trong fragment cuối trang, tự chạy lại mỗi REFRESH_SECONDS
+elif source == "DWH (rollup)" and has_rollups():
+    version = dwh_version()
+    bounds = query_dwh("SELECT MIN(minute) AS lo, MAX(minute) AS hi FROM rollup_minute_status", (), version)
+    t_min = pd.Timestamp(bounds["lo"].iloc[0]).to_pydatetime()
+    t_max = pd.Timestamp(bounds["hi"].iloc[0]).to_pydatetime() + timedelta(minutes=1)
+
+    start, end = st.sidebar.slider(
+        "Khoảng thời gian (UTC)",
+        min_value=t_min,
+        max_value=t_max,
+        value=(t_min, t_max),
+        step=timedelta(minutes=1),
+        format="YYYY-MM-DD HH:mm",
+    )
+    status_types = st.sidebar.multiselect("Status", ALL_STATUS_TYPES, default=ALL_STATUS_TYPES)
+    if not status_types:
+        st.warning("Chọn ít nhất 1 nhóm status.")
+        st.stop()
+
+    panels = panels_from_dwh(start, end, tuple(status_types), version)
+elif source == "Parquet export" and parquet_dates():
+    dates = parquet_dates()
+    d_from, d_to = st.sidebar.select_slider("Ngày", options=dates, value=(dates[0], dates[-1]))
+    panels = panels_from_frame(load_parquet(d_from, d_to))
+else:
+    if source == "DWH (rollup)":
+        st.sidebar.warning("DWH chưa có rollup – hãy chạy `python src/etl.py`. Đang dùng CSV export.")
+    elif source == "Parquet export":
+        st.sidebar.warning(
+            "Chưa có Parquet – hãy chạy `python src/etl.py --export parquet`. Đang dùng CSV export."
+        )
+    panels = csv_panels(CSV_PATH.stat().st_mtime_ns)
 
-st.markdown("---")
+def render(panels):
+    """Vẽ toàn bộ dashboard từ dict số liệu panel"""
+    if panels["total"] == 0:
+        st.warning("Không có request nào trong khoảng đã chọn.")
+        return
 
-# ============================
-# RAW LOG TABLE
-# ============================
+    # ============================
+    # KPI SECTION
+    # ============================
 
-st.subheader("Bảng request chi tiết")
-st.dataframe(df.head(500), use_container_width=True)
+    st.title("MINI-SIEM – Dashboard Giám Sát An Ninh Hệ Thống TMĐT")
 
-# ============================
-# ANOMALY DETECTION (optional)
-# ============================
+    col1, col2, col3, col4 = st.columns(4)
+
+    total_req = panels["total"]
+    error_4xx = panels["n_4xx"]
+    error_5xx = panels["n_5xx"]
+    avg_wait = panels["avg_wait"]
+
+    col1.metric("Tổng Request", f"{total_req:,}")
+    col2.metric("Tỷ lệ lỗi 4xx", f"{error_4xx / total_req:.2%}")
+    col3.metric("Tỷ lệ lỗi 5xx", f"{error_5xx / total_req:.2%}")
+    col4.metric("Wait Time trung bình (ms)", f"{avg_wait:.1f} ms")
+
+    st.markdown("---")
+
+    # ============================
+    # TRAFFIC OVER TIME
+    # ============================
+
+    st.subheader("Traffic theo thời gian")
+
+    df_time = panels["df_time"]
+
+    fig_traffic = px.line(
+        df_time, x="time", y="count",
+        title="Lưu lượng Request theo phút",
+        markers=True
+    )
+    st.plotly_chart(fig_traffic, use_container_width=True)
+
+    # ============================
+    # STATUS BREAKDOWN
+    # ============================
+
+    st.subheader("Trạng thái trả về (Status Breakdown)")
+
+    fig_status = px.bar(
+        panels["df_status"],
+        x="status_type", y="count",
+        color="status_type",
+        title="Phân bố status"
+    )
+    st.plotly_chart(fig_status, use_container_width=True)
+
+    col5, col6 = st.columns(2)
+
+    # ============================
+    # TOP SUSPICIOUS URL (4xx)
+    # ============================
+
+    with col5:
+        st.subheader("URL nghi ngờ – nhiều lỗi 4xx")
+
+        top_susp = panels["top_susp"]
+
+        fig_susp = px.bar(
+            top_susp.head(10),
+            x="count", y="path",
+            orientation="h",
+            title="Top 10 suspicious URL (4xx)"
+        )
+        st.plotly_chart(fig_susp, use_container_width=True)
+
+    # ============================
+    # SLOW ENDPOINTS
+    # ============================
+
+    with col6:
+        st.subheader("Endpoint chậm – Wait Time cao")
+
+        df_slow = panels["df_slow"]
+
+        # mean che mất tail latency: vẽ p50 / p95 / p99 (DDSketch, sai số tương đối 1%)
+        fig_slow = px.bar(
+            df_slow.head(10),
+            x=["p50", "p95", "p99"], y="path",
+            orientation="h", barmode="group",
+            hover_data={"wait_ms": ":.1f"},
+            labels={"value": "wait_ms", "variable": "phân vị"},
+            title="Top 10 slow endpoints (theo p95)"
+        )
+        st.plotly_chart(fig_slow, use_container_width=True)
+
+    st.markdown("---")
+
+    # ============================
+    # ATTACKS (SIGNATURE)
+    # ============================
+
+    st.subheader("Tấn công theo phút (signature SQLi / XSS / LFI / ...)")
+
+    df_attacks = panels["df_attacks"]
+    if len(df_attacks) > 0:
+        fig_attacks = px.bar(
+            df_attacks, x="time", y="count",
+            color="attack_category",
+            title="Số request khớp signature tấn công theo phút"
+        )
+        st.plotly_chart(fig_attacks, use_container_width=True)
+    else:
+        st.success("Không có request nào khớp signature tấn công.")
+
+    st.markdown("---")
+
+    # ============================
+    # RAW LOG TABLE
+    # ============================
+
+    st.subheader("Bảng request chi tiết")
+    st.dataframe(panels["df_raw"], use_container_width=True)
+
+    # ============================
+    # ANOMALY DETECTION
+    # ============================
+
+    st.subheader("Phát hiện bất thường (cửa sổ trượt)")
+    st.write(
+        f"- Spike: số request/phút > mean + {Z_THRESHOLD:g}·std của {WINDOW_MINUTES} phút trước đó "
+        "(theo toàn hệ thống, path, status và loại tấn công)"
+    )
+
+    df_anomalies = panels["df_anomalies"]
 
-st.subheader("Phát hiện bất thường (Simple Rules)")
+    if len(df_anomalies) > 0:
+        st.error("PHÁT HIỆN TRAFFIC SPIKE!")
+        st.dataframe(df_anomalies, use_container_width=True)
+    else:
+        st.success("Không phát hiện spike bất thường.")
 
-traffic_threshold = df_time["count"].mean() * 3
-st.write(f"- Ngưỡng spike traffic: > {traffic_threshold:.1f} request/min")
 
-anomalies = df_time[df_time["count"] > traffic_threshold]
+if panels is None:
+    @st.fragment(run_every=REFRESH_SECONDS)
+    def live_view():
+        render(live_panels())
 
-if len(anomalies) > 0:
-    st.error("PHÁT HIỆN TRAFFIC SPIKE!")
-    st.dataframe(anomalies)
+    live_view()
 else:
-    st.success("Không phát hiện spike bất thường.")
+    render(panels)
@@ -0,0 +1,227 @@
+"""Phát hiện bất thường theo cửa sổ trượt, cập nhật dần khi có fact mới.
+
+Mỗi chuỗi (global, theo path, theo status_type, theo loại tấn công) giữ số
+request của phút hiện tại và 1 ring buffer số request của W phút trước đó.
+Mean/variance của cửa sổ được cộng/trừ dần khi phút mới vào / phút cũ ra nên
+mỗi lần cập nhật là O(1) và bộ nhớ chỉ phụ thuộc W × số chuỗi, không phụ thuộc
+độ dài log. Một phút bị coi là spike khi số request vượt mean + Z·std của cửa sổ.
+"""
+import json
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from detection import BENIGN
+
+WINDOW_MINUTES = 60
+Z_THRESHOLD    = 3.0
+MIN_HISTORY    = 10      # số phút tối thiểu trong cửa sổ trước khi bắt đầu cảnh báo
+MIN_COUNT      = 5       # bỏ qua spike quá nhỏ (VD 0 -> 2 request)
+MAX_SERIES     = 10_000  # chuỗi ít cập nhật nhất bị bỏ khi vượt giới hạn
+
+
+class RollingWindow:
+    """Ring buffer W giá trị nguyên, giữ tổng và tổng bình phương để tính mean/std"""
+
+    __slots__ = ("values", "pos", "n", "total", "total_sq")
+
+    def __init__(self, size, values=None, pos=0, n=0):
+        self.values = values or [0] * size
+        self.pos = pos
+        self.n = n
+        self.total = sum(self.values)
+        self.total_sq = sum(v * v for v in self.values)
+
+    def push(self, x):
+        old = self.values[self.pos]
+        self.values[self.pos] = x
+        self.pos = (self.pos + 1) % len(self.values)
+        self.n = min(self.n + 1, len(self.values))
+        self.total += x - old
+        self.total_sq += x * x - old * old
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else 0.0
+
+    @property
+    def std(self):
+        if not self.n:
+            return 0.0
+        var = self.total_sq / self.n - self.mean ** 2
+        return max(var, 0.0) ** 0.5
+
+
+class Series:
+    """Số request của phút đang mở + cửa sổ các phút đã đóng"""
+
+    __slots__ = ("minute", "count", "window")
+
+    def __init__(self, size, minute=None, count=0, window=None):
+        self.minute = minute
+        self.count = count
+        self.window = window or RollingWindow(size)
+
+
+class AnomalyDetector:
+    def __init__(self, window=WINDOW_MINUTES, z=Z_THRESHOLD, min_history=MIN_HISTORY,
+                 min_count=MIN_COUNT, max_series=MAX_SERIES):
+        self.size = window
+        self.z = z
+        self.min_history = min_history
+        self.min_count = min_count
+        self.max_series = max_series
+        self.series = OrderedDict()
+        self.dirty = set()     # chuỗi đổi trạng thái từ lần save_detector trước
+        self.evicted = []
+
+    def observe(self, minute, dimension, key, count=1):
+        """Ghi nhận `count` request của chuỗi (dimension, key) tại phút `minute`
+        (số phút kể từ epoch). Trả về list anomaly của các phút vừa đóng."""
+        sid = (dimension, key)
+        s = self.series.get(sid)
+        if s is None:
+            s = self.series[sid] = Series(self.size, minute)
+            if len(self.series) > self.max_series:
+                old, _ = self.series.popitem(last=False)
+                self.dirty.discard(old)
+                self.evicted.append(old)
+        else:
+            self.series.move_to_end(sid)
+        self.dirty.add(sid)
+
+        found = []
+        if minute > s.minute:
+            found = self._close(sid, s)
+            # các phút trống ở giữa là 0 request; quá W phút thì cửa sổ toàn 0
+            for _ in range(min(minute - s.minute - 1, self.size)):
+                s.window.push(0)
+            s.minute, s.count = minute, 0
+        # fact đến trễ (minute < phút đang mở) được cộng vào phút đang mở
+        s.count += count
+        return found
+
+    def _close(self, sid, s):
+        w = s.window
+        found = []
+        if w.n >= self.min_history and s.count >= self.min_count:
+            std = max(w.std, 1.0)
+            zscore = (s.count - w.mean) / std
+            if zscore > self.z:
+                found.append({
+                    "minute": s.minute,
+                    "dimension": sid[0],
+                    "key": sid[1],
+                    "count": s.count,
+                    "baseline": w.mean,
+                    "zscore": zscore,
+                })
+        w.push(s.count)
+        return found
+
+    # ---- lưu / nạp trạng thái giữa các lần chạy ETL ----
+
+    def dump(self, dirty_only=False):
+        for (dimension, key), s in self.series.items():
+            if dirty_only and (dimension, key) not in self.dirty:
+                continue
+            w = s.window
+            yield dimension, key, json.dumps(
+                {"minute": s.minute, "count": s.count, "values": w.values, "pos": w.pos, "n": w.n}
+            )
+
+    def load(self, rows):
+        """Nạp trạng thái đã lưu theo thứ tự phút đang mở (cũ trước, giống thứ tự LRU
+        của observe); vượt max_series thì bỏ chuỗi cũ nhất, save_detector xoá khỏi DB"""
+        loaded = []
+        for dimension, key, state in rows:
+            st = json.loads(state)
+            if len(st["values"]) != self.size:
+                continue  # đổi kích thước cửa sổ -> học lại từ đầu
+            window = RollingWindow(self.size, st["values"], st["pos"], st["n"])
+            loaded.append(((dimension, key), Series(self.size, st["minute"], st["count"], window)))
+        loaded.sort(key=lambda item: item[1].minute)
+        excess = max(0, len(loaded) - self.max_series)
+        self.evicted.extend(sid for sid, _ in loaded[:excess])
+        self.series.update(loaded[excess:])
+
+
+def minute_label(minute):
+    return datetime.fromtimestamp(minute * 60, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def load_detector(conn, **kwargs):
+    detector = AnomalyDetector(**kwargs)
+    detector.load(conn.execute("SELECT dimension, key, state FROM anomaly_state"))
+    return detector
+
+
+def save_detector(conn, detector):
+    """Chỉ ghi các chuỗi thay đổi từ lần save trước (ETL follow save mỗi micro-batch)"""
+    conn.executemany(
+        "DELETE FROM anomaly_state WHERE dimension = ? AND key = ?", detector.evicted
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO anomaly_state (dimension, key, state) VALUES (?, ?, ?)",
+        detector.dump(dirty_only=True),
+    )
+    detector.dirty.clear()
+    detector.evicted.clear()
+
+
+def detect(cur, detector, events):
+    """Đưa 1 lô fact vào detector và ghi anomaly phát hiện được vào bảng anomalies.
+
+    events: DataFrame cột minute (số phút epoch), path, status_type, attack_category.
+    Mỗi chuỗi được cộng theo (phút, key) trước rồi mới observe, theo thứ tự phút.
+    """
+    found = []
+    series = {
+        "global": events.assign(key="*"),
+        "path": events.rename(columns={"path": "key"}),
+        "status_type": events.rename(columns={"status_type": "key"}),
+        "attack": events[events["attack_category"].notna() & (events["attack_category"] != BENIGN)]
+        .rename(columns={"attack_category": "key"}),
+    }
+    for dimension, frame in series.items():
+        counts = frame.groupby(["minute", "key"]).size()
+        for (minute, key), count in counts.items():
+            found.extend(detector.observe(int(minute), dimension, key, int(count)))
+
+    if found:
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        cur.executemany(
+            """
+            INSERT INTO anomalies (minute, dimension, key, count, baseline, zscore, detected_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (minute_label(a["minute"]), a["dimension"], a["key"], a["count"],
+                 a["baseline"], a["zscore"], now)
+                for a in found
+            ],
+        )
+    return found
+
+
+def detect_series(counts, **kwargs):
+    """Chạy detector trên 1 chuỗi số request theo phút (index = Timestamp phút).
+
+    Dùng cho dashboard khi đọc CSV/Parquet: cùng thuật toán với ETL, trả về
+    DataFrame cùng cột với bảng anomalies.
+    """
+    index = counts.index.tz_localize(None) if counts.index.tz is not None else counts.index
+    minutes = (index - pd.Timestamp(0)) // pd.Timedelta(minutes=1)
+
+    detector = AnomalyDetector(**kwargs)
+    found = []
+    for minute, count in zip(minutes, counts.to_numpy()):
+        found.extend(detector.observe(int(minute), "global", "*", int(count)))
+    if detector.series:
+        # đóng phút cuối cùng
+        found.extend(detector._close(("global", "*"), detector.series[("global", "*")]))
+
+    df = pd.DataFrame(found, columns=["minute", "dimension", "key", "count", "baseline", "zscore"])
+    df["minute"] = df["minute"].map(minute_label)
+    return df
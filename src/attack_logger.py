@@ -1,10 +1,11 @@
-import csv
 import random
 import time
-from datetime import datetime
 from pathlib import Path
 
+from log_sink import LazySink
+
 LOG_PATH = Path("data/raw/log_parsed.csv")
+SINK = LazySink(LOG_PATH)  # ghi theo lô ở thread nền, tự flush khi thoát; mở ở dòng đầu tiên
 
 # Các URL bình thường (lấy từ script Shopee của ông)
 NORMAL_URLS = [
@@ -40,19 +41,8 @@ TOTAL_EVENTS = 800        # số dòng log muốn sinh thêm
 SLEEP_BETWEEN_EVENTS = 0  # để 0 cho nhanh, hoặc 0.05 cho giống realtime
 
 
-def ensure_header():
-    if not LOG_PATH.exists():
-        LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with LOG_PATH.open("w", newline="", encoding="utf8") as f:
-            w = csv.writer(f)
-            w.writerow(["time", "method", "url", "status", "mimeType", "wait_ms"])
-
-
 def write_log_row(method, url, status, mime, wait_ms):
-    ts = datetime.utcnow().isoformat() + "Z"
-    with LOG_PATH.open("a", newline="", encoding="utf8") as f:
-        w = csv.writer(f)
-        w.writerow([ts, method, url, status, mime, wait_ms])
+    SINK.write(method, url, status, mime, wait_ms)
 
 
 def simulate_event():
@@ -88,7 +78,6 @@ def simulate_event():
 
 
 def main():
-    ensure_header()
     print(f"🚀 Attack logger (offline) – sinh thêm {TOTAL_EVENTS} events vào {LOG_PATH}")
 
     for i in range(TOTAL_EVENTS):
@@ -1,7 +1,33 @@
-import random
+"""Cân bằng lại số request theo status_type (sample / oversample + jitter).
+
+Mỗi class lấy đúng TARGET_PER_CLASS dòng: sample không lặp nếu đủ dữ liệu,
+ngược lại oversample có lặp; wait_ms jitter ±20%, time jitter ±30 phút. Mọi
+ngẫu nhiên lấy từ 1 numpy Generator theo --seed nên chạy lại cho cùng kết quả.
+Class được xử lý lần lượt: đếm số dòng của class, chọn trước mỗi dòng nguồn
+được lấy bao nhiêu lần, rồi đọc nguồn theo lô --chunk-rows dòng và ghi luôn ra
+file, nên cả nguồn lẫn output hàng triệu dòng đều không phải giữ trong RAM.
+
+    python src/augment_status.py                         # dwh_requests.csv -> balanced_big.csv
+    python src/augment_status.py --source dwh --target 2000000 --out /tmp/big.parquet
+"""
+import argparse
+import sqlite3
+import time
 from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
+import etl
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # chỉ cần khi đọc / ghi Parquet; CSV thì ghi bằng pandas
+    pa = pa_csv = ds = pq = None
+
 IN_CSV  = Path("data/dwh/dwh_requests.csv")
 OUT_CSV = Path("data/dwh/dwh_requests_balanced_big.csv")
 
@@ -13,50 +39,172 @@ TARGET_PER_CLASS = {
     "5xx": 2000,
 }
 
-print("Đọc dữ liệu từ:", IN_CSV)
-df = pd.read_csv(IN_CSV, parse_dates=["time"])
+SEED       = 42
+CHUNK_ROWS = 500_000
+
+
+def class_source(source, chunk_rows=CHUNK_ROWS):
+    """Trả về (count, chunks): count(label) -> số dòng của class, chunks(label) ->
+    generator DataFrame các dòng của class đó (cùng cột dwh_requests.csv), mỗi lô
+    tối đa chunk_rows dòng nguồn. Không nguồn nào đọc cả class vào RAM 1 lúc.
+    """
+    if source == "dwh":
+        where = "JOIN dim_status s ON f.status_id = s.status_id WHERE s.status_type = ?"
+
+        def count(label):
+            with sqlite3.connect(etl.DB_PATH) as conn:
+                return conn.execute(f"SELECT COUNT(*) FROM fact_requests f {where}", (label,)).fetchone()[0]
+
+        def chunks(label):
+            with sqlite3.connect(etl.DB_PATH) as conn:
+                sql = etl.EXPORT_QUERY.format(source="fact_requests", where="WHERE s.status_type = ?")
+                for df in pd.read_sql_query(sql, conn, params=(label,), chunksize=chunk_rows):
+                    yield df.assign(time=pd.to_datetime(df["time"], format="ISO8601", utc=True))
+        return count, chunks
+
+    if source == "parquet":
+        if ds is None:
+            raise RuntimeError("Cần cài package 'pyarrow' để đọc Parquet")
+        dataset = ds.dataset(etl.PARQUET_DIR, format="parquet", partitioning="hive")
+
+        def count(label):
+            return dataset.count_rows(filter=ds.field("status_type") == label)
+
+        def chunks(label):
+            for batch in dataset.to_batches(filter=ds.field("status_type") == label, batch_size=chunk_rows):
+                df = batch.to_pandas()
+                df.insert(2, "date", df.pop("date").astype(str))  # cột partition về đúng vị trí
+                yield df.astype({"status_type": str})
+        return count, chunks
+
+    counts = {}
 
-blocks = []
+    def count(label):
+        # 1 lượt đọc riêng cột status_type, đếm cho mọi class
+        if not counts:
+            for part in pd.read_csv(IN_CSV, usecols=["status_type"], chunksize=chunk_rows):
+                for key, n in part["status_type"].value_counts().items():
+                    counts[key] = counts.get(key, 0) + int(n)
+        return counts.get(label, 0)
 
-def build_block(df_src, label, target_n):
-    if df_src.empty:
+    def chunks(label):
+        for df in pd.read_csv(IN_CSV, parse_dates=["time"], chunksize=chunk_rows):
+            yield df[df["status_type"] == label]
+    return count, chunks
+
+
+def _jitter(sampled, rng):
+    """wait_ms jitter ±20% (tối thiểu 1ms), time jitter ± 0–30 phút; date/hour/minute tính lại"""
+    n = len(sampled)
+    if "wait_ms" in sampled.columns:
+        sampled["wait_ms"] = np.fmax(1.0, sampled["wait_ms"].to_numpy() * rng.uniform(0.8, 1.2, n))
+
+    jitter = pd.to_timedelta(rng.integers(-30 * 60, 30 * 60, n, endpoint=True), unit="s")
+    sampled["time"] = sampled["time"] + jitter
+    if {"date", "hour", "minute"} <= set(sampled.columns):
+        # strftime chỉ chạy trên các ngày distinct
+        codes, days = pd.factorize(sampled["time"].dt.floor("D"))
+        sampled["date"] = np.asarray(days.strftime("%Y-%m-%d"), dtype=object)[codes]
+        sampled["hour"] = sampled["time"].dt.hour
+        sampled["minute"] = sampled["time"].dt.minute
+    return sampled
+
+
+def build_block(chunks, n_src, label, target_n, rng, chunk_rows=CHUNK_ROWS):
+    """Generator các chunk đã jitter, tổng cộng target_n dòng của 1 class.
+
+    chunks: các lô dòng nguồn của class (n_src dòng tổng cộng), chỉ đọc 1 lượt.
+    """
+    if not n_src:
         print(f"- Không có bản ghi {label}, bỏ qua.")
-        return None
+        return
 
-    if len(df_src) >= target_n:
-        sampled = df_src.sample(target_n, random_state=42)
-        print(f"- {label}: sample {target_n} / {len(df_src)} (không lặp)")
+    # picks[i] = số lần dòng nguồn thứ i xuất hiện trong output
+    if n_src >= target_n:
+        picks = np.bincount(rng.choice(n_src, target_n, replace=False), minlength=n_src)
+        print(f"- {label}: sample {target_n} / {n_src} (không lặp)")
     else:
-        sampled = df_src.sample(target_n, replace=True, random_state=42)
-        print(f"- {label}: oversample {target_n} từ {len(df_src)} (có lặp)")
+        picks = np.bincount(rng.integers(0, n_src, target_n), minlength=n_src)
+        print(f"- {label}: oversample {target_n} từ {n_src} (có lặp)")
+    picks = picks.astype(np.int32)
 
-    sampled = sampled.copy()
+    def shuffled(block):
+        # trộn thứ tự trong lô: dòng lặp không nằm liền nhau
+        return _jitter(block.iloc[rng.permutation(len(block))].reset_index(drop=True), rng)
 
-    # jitter wait_ms ±20%
-    if "wait_ms" in sampled.columns:
-        sampled["wait_ms"] = sampled["wait_ms"].apply(
-            lambda x: max(1.0, x * random.uniform(0.8, 1.2))
-        )
+    pending, n_pending, pos = [], 0, 0
+    for chunk in chunks:
+        reps = picks[pos:pos + len(chunk)]
+        pos += len(chunk)
+        sampled = chunk.iloc[:len(reps)].iloc[np.repeat(np.arange(len(reps)), reps)]
+        pending.append(sampled)
+        n_pending += len(sampled)
+        # gom đủ chunk_rows dòng mới ghi (tránh row group / lần ghi quá nhỏ)
+        while n_pending >= chunk_rows:
+            block = pd.concat(pending, ignore_index=True)
+            pending, n_pending = [block.iloc[chunk_rows:]], n_pending - chunk_rows
+            yield shuffled(block.iloc[:chunk_rows])
+    if n_pending:
+        yield shuffled(pd.concat(pending, ignore_index=True))
 
-    # jitter time ± 0–30 phút
-    jitter_secs = [random.randint(-30 * 60, 30 * 60) for _ in range(len(sampled))]
-    sampled["time"] = sampled["time"] + pd.to_timedelta(jitter_secs, unit="s")
 
-    return sampled
+def augment(source="csv", out=OUT_CSV, targets=TARGET_PER_CLASS, seed=SEED, chunk_rows=CHUNK_ROWS):
+    """Ghi dữ liệu đã cân bằng ra out (.csv hoặc .parquet). Trả về số dòng theo class"""
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    if out.suffix == ".parquet" and pq is None:
+        raise RuntimeError("Cần cài package 'pyarrow' để ghi Parquet (hoặc dùng --out *.csv)")
+    rng = np.random.default_rng(seed)
+    count, chunks = class_source(source, chunk_rows)
+
+    counts = {}
+    writer = schema = None
+    first = True
+    try:
+        for label in ["2xx", "3xx", "4xx", "5xx"]:
+            target_n = targets.get(label)
+            if not target_n:
+                continue
+            for chunk in build_block(chunks(label), count(label), label, target_n, rng, chunk_rows):
+                if pa is None:
+                    chunk.to_csv(out, index=False, header=first, mode="w" if first else "a")
+                else:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        # schema của chunk đầu dùng cho cả file (chunk sau cast theo)
+                        schema = table.schema
+                        writer = (pq.ParquetWriter if out.suffix == ".parquet" else pa_csv.CSVWriter)(
+                            str(out), schema
+                        )
+                    writer.write_table(table.cast(schema))
+                first = False
+                counts[label] = counts.get(label, 0) + len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return counts
+
 
-for label in ["2xx", "3xx", "4xx", "5xx"]:
-    target_n = TARGET_PER_CLASS.get(label)
-    if not target_n:
-        continue
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cân bằng số request theo status_type")
+    parser.add_argument("--source", choices=["csv", "dwh", "parquet"], default="csv",
+                        help="csv = data/dwh/dwh_requests.csv, dwh = mini_dwh.db, parquet = export Parquet")
+    parser.add_argument("--out", type=Path, default=OUT_CSV, help=".csv hoặc .parquet")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--target", type=int, default=None,
+                        help="cùng 1 target cho mọi class (mặc định theo TARGET_PER_CLASS)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="số dòng mỗi lần ghi")
+    args = parser.parse_args()
 
-    df_label = df[df["status_type"] == label]
-    block = build_block(df_label, label, target_n)
-    if block is not None:
-        blocks.append(block)
+    targets = {label: args.target for label in TARGET_PER_CLASS} if args.target else TARGET_PER_CLASS
 
-df_big = pd.concat(blocks, ignore_index=True)
-df_big.to_csv(OUT_CSV, index=False)
+    print("Đọc dữ liệu từ:", {"csv": IN_CSV, "dwh": etl.DB_PATH, "parquet": etl.PARQUET_DIR}[args.source])
+    t0 = time.perf_counter()
+    counts = augment(args.source, args.out, targets, args.seed, args.chunk_rows)
+    elapsed = time.perf_counter() - t0
+    total = sum(counts.values())
 
-print("\n✅ Đã lưu:", OUT_CSV)
-print("Số dòng:", len(df_big))
-print(df_big["status_type"].value_counts())
+    print("\n✅ Đã lưu:", args.out)
+    print("Số dòng:", total, f"({total / elapsed:,.0f} rows/s, {elapsed:.1f}s)")
+    for label, n in counts.items():
+        print(f"  {label}: {n}")
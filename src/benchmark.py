@@ -0,0 +1,344 @@
+"""Benchmark end-to-end pipeline: thời gian, rows/sec, peak RSS, kích thước DB theo stage.
+
+Mỗi scale (số dòng log) sinh 1 file log giả lập bằng synth_logs.py (có --bad-ratio
+dòng lỗi cho DQ), rồi với mỗi profile kết nối chạy lần lượt các stage:
+
+    generate -> init_db -> load_staging -> run_etl -> export_csv -> export_parquet
+    -> augment -> dashboard_dwh / dashboard_parquet / dashboard_csv -> end_to_end
+
+Mỗi stage chạy trong 1 process con riêng nên peak RSS (ru_maxrss) là của đúng
+stage đó; end_to_end chạy init + staging + ETL + export trong 1 process trên DB
+mới. Stage dashboard_* chạy app.py bằng streamlit.testing (không cần browser).
+Mọi file nằm trong --workdir (mặc định thư mục tạm), không đụng tới data/.
+
+Kết quả ghi ra JSON (--out); --compare so với 1 file kết quả cũ và thoát mã 1
+nếu có stage chậm / tốn RAM / DB lớn hơn baseline quá --tolerance.
+
+    python src/benchmark.py --scales 10k 100k 1M --bad-ratio 0.01 --out bench.json
+    python src/benchmark.py --scales 10k 100k 1M --compare bench.json
+    python src/benchmark.py --results new.json --compare bench.json   # chỉ so sánh
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+import etl
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+APP_PATH = BASE_DIR / "app.py"
+
+STAGES = [
+    "generate", "init_db", "load_staging", "run_etl", "export_csv", "export_parquet",
+    "augment", "dashboard_dwh", "dashboard_parquet", "dashboard_csv", "end_to_end",
+]
+# stage không phụ thuộc profile: chạy 1 lần mỗi scale
+SHARED_STAGES = {"generate"}
+DASHBOARD_SOURCES = {
+    "dashboard_dwh": "DWH (rollup)",
+    "dashboard_parquet": "Parquet export",
+    "dashboard_csv": "CSV export",
+}
+
+RESULT_PREFIX = "BENCH_RESULT "
+TOLERANCE = 0.2
+# chênh lệch tuyệt đối tối thiểu mới tính là regression (stage nhỏ dao động nhiều)
+MIN_DELTA = {"seconds": 0.25, "peak_rss_mb": 16, "db_mb": 1}
+
+
+def parse_count(text):
+    """'10k', '1M', '2.5m', '50000' -> số dòng"""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KM]?)", text.strip().upper())
+    if not m:
+        raise argparse.ArgumentTypeError(f"Số dòng không hợp lệ: {text}")
+    return int(float(m.group(1)) * 1000 ** " KM".index(m.group(2) or " "))
+
+
+# ============================
+# STAGE (chạy trong process con)
+# ============================
+
+def _count(table):
+    with sqlite3.connect(etl.DB_PATH) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def _run_dashboard(source):
+    """Chạy app.py với nguồn dữ liệu `source` (cwd = thư mục có data/dwh/...)"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=3600)
+    at.run()
+    if at.sidebar.radio[0].value != source:
+        at.sidebar.radio[0].set_value(source).run()
+    if at.exception:
+        raise RuntimeError(f"app.py lỗi với nguồn {source}: {at.exception[0].value}")
+
+
+def run_stage(stage, args):
+    """Chạy 1 stage, trả về số dòng stage đó xử lý (None = không áp dụng)"""
+    if stage == "generate":
+        import synth_logs
+
+        return synth_logs.generate(
+            args.input, args.rows, seed=args.seed, days=args.days, bad_ratio=args.bad_ratio,
+        )
+    if stage == "init_db":
+        etl.init_db(full_refresh=True)
+        return None
+    if stage == "load_staging":
+        etl.load_staging(args.input, profile=args.profile)
+        return _count("stg_logs")
+    if stage == "run_etl":
+        etl.run_etl(profile=args.profile)
+        return _count("stg_logs")
+    if stage == "export_csv":
+        etl.export_for_looker()
+        return _count("fact_requests")
+    if stage == "export_parquet":
+        etl.export_parquet(etl.PARQUET_DIR)  # default arg vẫn trỏ data/dwh thật
+        return _count("fact_requests")
+    if stage == "augment":
+        import augment_status
+
+        target = max(1, args.rows // 4)
+        counts = augment_status.augment(
+            "dwh", etl.DWH_DIR / augment_status.OUT_CSV.name,
+            {label: target for label in augment_status.TARGET_PER_CLASS}, args.seed,
+        )
+        return sum(counts.values())
+    if stage in DASHBOARD_SOURCES:
+        _run_dashboard(DASHBOARD_SOURCES[stage])
+        if stage == "dashboard_csv":
+            return sum(1 for _ in open(etl.DWH_DIR / "dwh_requests_balanced_big.csv", "rb")) - 1
+        return _count("fact_requests")
+    if stage == "end_to_end":
+        etl.init_db(full_refresh=True)
+        etl.load_staging(args.input, profile=args.profile)
+        etl.run_etl(profile=args.profile)
+        etl.export_for_looker()
+        etl.export_parquet(etl.PARQUET_DIR)  # default arg vẫn trỏ data/dwh thật
+        return _count("stg_logs")
+    raise ValueError(f"Stage không hợp lệ: {stage}")
+
+
+def stage_main(args):
+    """Entry point của process con: đo 1 stage, in 1 dòng BENCH_RESULT {json}"""
+    workdir = Path(args.workdir)
+    etl.DWH_DIR = workdir / "data" / "dwh"
+    etl.DB_PATH = etl.DWH_DIR / "mini_dwh.db"
+    etl.OUT_CSV = etl.DWH_DIR / "dwh_requests.csv"
+    etl.PARQUET_DIR = etl.DWH_DIR / "parquet" / "requests"
+    etl.DWH_DIR.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)  # app.py đọc data/dwh/... theo đường dẫn tương đối
+
+    t0 = time.perf_counter()
+    rows = run_stage(args.run_stage, args)
+    seconds = time.perf_counter() - t0
+    # Linux: ru_maxrss tính bằng KB
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(RESULT_PREFIX + json.dumps({"seconds": seconds, "rows": rows, "peak_rss_mb": peak_rss_mb}))
+
+
+# ============================
+# ĐIỀU PHỐI (process cha)
+# ============================
+
+def _stage_available(stage):
+    """Lý do bỏ qua stage nếu thiếu package tuỳ chọn, ngược lại None"""
+    if stage in ("export_parquet", "dashboard_parquet") and etl.pq is None:
+        return "chưa cài pyarrow"
+    if stage in DASHBOARD_SOURCES:
+        try:
+            import streamlit.testing.v1  # noqa: F401
+        except ImportError:
+            return "chưa cài streamlit"
+    return None
+
+
+def _db_mb(workdir):
+    dwh = Path(workdir) / "data" / "dwh"
+    files = [dwh / name for name in ("mini_dwh.db", "mini_dwh.db-wal")]
+    return sum(f.stat().st_size for f in files if f.exists()) / 1e6
+
+
+def spawn_stage(stage, workdir, input_path, rows, profile, args):
+    cmd = [
+        sys.executable, str(Path(__file__).resolve()), "--run-stage", stage,
+        "--workdir", str(workdir), "--input", str(input_path), "--rows", str(rows),
+        "--profile", profile, "--seed", str(args.seed), "--days", str(args.days),
+        "--bad-ratio", str(args.bad_ratio),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if args.verbose or proc.returncode:
+        sys.stdout.write(proc.stdout)
+        sys.stderr.write(proc.stderr)
+    if proc.returncode:
+        raise RuntimeError(f"Stage {stage} lỗi (mã {proc.returncode})")
+    line = next(line for line in reversed(proc.stdout.splitlines()) if line.startswith(RESULT_PREFIX))
+    return json.loads(line[len(RESULT_PREFIX):])
+
+
+def bench_scale(rows, args, root):
+    """Chạy mọi stage cho 1 scale, trả về list kết quả"""
+    scale_dir = Path(root) / f"rows_{rows}"
+    scale_dir.mkdir(parents=True, exist_ok=True)
+    input_path = scale_dir / "raw.csv"
+
+    results = []
+    for profile in args.profiles:
+        workdir = scale_dir / profile
+        for stage in args.stages:
+            if stage in SHARED_STAGES and profile != args.profiles[0]:
+                continue
+            reason = _stage_available(stage)
+            if reason:
+                print(f"  {stage:<18} bỏ qua ({reason})")
+                continue
+
+            r = spawn_stage(stage, workdir, input_path, rows, profile, args)
+            n = r["rows"]
+            entry = {
+                "scale": rows,
+                "bad_ratio": args.bad_ratio,
+                "profile": None if stage in SHARED_STAGES else profile,
+                "stage": stage,
+                "seconds": round(r["seconds"], 4),
+                "rows": n,
+                "rows_per_sec": round(n / r["seconds"]) if n and r["seconds"] > 0 else None,
+                "peak_rss_mb": round(r["peak_rss_mb"], 1),
+                "db_mb": None if stage in SHARED_STAGES else round(_db_mb(workdir), 2),
+            }
+            results.append(entry)
+            print(format_row(entry))
+    return results
+
+
+def format_row(r):
+    rps = f"{r['rows_per_sec']:,}" if r["rows_per_sec"] else "-"
+    db = f"{r['db_mb']:.1f}" if r["db_mb"] is not None else "-"
+    return (
+        f"  {r['stage']:<18}{r['profile'] or '-':<9}{r['seconds']:>9.2f}s{rps:>13}"
+        f"{r['peak_rss_mb']:>9.0f} MB{db:>9} MB"
+    )
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True,
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# ============================
+# SO SÁNH VỚI BASELINE
+# ============================
+
+def _key(r):
+    return r["scale"], r["bad_ratio"], r["profile"], r["stage"]
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """In bảng so sánh với baseline, trả về list regression (stage, metric, cũ, mới)"""
+    base = {_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nSo với baseline {baseline['meta'].get('timestamp')} "
+          f"(commit {baseline['meta'].get('git_commit')}), tolerance {tolerance:.0%}:")
+    for r in results:
+        b = base.get(_key(r))
+        if b is None:
+            continue
+        for metric, min_delta in MIN_DELTA.items():
+            old, new = b.get(metric), r.get(metric)
+            if not old or new is None:
+                continue
+            flag = new > old * (1 + tolerance) and new - old > min_delta
+            if flag:
+                regressions.append((r, metric, old, new))
+            if flag or metric == "seconds":
+                print(
+                    f"  {'REGRESSION' if flag else 'ok':<11}{r['scale']:>10,} {r['profile'] or '-':<9}"
+                    f"{r['stage']:<18}{metric:<12}{old:>10.2f} -> {new:>10.2f} ({new / old - 1:+.0%})"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end pipeline mini SIEM")
+    parser.add_argument("--scales", type=parse_count, nargs="+", default=[parse_count("10k")],
+                        help="số dòng log giả lập, VD 10k 100k 1M 10M")
+    parser.add_argument("--bad-ratio", type=float, default=0.01, help="tỉ lệ dòng lỗi cho DQ")
+    parser.add_argument("--days", type=float, default=1, help="số ngày log trải ra")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--profiles", nargs="+", choices=sorted(etl.PRAGMA_PROFILES), default=["default"])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES,
+                        help="stage sau cần output của stage trước (trừ generate / end_to_end)")
+    parser.add_argument("--workdir", type=Path, default=None,
+                        help="giữ file benchmark ở đây; mặc định thư mục tạm, xoá khi xong")
+    parser.add_argument("--out", type=Path, default=None, help="ghi kết quả ra file JSON")
+    parser.add_argument("--results", type=Path, default=None, help="đọc kết quả có sẵn thay vì chạy")
+    parser.add_argument("--compare", type=Path, default=None, help="file kết quả baseline để so sánh")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="VD 0.2 = chậm hơn 20%%")
+    parser.add_argument("-v", "--verbose", action="store_true", help="in output của từng stage")
+    # dùng nội bộ cho process con
+    parser.add_argument("--run-stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--input", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--profile", default="default", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        stage_main(args)
+        return
+
+    if args.results:
+        report = json.loads(args.results.read_text(encoding="utf-8"))
+    else:
+        report = {"meta": environment(), "results": []}
+        print(f"{'stage':<20}{'profile':<9}{'time':>10}{'rows/sec':>13}{'peak RSS':>12}{'DB':>12}")
+        if args.workdir:
+            args.workdir.mkdir(parents=True, exist_ok=True)
+        with nullcontext(args.workdir) if args.workdir else tempfile.TemporaryDirectory() as root:
+            for rows in args.scales:
+                print(f"\n{rows:,} dòng (bad_ratio {args.bad_ratio})")
+                report["results"] += bench_scale(rows, args, root)
+
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nĐã ghi kết quả: {args.out}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(report["results"], baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression so với baseline.")
+            sys.exit(1)
+        print("\nKhông có regression.")
+
+
+if __name__ == "__main__":
+    main()
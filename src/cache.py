@@ -0,0 +1,54 @@
+"""Cache LRU có giới hạn cho natural key của dimension.
+
+Log thật lặp lại rất nhiều trên 1 tập URL / status nhỏ: cache giữ kết quả parse
+và surrogate key của các key gặp gần đây, nên key lặp lại chỉ tốn 1 lần tra
+dict thay vì parse lại + truy vấn dim.
+"""
+from collections import OrderedDict
+
+CACHE_SIZE = 500_000
+
+
+class LRUCache:
+    """key -> value, bỏ key dùng lâu nhất khi vượt maxsize (None = không giới hạn)"""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """Đọc không tính hit/miss và không đổi thứ tự LRU"""
+        return self.data.get(key, default)
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if self.maxsize is not None and len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,138 @@
+"""Kiểm tra EXPLAIN QUERY PLAN của các query dashboard / điều tra trên DWH.
+
+Mỗi partition fact, rollup_minute_status, sketch_bucket và anomalies phải được đọc qua index
+(SEARCH ... USING INDEX hoặc SCAN ... USING COVERING INDEX); gặp "SCAN <bảng>" trơn
+(full scan) thì báo lỗi và thoát mã 1, để phát hiện khi sửa query hoặc schema làm
+mất index. tests/test_query_plans.py chạy check() này trong pytest.
+
+    python src/check_query_plans.py                  # schema.sql + 2 partition trên DB trong RAM
+    python src/check_query_plans.py --db data/dwh/mini_dwh.db
+"""
+import argparse
+import re
+import sqlite3
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+import etl
+from live_panels import FACT_ROWS_QUERY
+from partitions import FactPartitions, fact_source, refresh_view
+from queries import ANOMALY_QUERY, ATTACKS_QUERY, MINUTE_QUERY, RAW_QUERY
+from sketches import BUCKET_QUERY, EDGE_QUERY
+
+# SQL lấy thẳng từ queries.py / sketches.py / live_panels.py (cùng câu app.py chạy);
+# {source} từ partitions.fact_source, {marks} ứng với 2 status_type trong tham số.
+# Mốc thời gian LO / HI thay bằng khoảng 2 giờ quanh 0h của ngày mới nhất (xem sample_range)
+LO, HI = object(), object()
+FACT_PARAMS = (LO, HI, "4xx", "5xx")
+MINUTE_PARAMS = ("2025-11-25 23:00", "2025-11-26 01:00", "4xx", "5xx")
+
+QUERIES = {
+    "dashboard request theo phút (rollup)": (MINUTE_QUERY, MINUTE_PARAMS),
+    # top path / phân vị wait_ms: sketches.range_sketches
+    "dashboard sketch theo bucket": (BUCKET_QUERY, ("hour", "2025-11-25 23", "2025-11-26 01", "4xx", "5xx")),
+    "dashboard sketch phần phút lẻ": (EDGE_QUERY, FACT_PARAMS),
+    "dashboard tấn công theo phút": (ATTACKS_QUERY, FACT_PARAMS),
+    "dashboard raw rows": (RAW_QUERY, FACT_PARAMS),
+    "dashboard anomaly": (ANOMALY_QUERY, MINUTE_PARAMS),
+    "live panel fact sau watermark": (
+        FACT_ROWS_QUERY,
+        (0, 1_000_000),
+    ),
+    "điều tra request tới 1 path trong 1 giờ": (
+        "SELECT f.request_id, f.event_ms, u.url, s.status_code, f.wait_ms "
+        "FROM dim_url u "
+        "JOIN fact_requests f ON f.url_id = u.url_id "
+        "JOIN dim_status s ON f.status_id = s.status_id "
+        "WHERE u.path = ? AND f.time_id >= ? ORDER BY f.event_ms",
+        ("/.git/config", LO),
+    ),
+    # aggregate theo path trên cả lịch sử thì phải đọc hết; trên 1 partition phải
+    # đi bằng index (covering cho wait_ms)
+    "4xx theo path trong 1 partition": (
+        "SELECT u.path, COUNT(*) FROM {partition} f "
+        "JOIN dim_url u ON f.url_id = u.url_id JOIN dim_status s ON f.status_id = s.status_id "
+        "WHERE s.status_type = '4xx' GROUP BY u.path",
+        (),
+    ),
+    "wait theo path trong 1 partition": (
+        "SELECT u.path, COUNT(*), COUNT(f.wait_ms), TOTAL(f.wait_ms), MIN(f.wait_ms), MAX(f.wait_ms) "
+        "FROM {partition} f JOIN dim_url u ON f.url_id = u.url_id GROUP BY u.path",
+        (),
+    ),
+}
+
+# "SCAN fact_requests_YYYYMMDD" (hoặc alias f của 1 partition), rollup theo phút,
+# sketch_bucket hay anomalies không kèm USING ... INDEX = đọc toàn bộ bảng
+FULL_SCAN = re.compile(
+    r"^SCAN (f|fact_requests_\d{8}|rollup_minute_status|sketch_bucket|anomalies)\b(?!.*USING (COVERING )?INDEX)"
+)
+
+
+def query_plan(conn, sql, params):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def full_scans(plan):
+    """Các bước full scan partition; "SCAN f" trên kết quả UNION ALL đã materialize thì bỏ qua"""
+    subquery = any(step in ("MATERIALIZE f", "CO-ROUTINE f") for step in plan)
+    return [
+        step for step in plan
+        if FULL_SCAN.match(step) and not (subquery and step == "SCAN f")
+    ]
+
+
+def sample_range(conn):
+    """[lo, hi) time_id vắt qua 0h của ngày mới nhất: chạm 2 partition nếu có ngày trước đó"""
+    day = conn.execute("SELECT MAX(day) FROM fact_partitions WHERE dropped_at IS NULL").fetchone()[0] or 0
+    return day * 1440 - 60, day * 1440 + 60
+
+
+def check(conn, verbose=True):
+    """Trả về danh sách tên query có full scan (partition fact, rollup, sketch, anomaly)"""
+    lo, hi = sample_range(conn)
+    source = fact_source(conn, lo, hi)
+    partition = fact_source(conn, hi - 1, hi)
+    failed = []
+    for name, (sql, params) in QUERIES.items():
+        params = [lo if p is LO else hi if p is HI else p for p in params]
+        sql = sql.replace("{source}", source).replace("{partition}", partition).replace("{marks}", "?, ?")
+        plan = query_plan(conn, sql, params)
+        bad = bool(full_scans(plan))
+        if bad:
+            failed.append(name)
+        if verbose:
+            print(f"{'FAIL' if bad else 'ok  '} {name}")
+            for step in plan:
+                print(f"       {step}")
+    return failed
+
+
+def connect_schema():
+    """DB trong RAM có schema.sql và 2 partition (2 ngày liền nhau) 1 dòng, không cần DWH thật"""
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(Path(etl.SCHEMA_SQL).read_text(encoding="utf-8"))
+    refresh_view(conn)
+    minutes = [20417 * 1440, 20418 * 1440]
+    FactPartitions(conn.cursor()).insert(pd.DataFrame({
+        "event_ms": [m * 60_000 for m in minutes],
+        "time_id": minutes,
+        "url_id": 1, "status_id": 1, "method_id": 1, "mime_id": 1, "wait_ms": 1.0,
+    }))
+    return conn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kiểm tra query plan của fact_requests (không full scan)")
+    parser.add_argument("--db", type=Path, help="DWH cần kiểm tra; mặc định áp schema.sql lên DB trong RAM")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db) if args.db else connect_schema()
+    failed = check(conn)
+    conn.close()
+    if failed:
+        print(f"\n{len(failed)} query full scan fact_requests: {', '.join(failed)}")
+        sys.exit(1)
+    print("\nMọi query đều dùng index.")
@@ -0,0 +1,152 @@
+"""Thu thập traffic bất đồng bộ (asyncio + aiohttp), thay cho vòng lặp tuần tự
++ sleep cố định của shopee_logger / generate_logs.
+
+- Tối đa --concurrency request chạy cùng lúc, dùng chung 1 ClientSession nên
+  kết nối keep-alive được tái sử dụng.
+- Mỗi host có 1 token bucket (--rate request/giây, cho phép burst --burst)
+  thay cho sleep giữa 2 request.
+- wait_ms đo bằng time.perf_counter() từ lúc request thực sự được gửi (sau
+  khi lấy được slot và token) tới khi đọc xong body, nên không tính thời gian
+  xếp hàng.
+- Kết quả ghi qua LogSink (log_sink.py) vào data/raw/log_parsed.csv.
+
+    python src/collector.py --preset shopee --rounds 30 --concurrency 10 --rate 2
+    python src/collector.py --urls http://127.0.0.1:8000/ http://127.0.0.1:8000/404 --rounds 100
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:  # chỉ cần cho chế độ thu thập bất đồng bộ
+    aiohttp = None
+
+from log_sink import LOG_PATH, get_sink
+
+CONCURRENCY = 10
+RATE        = 2.0   # request / giây / host
+BURST       = 4
+TIMEOUT     = 8.0   # giây, toàn bộ request
+CONNECT_TIMEOUT = 3.0
+
+
+class TokenBucket:
+    """Giới hạn tốc độ: `rate` token/giây, tích tối đa `burst` token"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def fetch(session, url, bucket):
+    """Gửi 1 GET, trả về (status, mime, wait_ms) theo đúng quy ước của các logger cũ"""
+    await bucket.acquire()
+    start = time.perf_counter()
+    try:
+        async with session.get(url) as r:
+            await r.read()
+            status = r.status
+            mime = r.headers.get("Content-Type", "x-unknown")
+    except asyncio.TimeoutError:
+        status, mime = 0, "timeout"
+    except Exception as e:
+        status, mime = 0, f"error:{type(e).__name__}"
+    return status, mime, (time.perf_counter() - start) * 1000.0
+
+
+async def collect(urls, rounds=1, concurrency=CONCURRENCY, rate=RATE, burst=BURST,
+                  timeout=TIMEOUT, headers=None, sink=None):
+    """Gửi `rounds` lượt qua toàn bộ `urls`; trả về Counter theo status"""
+    if aiohttp is None:
+        raise RuntimeError("Cần cài package 'aiohttp' để chạy collector")
+    sink = sink or get_sink(LOG_PATH)
+    buckets = {}
+    statuses = Counter()
+    # hàng đợi có giới hạn: số job trong RAM không phụ thuộc rounds × số URL
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker(session):
+        while True:
+            url = await queue.get()
+            if url is None:
+                return
+            host = urlsplit(url).netloc
+            bucket = buckets.setdefault(host, TokenBucket(rate, burst))
+            status, mime, wait_ms = await fetch(session, url, bucket)
+            sink.write("GET", url, status, mime, wait_ms)
+            statuses[status] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout, connect=CONNECT_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout, headers=headers) as session:
+        workers = [asyncio.create_task(worker(session)) for _ in range(concurrency)]
+        for _ in range(rounds):
+            for url in urls:
+                await queue.put(url)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    return statuses
+
+
+def preset(name):
+    """(urls, headers) lấy từ script thu thập cũ"""
+    if name == "shopee":
+        import shopee_logger
+
+        headers = {
+            "User-Agent": shopee_logger.USER_AGENT,
+            "Accept": "text/html,application/json;q=0.9,*/*;q=0.8",
+            "Accept-Language": "vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7",
+        }
+        if shopee_logger.COOKIE_PATH.exists():
+            headers["Cookie"] = shopee_logger.load_cookie()
+        return shopee_logger.TARGET_URLS, headers
+
+    import generate_logs
+
+    return generate_logs.TARGET_URLS, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Thu thập traffic bất đồng bộ -> data/raw/log_parsed.csv")
+    parser.add_argument("--preset", choices=["shopee", "generate"], default="shopee", help="bộ URL có sẵn")
+    parser.add_argument("--urls", nargs="+", help="danh sách URL (thay cho --preset), VD stub server local")
+    parser.add_argument("--rounds", type=int, default=30, help="số lượt quét hết danh sách URL")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="số request đồng thời tối đa")
+    parser.add_argument("--rate", type=float, default=RATE, help="request / giây cho mỗi host")
+    parser.add_argument("--burst", type=int, default=BURST, help="số request dồn tối đa cho mỗi host")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT, help="timeout mỗi request (giây)")
+    parser.add_argument("--output", type=Path, default=LOG_PATH, help="file log CSV")
+    args = parser.parse_args()
+
+    urls, headers = (args.urls, None) if args.urls else preset(args.preset)
+    sink = get_sink(args.output)
+
+    started = time.perf_counter()
+    statuses = asyncio.run(collect(
+        urls, args.rounds, args.concurrency, args.rate, args.burst, args.timeout, headers, sink,
+    ))
+    sink.close()
+    elapsed = time.perf_counter() - started
+
+    total = sum(statuses.values())
+    print(f"Collected {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s) -> {args.output}")
+    for status, count in sorted(statuses.items()):
+        print(f"  {status:<5}{count}")
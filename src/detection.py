@@ -0,0 +1,109 @@
+"""Phát hiện tấn công theo signature trên URL.
+
+Mỗi URL distinct chỉ được phân loại 1 lần, lúc được thêm vào dim_url; kết quả
+lưu ở cột dim_url.attack_category ('none' nếu không khớp signature nào). Đếm
+tấn công theo phút vì vậy chỉ là 1 phép join fact -> dim_url.
+
+    python src/detection.py --reclassify   # chạy lại sau khi sửa SIGNATURES
+"""
+import argparse
+import html
+import re
+import sqlite3
+from urllib.parse import unquote_plus
+
+BENIGN = "none"
+
+# Thứ tự category = thứ tự ưu tiên khi hiển thị; pattern không dùng group có tên.
+SIGNATURES = {
+    "sqli": [
+        r"'\s*(?:or|and)\s+['\d\w]+\s*=\s*['\d\w]+",
+        r"\bunion(?:\s+all)?\s+select\b",
+        r"'\s*(?:--|#|/\*)",
+        r";\s*(?:drop|delete|insert|update)\s",
+        r"\b(?:sleep|benchmark|pg_sleep)\s*\(",
+        r"\binformation_schema\b",
+    ],
+    "xss": [
+        r"<\s*script\b",
+        r"javascript\s*:",
+        r"\bon(?:error|load|mouseover|focus|click)\s*=",
+        r"<\s*(?:svg|iframe|img|body)\b[^>]*",
+        r"\balert\s*\(",
+        r"document\.cookie",
+    ],
+    "lfi": [
+        r"(?:\.\./){2,}",
+        r"/etc/(?:passwd|shadow|hosts)",
+        r"/proc/self/",
+        r"\b(?:php|file|expect|data)://",
+        r"c:/windows/",
+    ],
+    "sensitive_file": [
+        r"/\.(?:git|svn|hg)(?:/|$)",
+        r"/\.(?:env|htaccess|htpasswd|ds_store)\b",
+        r"\.(?:bak|old|orig|swp|save)(?:$|\?)",
+        r"/(?:wp-config|config)\.php\b",
+        r"/\.ssh/",
+    ],
+    "admin_probe": [
+        r"/(?:admin|administrator|phpmyadmin|wp-admin|wp-login\.php|manager/html)(?:/|$|\?)",
+    ],
+}
+
+# 1 regex gộp cho mọi signature: mỗi category là 1 group có tên, match.lastgroup
+# cho biết category khớp -> mỗi URL chỉ quét 1 lần thay vì lặp qua từng regex.
+_MATCHER = re.compile(
+    "|".join(f"(?P<{cat}>{'|'.join(f'(?:{p})' for p in pats)})" for cat, pats in SIGNATURES.items()),
+    re.IGNORECASE,
+)
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_url(url):
+    """Giải mã URL (kể cả mã hoá 2–3 lớp), HTML entity, chuẩn hoá \\ -> / và khoảng trắng"""
+    prev = None
+    for _ in range(3):
+        if url == prev:
+            break
+        prev, url = url, unquote_plus(url)
+    url = html.unescape(url).replace("\x00", "").replace("\\", "/")
+    return _WS.sub(" ", url).lower()
+
+
+def classify_url(url):
+    """Trả về category tấn công đầu tiên khớp với URL, hoặc 'none'"""
+    if not isinstance(url, str):
+        return BENIGN
+    match = _MATCHER.search(normalize_url(url))
+    return match.lastgroup if match else BENIGN
+
+
+def classify_urls(conn, reclassify=False):
+    """Phân loại các dòng dim_url chưa có attack_category (hoặc tất cả nếu reclassify)"""
+    where = "" if reclassify else "WHERE attack_category IS NULL"
+    rows = conn.execute(f"SELECT url_id, url FROM dim_url {where}").fetchall()
+    conn.executemany(
+        "UPDATE dim_url SET attack_category = ? WHERE url_id = ?",
+        ((classify_url(url), url_id) for url_id, url in rows),
+    )
+    return len(rows)
+
+
+if __name__ == "__main__":
+    from etl import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Phân loại tấn công cho dim_url")
+    parser.add_argument("--reclassify", action="store_true", help="phân loại lại toàn bộ dim_url")
+    args = parser.parse_args()
+
+    with sqlite3.connect(DB_PATH) as conn:
+        n = classify_urls(conn, reclassify=args.reclassify)
+        summary = conn.execute(
+            "SELECT attack_category, COUNT(*) FROM dim_url GROUP BY 1 ORDER BY 2 DESC"
+        ).fetchall()
+
+    print(f"Classified {n} URL(s)")
+    for category, count in summary:
+        print(f"  {category:<15}{count}")
@@ -1,11 +1,38 @@
+import argparse
+import csv
+import gzip
+import io
+import itertools
 import os
+import shutil
 import sqlite3
+import uuid
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse
 
+import numpy as np
 import pandas as pd
 
+import instrument
+from anomaly import detect, load_detector, save_detector
+from cache import CACHE_SIZE, LRUCache
+from detection import classify_url, classify_urls
+from partitions import FactPartitions, create_all_indexes, fact_source, refresh_view
+from rollups import minute_key, rebuild_rollups, update_rollups
+from sketches import rebuild_sketches, update_sketches
+
+try:
+    import zstandard
+except ImportError:  # chỉ cần khi nạp log lưu trữ dạng .zst
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # chỉ cần khi export Parquet
+    pa = pq = None
+
 # ==== PATH CONFIG ====
 BASE_DIR   = Path(__file__).resolve().parent.parent
 DATA_DIR   = BASE_DIR / "data"
@@ -16,6 +43,7 @@ CSV_PATH   = RAW_DIR / "log_parsed.csv"
 DB_PATH    = DWH_DIR / "mini_dwh.db"
 SCHEMA_SQL = BASE_DIR / "src" / "schema.sql"
 OUT_CSV    = DWH_DIR / "dwh_requests.csv"
+PROFILE_DIR = DWH_DIR / "profiles"
 
 
 # ==== HELPER ====
@@ -25,178 +53,1018 @@ def init_dirs():
     DWH_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def init_db():
-    """Tạo DB mới và apply schema.sql"""
-    if DB_PATH.exists():
-        DB_PATH.unlink()
+# ==== CONNECTION PROFILE ====
+# "bulk": bỏ journaling/fsync, cache + mmap lớn để nạp nhanh; chỉ dùng khi
+# có thể chạy lại ETL nếu máy sập giữa chừng. "default": setting an toàn của SQLite.
+PRAGMA_PROFILES = {
+    "default": {},
+    "bulk": {
+        "journal_mode": "OFF",
+        "synchronous": "OFF",
+        "cache_size": -262144,       # KiB -> 256 MB
+        "temp_store": "MEMORY",
+        "mmap_size": 1 << 30,
+    },
+}
+
+SAFE_PRAGMAS = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+}
+
+
+def connect(profile="default"):
+    conn = instrument.connect(DB_PATH)
+    for name, value in PRAGMA_PROFILES[profile].items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def drop_indexes(conn):
+    """Drop các index đặt tên (ux_/ix_) trước khi bulk load, trả về SQL để build lại"""
+    rows = [
+        (name, sql)
+        for name, sql in conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+        )
+        if name.startswith(("ux_", "ix_"))
+    ]
+    for name, _ in rows:
+        conn.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in rows]
+
+
+def finish_bulk_load(conn, index_sql):
+    """Build lại index sau khi nạp fact, ANALYZE rồi trả connection về setting an toàn"""
+    for sql in index_sql:
+        conn.execute(sql)
+    create_all_indexes(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+    for name, value in SAFE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
 
+
+def get_meta(conn, key, default=None):
+    row = conn.execute("SELECT value FROM etl_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_meta(conn, key, value):
+    conn.execute(
+        "INSERT INTO etl_meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, str(value)),
+    )
+
+
+def raw_meta_key(conn, kind, path):
+    """Khoá etl_meta cho watermark của 1 file log thô (VD raw_offset), theo đường dẫn
+    tuyệt đối: 2 file cùng tên ở 2 thư mục không dùng chung offset.
+
+    DWH cũ lưu khoá theo tên file: khoá đó được chuyển sang file đầu tiên dùng tới.
+    """
+    key = f"{kind}:{Path(path).resolve()}"
+    if get_meta(conn, key) is None:
+        conn.execute("UPDATE etl_meta SET key = ? WHERE key = ?", (key, f"{kind}:{Path(path).name}"))
+    return key
+
+
+def bump_load_version(conn):
+    """Tăng load_version sau mỗi lần nạp có dữ liệu mới (dashboard dùng làm khoá cache)"""
+    set_meta(conn, "load_version", int(get_meta(conn, "load_version", 0)) + 1)
+
+
+def _has_watermark():
+    """DWH hiện tại có high-water mark để chạy incremental hay không"""
+    if not DB_PATH.exists():
+        return False
     with sqlite3.connect(DB_PATH) as conn:
+        try:
+            return get_meta(conn, "last_stg_row_id") is not None
+        except sqlite3.OperationalError:
+            # DWH cũ, chưa có bảng etl_meta
+            return False
+
+
+def _outdated_schema():
+    """DWH tạo từ schema trước khi fact chia partition (fact_requests còn là 1 bảng)"""
+    if not DB_PATH.exists():
+        return False
+    with sqlite3.connect(DB_PATH) as conn:
+        row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'fact_requests'").fetchone()
+    return row is not None and row[0] == "table"
+
+
+def _ensure_column(conn, table, column, decl):
+    """Thêm cột mới vào bảng của DWH tạo từ schema cũ (CREATE IF NOT EXISTS không làm)"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def init_db(full_refresh=False):
+    """Apply schema.sql; full_refresh (hoặc DWH chưa có watermark) thì tạo DB mới"""
+    if not full_refresh and not _has_watermark():
+        print("DWH chưa có high-water mark -> chạy full refresh.")
+        full_refresh = True
+    elif not full_refresh and _outdated_schema():
+        print("DWH dùng schema cũ (fact chưa chia partition) -> chạy full refresh.")
+        full_refresh = True
+
+    if full_refresh and DB_PATH.exists():
+        DB_PATH.unlink()
+
+    with instrument.connect(DB_PATH) as conn:
         with open(SCHEMA_SQL, "r", encoding="utf-8") as f:
             conn.executescript(f.read())
+        refresh_view(conn)
+
+        _ensure_column(conn, "dim_url", "attack_category", "TEXT")
+        _ensure_column(conn, "fact_partitions", "compacted_rows", "INTEGER DEFAULT 0")
+        classify_urls(conn)
+        # đổi mỗi khi DB được tạo lại: dashboard live biết phải khởi tạo lại state
+        conn.execute("INSERT OR IGNORE INTO etl_meta (key, value) VALUES ('dwh_id', ?)", (uuid.uuid4().hex,))
+
+        # DWH tạo trước khi có rollup: tính bù 1 lần từ fact hiện có
+        has_facts = conn.execute("SELECT 1 FROM fact_requests LIMIT 1").fetchone()
+        has_rollup = conn.execute("SELECT 1 FROM rollup_minute_status LIMIT 1").fetchone()
+        if has_facts and not has_rollup:
+            rebuild_rollups(conn)
+        # tương tự cho sketch (DWH tạo trước khi có sketch_bucket)
+        has_sketch = conn.execute("SELECT 1 FROM sketch_bucket LIMIT 1").fetchone()
+        if has_facts and not has_sketch:
+            rebuild_sketches(conn)
         conn.commit()
 
 
-def load_staging():
-    """Nạp CSV vào bảng stg_logs"""
-    df = pd.read_csv(CSV_PATH)
+RAW_COLUMNS = ["time", "method", "url", "status", "mimeType", "wait_ms"]
 
-    with sqlite3.connect(DB_PATH) as conn:
-        df.to_sql("stg_logs", conn, if_exists="append", index=False)
+# status / wait_ms giữ dạng chuỗi để DQ còn thấy giá trị gốc (cột INTEGER tự ép
+# "200" -> 200); wait_ms là số được đổi sang float lúc staging (stage_chunks)
+STG_DTYPES = {
+    "time": "string",
+    "method": "string",
+    "url": "string",
+    "status": "string",
+    "mimeType": "string",
+    "wait_ms": "string",
+}
+STAGING_CHUNK_SIZE = 200_000
 
 
-def run_etl():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+def _open_raw(path):
+    """Mở log thô ở dạng nhị phân: .csv, .csv.gz hoặc .csv.zst"""
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError("Cần cài package 'zstandard' để đọc log .zst")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.BufferedReader(reader)
+    return open(path, "rb")
+
+
+class _CompleteLines(io.RawIOBase):
+    """Bọc 1 stream nhị phân, chỉ trả về các dòng hoàn chỉnh.
+
+    Phần sau ký tự xuống dòng cuối cùng (dòng đang được logger ghi dở) bị giữ
+    lại; `consumed` là số byte đã trả ra, dùng để cập nhật high-water mark.
+    """
+
+    def __init__(self, raw, block_size=1 << 20):
+        self.raw = raw
+        self.block_size = block_size
+        self.ready = b""
+        self.pending = b""
+        self.consumed = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self.ready:
+            block = self.raw.read(self.block_size)
+            if not block:
+                return 0
+            self.pending += block
+            cut = self.pending.rfind(b"\n") + 1
+            self.ready, self.pending = self.pending[:cut], self.pending[cut:]
+
+        n = min(len(buf), len(self.ready))
+        buf[:n] = self.ready[:n]
+        self.ready = self.ready[n:]
+        self.consumed += n
+        return n
+
+
+def _seek_forward(raw, offset):
+    """Nhảy tới offset (tính trên dữ liệu đã giải nén); stream zstd chỉ đọc bỏ qua được"""
+    if raw.seekable():
+        raw.seek(offset)
+        return
+    remaining = offset - raw.tell()
+    while remaining > 0:
+        block = raw.read(min(remaining, 1 << 20))
+        if not block:
+            break
+        remaining -= len(block)
+
+
+def _read_tolerant(stream, names, chunksize):
+    """Đọc CSV bằng module csv: dòng thiếu field được bù NA, dòng thừa field gộp
+    phần thừa vào field cuối (wait_ms -> DQ báo invalid_wait), không raise"""
+    n = len(names)
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline=""))
+    while True:
+        rows = []
+        for fields in itertools.islice(reader, chunksize):
+            if not fields:
+                continue  # dòng trống: read_csv cũng bỏ qua
+            if len(fields) > n:
+                fields = fields[:n - 1] + [",".join(fields[n - 1:])]
+            rows.append([value or None for value in fields] + [None] * (n - len(fields)))
+        if not rows:
+            return
+        yield pd.DataFrame(rows, columns=names).astype({c: STG_DTYPES.get(c, "string") for c in names})
+
+
+def read_raw_csv(stream, names, chunksize=STAGING_CHUNK_SIZE, tolerant=False):
+    """Đọc log thô theo chunk. tolerant: dòng sai số field vẫn được nạp (để DQ ghi
+    vào dq_issues) thay vì raise; chậm hơn parser C nên chỉ dùng cho micro-batch"""
+    if tolerant:
+        return _read_tolerant(stream, names, chunksize)
+    return pd.read_csv(stream, header=None, names=names, dtype=STG_DTYPES, chunksize=chunksize)
+
+
+def stage_chunks(conn, chunks):
+    """Insert các chunk CSV thô vào stg_logs bằng executemany, trả về số dòng"""
+    n_rows = 0
+    for chunk in chunks:
+        chunk = chunk[RAW_COLUMNS].astype(object)
+        # wait_ms không phải số giữ nguyên chuỗi gốc để DQ báo invalid_wait
+        wait = pd.to_numeric(chunk["wait_ms"], errors="coerce")
+        chunk["wait_ms"] = wait.astype(object).where(wait.notna(), chunk["wait_ms"])
+        chunk = chunk.where(chunk.notna(), None)
+        with instrument.timer("stg_insert"):
+            conn.executemany(
+                f"INSERT INTO stg_logs ({', '.join(RAW_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(RAW_COLUMNS))})",
+                chunk.itertuples(index=False, name=None),
+            )
+        n_rows += len(chunk)
+    instrument.count("staged", n_rows)
+    return n_rows
+
+
+def load_staging(csv_path=CSV_PATH, chunksize=STAGING_CHUNK_SIZE, profile="default"):
+    """Nạp phần mới của log thô (sau high-water mark) vào stg_logs theo từng chunk.
+
+    Mỗi chunk được insert bằng executemany trong cùng 1 transaction, nên bộ
+    nhớ chỉ phụ thuộc chunksize chứ không phụ thuộc kích thước file.
+    """
+    with connect(profile) as conn, _open_raw(csv_path) as raw:
+        offset_key = raw_meta_key(conn, "raw_offset", csv_path)
+        offset = int(get_meta(conn, offset_key, 0))
+        header = raw.readline()
+        names = header.decode("utf-8").strip().split(",")
+
+        if Path(csv_path).suffix not in (".gz", ".zst") and os.path.getsize(csv_path) < offset:
+            # file bị truncate / thay file mới -> đọc lại từ đầu
+            offset = 0
+        offset = max(offset, len(header))
+        _seek_forward(raw, offset)
+
+        lines = _CompleteLines(raw)
+        reader = read_raw_csv(io.BufferedReader(lines), names, chunksize)
+        n_rows = stage_chunks(conn, reader)
+        set_meta(conn, offset_key, offset + lines.consumed)
+
+    print(f"Staged {n_rows} new rows from {csv_path}")
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _event_ms(ts):
+    """ts -> (epoch milliseconds UTC,), None nếu không parse được; ts không có múi giờ coi là UTC"""
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return ((dt - EPOCH) // timedelta(milliseconds=1),)
+
+
+def _url_attrs(url):
+    """url -> (domain, path, query) cho dim_url, None nếu urlparse lỗi"""
+    try:
+        p = urlparse(url)
+    except Exception:
+        return None
+    return p.netloc, p.path, p.query
+
+
+def _status_attrs(status):
+    status_type = f"{str(status)[0]}xx" if 100 <= status <= 599 else "other"
+    return (status_type,)
+
+
+def _no_attrs(value):
+    return ()
+
+
+class TimeDim:
+    """dim_time theo phút. time_id chính là epoch minute nên tính thẳng từ
+    event_ms, không cần map key -> id; chỉ phải insert các phút chưa có."""
+
+    def __init__(self, cur, cache_size=CACHE_SIZE):
+        self.cur = cur
+        self.cache = LRUCache(cache_size)   # các phút đã chắc chắn có trong dim_time
+        self.db_lookups = 0
+        self.inserted = 0
+
+    def resolve(self, minutes):
+        """Đảm bảo dim_time có đủ các phút (Series epoch minute), trả về chính minutes"""
+        new = [m for m in pd.unique(minutes).tolist() if self.cache.get(m) is None]
+        if new:
+            labels = pd.to_datetime(np.asarray(new, dtype="int64"), unit="m")
+            # phút bị đẩy khỏi cache có thể đã có trong bảng -> OR IGNORE theo khoá chính
+            self.cur.executemany(
+                "INSERT OR IGNORE INTO dim_time (time_id, minute_ts, date, hour, minute) "
+                "VALUES (?, ?, ?, ?, ?)",
+                zip(
+                    new,
+                    labels.strftime("%Y-%m-%d %H:%M"),
+                    labels.strftime("%Y-%m-%d"),
+                    labels.hour.tolist(),
+                    labels.minute.tolist(),
+                ),
+            )
+            self.inserted += max(self.cur.rowcount, 0)
+            for m in new:
+                self.cache.put(m, True)
+        return minutes
+
+
+# entry trong cache của dimension: [parts, id, extras]; parts = _UNPARSED khi
+# key được nạp từ bảng dim chứ chưa qua bước parse của DQ
+_UNPARSED = object()
+
+
+class DimResolver:
+    """Map natural key -> surrogate key của 1 dimension, nạp theo lô.
+
+    Key mới được cấp id tăng dần theo thứ tự xuất hiện đầu tiên và insert
+    bằng 1 lần executemany, thay cho INSERT OR IGNORE + SELECT trên từng dòng.
+    Map nằm trong 1 LRUCache có giới hạn (`cache`, dùng chung với bước parse
+    của DQ); key đã bị đẩy khỏi cache được tra lại trong bảng dim theo lô.
+    """
+
+    def __init__(self, cur, table, id_col, key_col, attr_cols, build, extra=None, cache_size=CACHE_SIZE):
+        """extra: dict {tên cột: hàm key -> giá trị} chỉ tính cho key mới, VD phân loại tấn công.
+        cache_size=None: không giới hạn (bulk load khi index dim đã bị drop)."""
+        self.cur = cur
+        self.table = table
+        self.key_col = key_col
+        self.columns = (id_col, key_col, *attr_cols, *(extra or {}))
+        self.select = ", ".join((key_col, id_col, *(extra or {})))
+        self.build = build
+        self.extra_cols = list(extra or {})
+        self.extra = list((extra or {}).values())
+        self.cache = LRUCache(cache_size)
+        self.db_lookups = 0    # số key phải tra lại bảng dim vì không có trong cache
+        self.inserted = 0      # số key mới đã insert vào dim
+
+        n_rows, max_id = cur.execute(f"SELECT COUNT(*), MAX({id_col}) FROM {table}").fetchone()
+        self.next_id = (max_id or 0) + 1
+        # dim vừa cache: nạp hết; khi cache chưa bỏ key nào thì key không có id
+        # trong cache chắc chắn là key mới, khỏi tra bảng
+        self.preloaded = cache_size is None or n_rows <= cache_size
+        if self.preloaded:
+            for key, id_, *extras in cur.execute(f"SELECT {self.select} FROM {table}"):
+                self.cache.put(key, [_UNPARSED, id_, tuple(extras)])
+
+    @property
+    def complete(self):
+        return self.preloaded and self.cache.evictions == 0
+
+    def _lookup(self, keys):
+        """Tra id (và cột extra) của các key không có trong cache, theo lô 500 key"""
+        self.db_lookups += len(keys)
+        for lo in range(0, len(keys), 500):
+            batch = list(keys[lo:lo + 500])
+            rows = self.cur.execute(
+                f"SELECT {self.select} FROM {self.table} "
+                f"WHERE {self.key_col} IN ({', '.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            for key, id_, *extras in rows:
+                self._remember(key, id_, tuple(extras))
+
+    def _remember(self, key, id_, extras):
+        entry = self.cache.data.get(key)
+        if entry is None:
+            self.cache.put(key, [_UNPARSED, id_, extras])
+        else:
+            entry[1], entry[2] = id_, extras
+
+    def _ids(self, uniq):
+        """id trong cache của từng key (NaN nếu chưa có).
+
+        Hit = key đã có id; entry chỉ có kết quả parse (id None) tính là miss.
+        Key hit được đẩy lên cuối để LRU bỏ key dùng lâu nhất chứ không phải
+        key nạp sớm nhất.
+        """
+        cache = self.cache
+        ids = np.full(len(uniq), np.nan)
+        for i, key in enumerate(uniq):
+            entry = cache.data.get(key)
+            if entry is None or entry[1] is None:
+                cache.misses += 1
+            else:
+                cache.data.move_to_end(key)
+                cache.hits += 1
+                ids[i] = entry[1]
+        return ids
+
+    def resolve(self, keys, attrs=None):
+        """Cấp id cho các key chưa có trong dim, trả về Series id khớp index của keys.
+
+        attrs: DataFrame thuộc tính đã tính sẵn (cùng index với keys); nếu
+        không có thì gọi build() cho từng key mới. Key lỗi (build trả None hoặc
+        thuộc tính có None) -> id NaN.
+        """
+        codes, uniq = pd.factorize(keys)
+        uniq = np.asarray(uniq, dtype=object)
+        ids = self._ids(uniq)
+        missing = np.flatnonzero(np.isnan(ids))
+
+        if len(missing) and not self.complete:
+            self._lookup(uniq[missing])
+            ids[missing] = [
+                np.nan if (e := self.cache.peek(k)) is None or e[1] is None else e[1]
+                for k in uniq[missing]
+            ]
+            missing = np.flatnonzero(np.isnan(ids))
+
+        if len(missing):
+            if attrs is None:
+                built = [self.build(uniq[i]) for i in missing]
+            else:
+                # thuộc tính lấy từ dòng xuất hiện đầu tiên của mỗi key mới
+                _, first_pos = np.unique(codes, return_index=True)
+                rows = attrs.iloc[first_pos[missing]].astype(object)
+                built = list(rows.itertuples(index=False, name=None))
+
+            new_rows = []
+            for i, values in zip(missing, built):
+                if values is None or None in values:
+                    continue
+                key = uniq[i]
+                ids[i] = self.next_id
+                extras = tuple(f(key) for f in self.extra)
+                self._remember(key, self.next_id, extras)
+                new_rows.append((self.next_id, key, *values, *extras))
+                self.next_id += 1
+
+            if new_rows:
+                placeholders = ", ".join("?" * len(self.columns))
+                self.cur.executemany(
+                    f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES ({placeholders})",
+                    new_rows,
+                )
+                self.inserted += len(new_rows)
+
+        return pd.Series(ids[codes], index=keys.index)
 
-    cur.execute("SELECT row_id, time, method, url, status, mimeType, wait_ms FROM stg_logs")
-    rows = cur.fetchall()
+    def extra_values(self, keys, column):
+        """Giá trị cột extra cho các key vừa resolve (VD attack_category của URL)"""
+        pos = self.extra_cols.index(column)
+        codes, uniq = pd.factorize(keys)
+        missing = [k for k in uniq if (e := self.cache.peek(k)) is None or e[2] is None]
+        if missing:
+            self._lookup(np.asarray(missing, dtype=object))
+        values = [
+            None if (e := self.cache.peek(k)) is None or e[2] is None else e[2][pos]
+            for k in uniq
+        ]
+        return np.asarray(values + [None], dtype=object)[codes]
 
-    def record_issue(stg_row_id, issue_type, detail):
-        cur.execute(
+
+# ==== DATA QUALITY ====
+
+STG_COLUMNS    = ["row_id", "time", "method", "url", "status", "mimeType", "wait_ms"]
+ETL_CHUNK_SIZE = 100_000
+
+DQ_RULES = []
+
+
+def dq_rule(func):
+    """Đăng ký 1 rule DQ.
+
+    Rule nhận 1 chunk staging (đã qua _parse_chunk) và yield các bộ
+    (issue_type, mask, detail): mask là Series bool các dòng lỗi, detail là
+    chuỗi cố định hoặc Series chỉ chứa các dòng lỗi.
+    """
+    DQ_RULES.append(func)
+    return func
+
+
+def _cached_parse(func, value, cache):
+    entry = cache.get(value)
+    if entry is None:
+        parts = func(value)
+        cache.put(value, [parts, None, None])
+    elif entry[0] is _UNPARSED:
+        parts = entry[0] = func(value)
+    else:
+        parts = entry[0]
+    return parts
+
+
+def _map_distinct(values, func, columns, cache=None):
+    """Gọi func đúng 1 lần cho mỗi giá trị distinct rồi trải kết quả ra theo dòng.
+
+    cache: LRUCache của dimension tương ứng; giá trị đã parse ở chunk trước
+    chỉ tốn 1 lần tra dict.
+    """
+    codes, uniq = pd.factorize(values)
+    uniq = np.asarray(uniq, dtype=object)
+    if cache is None:
+        results = [func(v) for v in uniq]
+    else:
+        results = [_cached_parse(func, v, cache) for v in uniq]
+    # thêm 1 dòng rỗng ở cuối: code -1 (giá trị NA) sẽ trỏ vào dòng này
+    results.append(None)
+    lookup = pd.DataFrame(
+        [r if r is not None else (None,) * len(columns) for r in results],
+        columns=columns,
+        dtype=object,
+    )
+    return lookup.iloc[codes].set_index(values.index)
+
+
+# Định dạng logger ghi ra ('YYYY-MM-DDTHH:MM:SS[.fff|.ffffff][Z]'): parse được
+# bằng pd.to_datetime vector hoá, kết quả giống hệt _event_ms.
+LOG_TS_PATTERN = r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:[0-5]\d(?:\.\d{3}|\.\d{6})?Z?"
+
+
+def _map_time(ts):
+    """Series event_ms (Int64, NA nếu không parse được) cho mỗi dòng.
+
+    Timestamp đúng định dạng log parse vector hoá, chỉ timestamp lạ mới gọi
+    _event_ms cho từng giá trị distinct.
+    """
+    fast = ts.str.fullmatch(LOG_TS_PATTERN).fillna(False).astype(bool)
+    dt = pd.to_datetime(ts[fast], format="ISO8601", utc=True, errors="coerce")
+    fast_ms = (dt - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(milliseconds=1)
+    other_ms = _map_distinct(ts[~fast], _event_ms, ["event_ms"])["event_ms"]
+    return pd.concat([fast_ms.astype("Int64"), other_ms.astype("Int64")]).reindex(ts.index)
+
+
+def _to_int(status):
+    try:
+        return (int(status),)
+    except Exception:
+        return None
+
+
+URL_PARTS  = ["url_domain", "url_path", "url_query"]
+
+
+def _parse_chunk(chunk, caches=None):
+    """Parse time/url/status 1 lần cho mỗi giá trị distinct; kết quả dùng lại cho dim"""
+    caches = caches or {}
+    chunk = chunk.assign(time=chunk["time"].astype("string"), url=chunk["url"].astype("string"))
+    event_ms = _map_time(chunk["time"]).rename("event_ms")
+    url_parts = _map_distinct(chunk["url"], _url_attrs, URL_PARTS, caches.get("url"))
+    codes = _map_distinct(chunk["status"], _to_int, ["status_code"], caches.get("status"))
+    return pd.concat([chunk, event_ms, url_parts, codes], axis=1)
+
+
+@dq_rule
+def check_time(chunk):
+    ts = chunk["time"]
+    missing = ts.str.strip().eq("").fillna(True)
+    yield "missing_time", missing, "Empty timestamp"
+
+    invalid = ~missing & chunk["event_ms"].isna()
+    yield "invalid_time", invalid, "Unparseable time: " + ts[invalid]
+
+
+@dq_rule
+def check_url(chunk):
+    url = chunk["url"]
+    bad = ~url.str.startswith("http").fillna(False)
+    yield "invalid_url", bad, "Bad url: " + url[bad].fillna("None")
+
+
+@dq_rule
+def check_status(chunk):
+    code = chunk["status_code"]
+    not_int = code.isna()
+    yield "invalid_status", not_int, "Not int: " + chunk.loc[not_int, "status"].map(str)
+
+    out_of_range = ~not_int & ~pd.to_numeric(code).between(100, 599)
+    yield "invalid_status", out_of_range, "Out of range: " + code[out_of_range].map(str)
+
+
+@dq_rule
+def check_wait(chunk):
+    wait = chunk["wait_ms"]
+    invalid = wait.notna() & pd.to_numeric(wait, errors="coerce").isna()
+    yield "invalid_wait", invalid, "Not numeric: " + wait[invalid].map(str)
+
+
+def run_dq(chunk, caches=None):
+    """Chạy toàn bộ DQ_RULES trên 1 chunk staging.
+
+    Trả về (clean, issues): clean là các dòng sạch kèm cột đã parse, issues là
+    DataFrame (stg_row_id, issue_type, detail) theo thứ tự dòng rồi thứ tự rule.
+    caches: {"url" | "status": LRUCache} dùng lại kết quả parse giữa các chunk.
+    """
+    chunk = _parse_chunk(chunk, caches)
+    bad = pd.Series(False, index=chunk.index)
+    frames = []
+
+    for rule in DQ_RULES:
+        for issue_type, mask, detail in rule(chunk):
+            mask = mask.fillna(False).astype(bool)
+            if not mask.any():
+                continue
+            bad |= mask
+            frames.append(pd.DataFrame({
+                "stg_row_id": chunk.loc[mask, "row_id"],
+                "issue_type": issue_type,
+                "detail": detail,
+                "rule_order": len(frames),
+            }))
+
+    issues = _sort_issues(frames)
+    return chunk[~bad], issues
+
+
+def _sort_issues(frames):
+    if not frames:
+        return pd.DataFrame(columns=["stg_row_id", "issue_type", "detail"])
+    issues = pd.concat(frames, ignore_index=True)
+    issues = issues.sort_values(["stg_row_id", "rule_order"], kind="stable")
+    return issues[["stg_row_id", "issue_type", "detail"]]
+
+
+# ==== ETL ====
+
+def load_chunk(cur, dims, facts, clean, issues, detector=None):
+    """Ghi 1 chunk đã qua DQ: dimension, fact và dq_issues. Trả về số dòng fact.
+
+    facts: FactPartitions (partitions.py) ghi fact vào partition theo ngày.
+
+    detector: AnomalyDetector (anomaly.py) nhận số request của các fact vừa nạp.
+    """
+    event_ms = clean["event_ms"].astype("int64")
+    with instrument.timer("dim.time"):
+        time_id = dims["time"].resolve(event_ms // 60_000)
+    with instrument.timer("dim.url"):
+        url_id = dims["url"].resolve(clean["url"], clean[URL_PARTS])
+    with instrument.timer("dim.status"):
+        status_id = dims["status"].resolve(clean["status_code"])
+    # method / mime thiếu vẫn nạp fact, id để NULL
+    with instrument.timer("dim.method"):
+        method_id = dims["method"].resolve(clean["method"].dropna()).reindex(clean.index)
+    with instrument.timer("dim.mime"):
+        mime_id = dims["mime"].resolve(clean["mimeType"].dropna()).reindex(clean.index)
+
+    ok = url_id.notna() & status_id.notna()
+    if not ok.all():
+        dim_errors = pd.DataFrame({
+            "stg_row_id": clean.loc[~ok, "row_id"],
+            "issue_type": "dim_error",
+            "detail": "Could not get dim IDs",
+            "rule_order": 0,
+        })
+        issues = _sort_issues([issues.assign(rule_order=0), dim_errors])
+
+    rows = pd.DataFrame({
+        "event_ms": event_ms[ok],
+        "time_id": time_id[ok],
+        "url_id": url_id[ok].astype("int64"),
+        "status_id": status_id[ok].astype("int64"),
+        "method_id": method_id[ok].astype("Int64"),
+        "mime_id": mime_id[ok].astype("Int64"),
+        "wait_ms": clean.loc[ok, "wait_ms"].astype("float64"),
+    })
+    with instrument.timer("fact_insert"):
+        facts.insert(rows)
+    with instrument.timer("dq_insert"):
+        cur.executemany(
             "INSERT INTO dq_issues (stg_row_id, issue_type, detail) VALUES (?, ?, ?)",
-            (stg_row_id, issue_type, detail),
+            issues.itertuples(index=False, name=None),
         )
+    instrument.count_values("dq", issues["issue_type"])
 
-    def get_or_create_dim_time(ts: str):
-        try:
-            dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
-        except Exception:
-            return None
-        date_str = dt.date().isoformat()
-        hour = dt.hour
-        minute = dt.minute
-
-        cur.execute(
-            "INSERT OR IGNORE INTO dim_time (ts, date, hour, minute) VALUES (?, ?, ?, ?)",
-            (ts, date_str, hour, minute),
-        )
-        cur.execute("SELECT time_id FROM dim_time WHERE ts = ?", (ts,))
-        row = cur.fetchone()
-        return row[0] if row else None
+    loaded = clean[ok]
+    with instrument.timer("rollups"):
+        minute = minute_key(time_id[ok])
+        status_type = (loaded["status_code"].astype(int) // 100).astype(str) + "xx"
+        rollup_facts = pd.DataFrame({
+            "minute": minute,
+            "status_type": status_type,
+            "path": loaded["url_path"],
+            "wait_ms": loaded["wait_ms"].astype("float64"),
+        })
+        update_rollups(cur, rollup_facts)
+    with instrument.timer("sketches"):
+        update_sketches(cur, rollup_facts)
 
-    def get_or_create_dim_url(url: str):
-        try:
-            p = urlparse(url)
-        except Exception:
-            return None
-        cur.execute(
-            "INSERT OR IGNORE INTO dim_url (url, domain, path, query) VALUES (?, ?, ?, ?)",
-            (url, p.netloc, p.path, p.query),
-        )
-        cur.execute("SELECT url_id FROM dim_url WHERE url = ?", (url,))
-        row = cur.fetchone()
-        return row[0] if row else None
-
-    def get_or_create_dim_status(status: int):
-        status_type = f"{str(status)[0]}xx" if 100 <= status <= 599 else "other"
-        cur.execute(
-            "INSERT OR IGNORE INTO dim_status (status_code, status_type) VALUES (?, ?)",
-            (status, status_type),
+    if detector is not None and len(loaded):
+        with instrument.timer("anomaly"):
+            detect(cur, detector, pd.DataFrame({
+                "minute": time_id[ok].to_numpy(),
+                "path": loaded["url_path"].to_numpy(),
+                "status_type": status_type.to_numpy(),
+                "attack_category": dims["url"].extra_values(loaded["url"], "attack_category"),
+            }))
+    return len(rows)
+
+
+def make_dims(cur, cache_size=CACHE_SIZE):
+    return {
+        "time": TimeDim(cur, cache_size),
+        "url": DimResolver(
+            cur, "dim_url", "url_id", "url", ("domain", "path", "query"), _url_attrs,
+            extra={"attack_category": classify_url}, cache_size=cache_size,
+        ),
+        "status": DimResolver(
+            cur, "dim_status", "status_id", "status_code", ("status_type",), _status_attrs,
+            cache_size=cache_size,
+        ),
+        "method": DimResolver(cur, "dim_method", "method_id", "method", (), _no_attrs, cache_size=cache_size),
+        "mime": DimResolver(cur, "dim_mime", "mime_id", "mime_type", (), _no_attrs, cache_size=cache_size),
+    }
+
+
+def cache_stats(dims):
+    """hit/miss của cache từng dimension, kèm số key phải tra bảng / đã insert"""
+    return {
+        name: {**dim.cache.stats(), "db_lookups": dim.db_lookups, "inserted": dim.inserted}
+        for name, dim in dims.items()
+    }
+
+
+def print_cache_stats(dims):
+    for name, st in cache_stats(dims).items():
+        print(
+            f"  cache {name:<7} size={st['size']:<8} hits={st['hits']:<9} misses={st['misses']:<9} "
+            f"evictions={st['evictions']:<8} hit_rate={st['hit_rate']:.1%}"
+            + f" db_lookups={st['db_lookups']}"
         )
-        cur.execute("SELECT status_id FROM dim_status WHERE status_code = ?", (status,))
-        row = cur.fetchone()
-        return row[0] if row else None
 
+
+def process_staging(conn, dims, facts, detector, chunksize=ETL_CHUNK_SIZE):
+    """DQ + nạp dim/fact cho các dòng staging sau high-water mark `last_stg_row_id`.
+
+    Không commit; trả về (số dòng vào fact, số dòng bị loại).
+    """
+    cur = conn.cursor()
+    last_row_id = int(get_meta(conn, "last_stg_row_id", 0))
+    reader = conn.execute(
+        f"SELECT {', '.join(STG_COLUMNS)} FROM stg_logs WHERE row_id > ? ORDER BY row_id",
+        (last_row_id,),
+    )
     valid = invalid = 0
+    # url/status dùng chung cache với DimResolver: entry status thô ("200") và
+    # key dim (200) khác kiểu nên không đè nhau.
+    # ts gần như không lặp lại nên không cache (_map_time parse vector hoá)
+    caches = {"url": dims["url"].cache, "status": dims["status"].cache}
 
-    for row_id, ts, method, url, status, mime, wait_ms in rows:
-        bad = False
+    while True:
+        with instrument.timer("read_staging"):
+            rows = reader.fetchmany(chunksize)
+            if not rows:
+                break
+            chunk = pd.DataFrame(rows, columns=STG_COLUMNS, dtype=object)
+        with instrument.timer("dq"):
+            clean, issues = run_dq(chunk, caches)
+        loaded = load_chunk(cur, dims, facts, clean, issues, detector)
+        valid += loaded
+        invalid += len(chunk) - loaded
+        last_row_id = int(chunk["row_id"].iloc[-1])
 
-        # ----- DQ CHECKS -----
-        # 1. time
-        if not isinstance(ts, str) or not ts.strip():
-            record_issue(row_id, "missing_time", "Empty timestamp")
-            bad = True
-        else:
-            try:
-                datetime.fromisoformat(ts.replace("Z", "+00:00"))
-            except Exception:
-                record_issue(row_id, "invalid_time", f"Unparseable time: {ts}")
-                bad = True
-
-        # 2. url
-        if not isinstance(url, str) or not url.startswith("http"):
-            record_issue(row_id, "invalid_url", f"Bad url: {url}")
-            bad = True
-
-        # 3. status
-        try:
-            s_int = int(status)
-        except Exception:
-            record_issue(row_id, "invalid_status", f"Not int: {status}")
-            bad = True
-        else:
-            if not (100 <= s_int <= 599):
-                record_issue(row_id, "invalid_status", f"Out of range: {s_int}")
-                bad = True
-
-        if bad:
-            invalid += 1
-            continue
-
-        # ----- DIM INSERT -----
-        time_id = get_or_create_dim_time(ts)
-        url_id = get_or_create_dim_url(url)
-        status_id = get_or_create_dim_status(s_int)
-
-        if None in (time_id, url_id, status_id):
-            record_issue(row_id, "dim_error", "Could not get dim IDs")
-            invalid += 1
-            continue
-
-        # ----- FACT INSERT -----
-        cur.execute(
-            """
-            INSERT INTO fact_requests
-                (time_id, url_id, status_id, method, mime_type, wait_ms)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (time_id, url_id, status_id, method, mime, float(wait_ms) if wait_ms is not None else None),
-        )
-        valid += 1
+    instrument.count("rows_in", valid + invalid)
+    instrument.count("rows_out", valid)
+    instrument.count("rejected", invalid)
+    set_meta(conn, "last_stg_row_id", last_row_id)
+    if valid or invalid:
+        save_detector(conn, detector)
+        bump_load_version(conn)
+    return valid, invalid
 
-    conn.commit()
+
+def run_etl(profile="default", cache_size=CACHE_SIZE):
+    conn = connect(profile)
+    cur = conn.cursor()
+
+    # bulk load vào DWH rỗng: bỏ index, nạp xong mới build 1 lần
+    index_sql = []
+    if profile == "bulk" and conn.execute("SELECT 1 FROM fact_requests LIMIT 1").fetchone() is None:
+        index_sql = drop_indexes(conn)
+
+    # dim không còn index: không được để cache bỏ key (tra lại bảng sẽ là full scan)
+    dims = make_dims(cur, None if index_sql else cache_size)
+    # bulk: partition mới chưa có index, finish_bulk_load build 1 lần
+    facts = FactPartitions(cur, indexes=not index_sql)
+    valid, invalid = process_staging(conn, dims, facts, load_detector(conn))
+    with instrument.timer("commit"):
+        conn.commit()
+    with instrument.timer("finish"):
+        if profile == "bulk":
+            finish_bulk_load(conn, index_sql)
+        else:
+            # cập nhật thống kê cho planner khi bảng lớn dần (bulk đã ANALYZE)
+            conn.execute("PRAGMA optimize")
     conn.close()
 
     print(f"Loaded into fact: {valid}, rejected rows: {invalid}")
+    print_cache_stats(dims)
+    instrument.note("dims", cache_stats(dims))
+
+
+EXPORT_QUERY = """
+SELECT
+  f.request_id,
+  strftime('%Y-%m-%dT%H:%M:%fZ', f.event_ms / 1000.0, 'unixepoch') AS time,
+  t.date      AS date,
+  t.hour      AS hour,
+  t.minute    AS minute,
+  u.url       AS url,
+  u.domain    AS domain,
+  u.path      AS path,
+  u.query     AS query,
+  s.status_code,
+  s.status_type,
+  m.method,
+  mt.mime_type,
+  f.wait_ms
+FROM {source} f
+JOIN dim_time   t ON f.time_id = t.time_id
+JOIN dim_url    u ON f.url_id = u.url_id
+JOIN dim_status s ON f.status_id = s.status_id
+LEFT JOIN dim_method m  ON f.method_id = m.method_id
+LEFT JOIN dim_mime   mt ON f.mime_id = mt.mime_id
+{where}
+ORDER BY f.request_id
+"""
 
 
 def export_for_looker():
     """Join fact + dim và xuất ra CSV final cho Looker"""
-    conn = sqlite3.connect(DB_PATH)
-
-    query = """
-    SELECT
-      f.request_id,
-      t.ts        AS time,
-      t.date      AS date,
-      t.hour      AS hour,
-      t.minute    AS minute,
-      u.url       AS url,
-      u.domain    AS domain,
-      u.path      AS path,
-      u.query     AS query,
-      s.status_code,
-      s.status_type,
-      f.method,
-      f.mime_type,
-      f.wait_ms
-    FROM fact_requests f
-    JOIN dim_time   t ON f.time_id = t.time_id
-    JOIN dim_url    u ON f.url_id = u.url_id
-    JOIN dim_status s ON f.status_id = s.status_id
-    ORDER BY f.request_id
-    """
+    conn = instrument.connect(DB_PATH)
 
-    df_final = pd.read_sql_query(query, conn)
+    df_final = pd.read_sql_query(EXPORT_QUERY.format(source=fact_source(conn), where=""), conn)
     df_final.to_csv(OUT_CSV, index=False)
     conn.close()
     print(f"Exported final DWH file to: {OUT_CSV}")
 
 
+PARQUET_DIR = DWH_DIR / "parquet" / "requests"
+EXPORT_CHUNK_SIZE = 500_000
+
+PARQUET_CATEGORIES = ["domain", "status_type", "method", "mime_type"]
+
+
+def _parquet_dtypes(df):
+    """Ép kiểu cho file Parquet: time thành timestamp UTC, cột ít giá trị thành category"""
+    return df.astype({
+        "request_id": "int64",
+        "hour": "int8",
+        "minute": "int8",
+        "status_code": "int16",
+        "wait_ms": "float64",
+        **{col: "category" for col in PARQUET_CATEGORIES},
+    }).assign(time=pd.to_datetime(df["time"], format="ISO8601", utc=True, errors="coerce"))
+
+
+def export_parquet(out_dir=PARQUET_DIR, chunksize=EXPORT_CHUNK_SIZE):
+    """Xuất fact + dim ra Parquet phân vùng theo date (out_dir/date=YYYY-MM-DD/).
+
+    Join được stream theo chunksize nên không giữ cả bảng trong RAM. Chỉ các fact
+    sau watermark `parquet_request_id` được ghi, thành file part mới trong
+    partition tương ứng, nên lần chạy sau chỉ tốn theo phần dữ liệu mới.
+    """
+    if pq is None:
+        raise RuntimeError("Cần cài package 'pyarrow' để xuất Parquet")
+
+    out_dir = Path(out_dir)
+    conn = instrument.connect(DB_PATH)
+    last_id = get_meta(conn, "parquet_request_id")
+    if last_id is None and out_dir.exists():
+        # DWH mới (full refresh): request_id bắt đầu lại -> bỏ bản export cũ
+        shutil.rmtree(out_dir)
+    last_id = int(last_id or 0)
+
+    n_rows = 0
+    # chỉ đọc các partition có fact sau watermark
+    source = fact_source(conn, after_id=last_id)
+    chunks = pd.read_sql_query(
+        EXPORT_QUERY.format(source=source, where="WHERE f.request_id > ?"), conn, params=(last_id,),
+        chunksize=chunksize,
+    )
+    for chunk in chunks:
+        chunk = _parquet_dtypes(chunk)
+        first_id = int(chunk["request_id"].iloc[0])
+        pq.write_to_dataset(
+            pa.Table.from_pandas(chunk, preserve_index=False),
+            root_path=out_dir,
+            partition_cols=["date"],
+            basename_template=f"part-{first_id:012d}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        last_id = int(chunk["request_id"].iloc[-1])
+        n_rows += len(chunk)
+
+    set_meta(conn, "parquet_request_id", last_id)
+    conn.commit()
+    conn.close()
+    print(f"Exported {n_rows} new rows to Parquet: {out_dir}")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ETL log CSV -> mini DWH (SQLite)")
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="xoá DWH và nạp lại toàn bộ lịch sử thay vì chỉ phần log mới",
+    )
+    parser.add_argument(
+        "--input",
+        type=Path,
+        default=CSV_PATH,
+        help="file log thô (.csv, .csv.gz, .csv.zst), mặc định data/raw/log_parsed.csv",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=STAGING_CHUNK_SIZE,
+        help="số dòng CSV đọc mỗi lần khi nạp staging",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(PRAGMA_PROFILES),
+        default="default",
+        help="profile kết nối SQLite; 'bulk' nạp nhanh, build index sau khi nạp xong",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=CACHE_SIZE,
+        help="số natural key tối đa giữ trong cache LRU của mỗi dimension",
+    )
+    parser.add_argument(
+        "--export",
+        choices=["csv", "parquet", "both"],
+        default="csv",
+        help="định dạng export sau khi nạp: CSV cho Looker (mặc định) và/hoặc Parquet theo ngày",
+    )
+    parser.add_argument(
+        "--no-instrument",
+        action="store_true",
+        help="không đo thời gian / đếm theo stage và không ghi báo cáo vào etl_runs",
+    )
+    parser.add_argument(
+        "--profile-stage",
+        metavar="STAGE",
+        help="chạy stage này dưới profiler, VD run_etl, dq, dim.url (lưu vào data/dwh/profiles/)",
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=["cprofile", "sample"],
+        default="cprofile",
+        help="cprofile: file .prof; sample: sampling profiler, file .folded cho flamegraph",
+    )
+    args = parser.parse_args()
+
     init_dirs()
-    init_db()
-    load_staging()
-    run_etl()
-    export_for_looker()
+    if not args.no_instrument:
+        instrument.start(
+            "etl", profile_stage=args.profile_stage, profiler=args.profiler, profile_dir=PROFILE_DIR,
+        )
+    status = "failed"
+    try:
+        with instrument.timer("init_db"):
+            init_db(full_refresh=args.full_refresh)
+        with instrument.timer("load_staging"):
+            load_staging(args.input, chunksize=args.chunk_size, profile=args.profile)
+        with instrument.timer("run_etl"):
+            run_etl(profile=args.profile, cache_size=args.cache_size)
+        if args.export in ("csv", "both"):
+            with instrument.timer("export_csv"):
+                export_for_looker()
+        if args.export in ("parquet", "both"):
+            with instrument.timer("export_parquet"):
+                export_parquet()
+        status = "ok"
+    finally:
+        instrument.finish(DB_PATH, status)
@@ -0,0 +1,199 @@
+"""Follow log thô (giống `tail -F`) và nạp liên tục vào mini DWH theo micro-batch.
+
+Dòng mới được gom lại rồi nạp khi đủ --batch-rows dòng hoặc khi dòng cũ nhất
+đã chờ gần hết --max-latency giây. Mỗi batch là 1 transaction: staging, DQ,
+dim/fact, rollup, anomaly và offset đọc file (`raw_offset:<đường dẫn file>`
+trong etl_meta, chung với etl.py) cùng commit, nên dừng / khởi động lại không mất
+hay nạp trùng dòng. Dòng đang ghi dở (chưa có ký tự xuống dòng) được giữ lại
+tới lần đọc sau; file bị truncate hoặc bị thay bằng file mới (rotate) thì đọc
+lại từ đầu file mới.
+
+Process này là writer duy nhất của DWH khi chạy: không chạy etl.py /
+etl_parallel.py song song vì map surrogate key được giữ trong RAM.
+
+    python src/etl_follow.py --max-latency 2
+"""
+import argparse
+import io
+import os
+import signal
+import time
+from pathlib import Path
+
+import etl
+
+BATCH_ROWS    = 5_000
+MAX_LATENCY   = 2.0    # giây từ lúc đọc được dòng tới lúc commit vào DWH
+POLL_INTERVAL = 0.2
+READ_BYTES    = 1 << 20
+
+
+class Follower:
+    def __init__(self, path, conn, batch_rows=BATCH_ROWS, max_latency=MAX_LATENCY):
+        self.path = Path(path)
+        self.conn = conn
+        self.batch_rows = batch_rows
+        self.max_latency = max_latency
+        self.offset_key = etl.raw_meta_key(conn, "raw_offset", self.path)
+        self.inode_key = etl.raw_meta_key(conn, "raw_inode", self.path)
+
+        self.f = None
+        self.names = None
+        self.offset = 0        # byte ngay sau dòng hoàn chỉnh cuối cùng đã đọc
+        self.partial = b""     # dòng đang ghi dở
+        self.lines = []
+        self.n_lines = 0
+        self.first_seen = None
+
+    def open(self):
+        """Mở file ở offset đã lưu; False nếu file chưa có hoặc chưa ghi xong header"""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        header = f.readline()
+        if not header.endswith(b"\n"):
+            f.close()
+            return False
+
+        st = os.fstat(f.fileno())
+        offset = int(etl.get_meta(self.conn, self.offset_key, 0))
+        if etl.get_meta(self.conn, self.inode_key, str(st.st_ino)) != str(st.st_ino) or st.st_size < offset:
+            offset = 0  # file đã bị rotate / truncate lúc process không chạy
+
+        self.f = f
+        self.names = header.decode("utf-8").strip().split(",")
+        self.offset = max(offset, len(header))
+        self.partial = b""
+        f.seek(self.offset)
+        return True
+
+    def read(self):
+        """Đọc phần mới (tối đa READ_BYTES), gom các dòng hoàn chỉnh. Trả về số byte đọc được"""
+        block = self.f.read(READ_BYTES)
+        if not block:
+            return 0
+        data = self.partial + block
+        cut = data.rfind(b"\n") + 1
+        if cut:
+            self.lines.append(data[:cut])
+            self.n_lines += data.count(b"\n", 0, cut)
+            self.offset += cut
+            self.first_seen = self.first_seen or time.monotonic()
+        self.partial = data[cut:]
+        return len(block)
+
+    def rotated(self):
+        """File trên đĩa không còn là file đang mở (rotate) hoặc ngắn hơn offset (truncate)"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False  # đang rotate: chờ file mới xuất hiện
+        return st.st_ino != os.fstat(self.f.fileno()).st_ino or st.st_size < self.offset
+
+    def reopen(self, dims, facts, detector):
+        """Nạp nốt file cũ rồi chuyển sang file mới, đọc từ đầu"""
+        if os.stat(self.path).st_ino != os.fstat(self.f.fileno()).st_ino:
+            while self.read():
+                pass
+            if self.partial:
+                # file cũ đã đóng: dòng cuối không có xuống dòng vẫn được nạp (DQ sẽ lọc)
+                self.lines.append(self.partial + b"\n")
+                self.n_lines += 1
+                self.partial = b""
+        self.flush(dims, facts, detector)
+        self.f.close()
+        self.f = None
+        etl.set_meta(self.conn, self.offset_key, 0)
+        self.conn.commit()
+        return self.open()
+
+    def slack(self, flush_cost):
+        """Số giây còn có thể chờ thêm trước khi batch hiện tại phải nạp"""
+        if not self.n_lines:
+            return float("inf")
+        return self.max_latency - flush_cost - (time.monotonic() - self.first_seen)
+
+    def due(self, flush_cost):
+        """Đủ dòng cho 1 batch, hoặc chờ thêm sẽ vượt latency budget"""
+        return self.n_lines >= self.batch_rows or self.slack(flush_cost) <= 0
+
+    def flush(self, dims, facts, detector):
+        """Nạp các dòng đã gom trong 1 transaction. Trả về (valid, invalid, lag giây)"""
+        if not self.n_lines:
+            return 0, 0, 0.0
+        stream = io.BytesIO(b"".join(self.lines))
+        # 1 dòng hỏng không được làm batch raise (offset không tiến -> kẹt mãi ở dòng đó)
+        etl.stage_chunks(self.conn, etl.read_raw_csv(stream, self.names, tolerant=True))
+        etl.set_meta(self.conn, self.offset_key, self.offset)
+        etl.set_meta(self.conn, self.inode_key, os.fstat(self.f.fileno()).st_ino)
+        valid, invalid = etl.process_staging(self.conn, dims, facts, detector)
+        self.conn.commit()
+
+        lag = time.monotonic() - self.first_seen
+        self.lines, self.n_lines, self.first_seen = [], 0, None
+        return valid, invalid, lag
+
+
+def follow(path, batch_rows=BATCH_ROWS, max_latency=MAX_LATENCY, poll_interval=POLL_INTERVAL):
+    conn = etl.connect()
+    dims = etl.make_dims(conn.cursor())
+    facts = etl.FactPartitions(conn.cursor())
+    detector = etl.load_detector(conn)
+
+    follower = Follower(path, conn, batch_rows, max_latency)
+
+    stop = False
+
+    def _stop(signum, frame):
+        nonlocal stop
+        stop = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    flush_cost = 0.1 * max_latency   # thời gian nạp 1 batch (EWMA), trừ hao vào latency budget
+    print(f"Following {path} (batch {batch_rows} rows / {max_latency}s) – Ctrl+C để dừng")
+    while not stop:
+        if follower.f is None:
+            if not follower.open():
+                time.sleep(poll_interval)
+                continue
+        elif follower.rotated():
+            print(f"{path} rotated / truncated -> đọc lại từ đầu")
+            follower.reopen(dims, facts, detector)
+            continue
+
+        n_bytes = follower.read()
+        if follower.due(flush_cost):
+            started = time.monotonic()
+            valid, invalid, lag = follower.flush(dims, facts, detector)
+            flush_cost = 0.8 * flush_cost + 0.2 * (time.monotonic() - started)
+            print(f"Loaded into fact: {valid}, rejected rows: {invalid}, lag {lag:.2f}s")
+            if lag > max_latency:
+                print(f"  cảnh báo: vượt latency budget {max_latency}s")
+        elif not n_bytes:
+            time.sleep(max(0.0, min(poll_interval, follower.slack(flush_cost))))
+
+    if follower.f is not None:
+        valid, invalid, _ = follower.flush(dims, facts, detector)
+        if valid or invalid:
+            print(f"Loaded into fact: {valid}, rejected rows: {invalid}")
+        follower.f.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow log thô và nạp liên tục vào mini DWH")
+    parser.add_argument("--input", type=Path, default=etl.CSV_PATH, help="file log CSV (không nén)")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="số dòng tối đa mỗi micro-batch")
+    parser.add_argument(
+        "--max-latency", type=float, default=MAX_LATENCY,
+        help="số giây tối đa từ lúc đọc được dòng tới lúc commit vào DWH",
+    )
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL, help="chu kỳ kiểm tra file (giây)")
+    args = parser.parse_args()
+
+    etl.init_dirs()
+    etl.init_db()
+    follow(args.input, args.batch_rows, args.max_latency, args.poll)
@@ -0,0 +1,205 @@
+"""ETL song song cho nhiều file log thô (mỗi proxy / logger 1 file).
+
+Mỗi file được chia thành các shard theo khoảng byte (cắt đúng ranh giới dòng).
+Worker trong ProcessPoolExecutor parse CSV, chạy DQ và tách thuộc tính
+dimension; process chính là writer duy nhất ghi vào mini_dwh.db theo đúng thứ
+tự shard. Surrogate key được cấp theo thứ tự xuất hiện đầu tiên giống hệt chạy
+tuần tự, nên kết quả trùng với `etl.py` chạy lần lượt trên từng file.
+
+    python src/etl_parallel.py "data/raw/*.csv" --workers 4
+"""
+import argparse
+import glob
+import io
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import etl
+
+SHARD_BYTES = 32 << 20
+
+
+def _last_newline(path, end):
+    """Vị trí ngay sau ký tự xuống dòng cuối cùng trước `end`"""
+    with open(path, "rb") as f:
+        pos = end
+        while pos > 0:
+            start = max(0, pos - (1 << 16))
+            f.seek(start)
+            block = f.read(pos - start)
+            cut = block.rfind(b"\n")
+            if cut >= 0:
+                return start + cut + 1
+            pos = start
+    return 0
+
+
+def plan_shards(path, offset, shard_bytes=SHARD_BYTES):
+    """Chia phần mới của 1 file thành các shard (path, start, end, names).
+
+    File nén không chia được theo byte: cả phần mới là 1 shard với end=None.
+    """
+    with etl._open_raw(path) as raw:
+        header = raw.readline()
+    names = header.decode("utf-8").strip().split(",")
+
+    if Path(path).suffix in (".gz", ".zst"):
+        return [(str(path), max(offset, len(header)), None, names)]
+
+    size = os.path.getsize(path)
+    if size < offset:
+        offset = 0
+    start = max(offset, len(header))
+    end = _last_newline(path, size)
+
+    shards = []
+    while start < end:
+        stop = end if start + shard_bytes >= end else _last_newline(path, start + shard_bytes)
+        if stop <= start:
+            # 1 dòng dài hơn shard_bytes: gộp tới hết dòng đó
+            with open(path, "rb") as f:
+                f.seek(start + shard_bytes)
+                f.readline()
+                stop = min(f.tell(), end)
+        shards.append((str(path), start, stop, names))
+        start = stop
+    return shards
+
+
+def process_shard(shard):
+    """Worker: staging tạm trong SQLite in-memory (để cột có cùng affinity với
+    stg_logs thật), chạy DQ và tách thuộc tính dimension.
+
+    Trả về (staged, clean, issues, end); row_id là số thứ tự cục bộ từ 1.
+    """
+    path, start, end, names = shard
+
+    with etl._open_raw(path) as raw:
+        if end is None:
+            etl._seek_forward(raw, start)
+            lines = etl._CompleteLines(raw)
+            stream = io.BufferedReader(lines)
+        else:
+            raw.seek(start)
+            stream = io.BytesIO(raw.read(end - start))
+
+        mem = sqlite3.connect(":memory:")
+        mem.executescript(etl.SCHEMA_SQL.read_text(encoding="utf-8"))
+        etl.stage_chunks(mem, etl.read_raw_csv(stream, names))
+
+    if end is None:
+        end = start + lines.consumed
+
+    rows = mem.execute(f"SELECT {', '.join(etl.STG_COLUMNS)} FROM stg_logs ORDER BY row_id").fetchall()
+    mem.close()
+
+    staged = pd.DataFrame(rows, columns=etl.STG_COLUMNS, dtype=object)
+    if staged.empty:
+        return staged, staged, pd.DataFrame(columns=["stg_row_id", "issue_type", "detail"]), end
+    clean, issues = etl.run_dq(staged)
+    return staged, clean, issues, end
+
+
+def _write_shard(cur, dims, facts, detector, result):
+    """Writer: ghi staging với row_id toàn cục rồi nạp dim/fact như etl.run_etl"""
+    staged, clean, issues, _ = result
+    if staged.empty:
+        return 0, 0
+
+    row = cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'stg_logs'").fetchone()
+    base = row[0] if row else 0
+
+    staged = staged.assign(row_id=staged["row_id"] + base)
+    cur.executemany(
+        f"INSERT INTO stg_logs ({', '.join(etl.STG_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(etl.STG_COLUMNS))})",
+        staged.itertuples(index=False, name=None),
+    )
+    clean = clean.assign(row_id=clean["row_id"] + base)
+    issues = issues.assign(stg_row_id=issues["stg_row_id"] + base)
+
+    loaded = etl.load_chunk(cur, dims, facts, clean, issues, detector)
+    return loaded, len(staged) - loaded
+
+
+def run_parallel(paths, workers=None, shard_bytes=SHARD_BYTES, profile="default"):
+    workers = workers or os.cpu_count() or 1
+    conn = etl.connect(profile)
+    cur = conn.cursor()
+
+    index_sql = []
+    if profile == "bulk" and conn.execute("SELECT 1 FROM fact_requests LIMIT 1").fetchone() is None:
+        index_sql = etl.drop_indexes(conn)
+
+    # index dim đã drop: cache không giới hạn để không phải tra lại bảng
+    dims = etl.make_dims(cur, None if index_sql else etl.CACHE_SIZE)
+    facts = etl.FactPartitions(cur, indexes=not index_sql)
+    detector = etl.load_detector(conn)
+    # staging còn dòng chưa xử lý (VD lần chạy tuần tự bị ngắt): nạp trước, vì
+    # sau mỗi file watermark last_stg_row_id nhảy tới cuối stg_logs
+    valid, invalid = etl.process_staging(conn, dims, facts, detector)
+    # giữ tối đa max_pending shard đang chạy để RAM không phình theo số shard
+    max_pending = 2 * workers
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path in paths:
+            offset_key = etl.raw_meta_key(conn, "raw_offset", path)
+            shards = plan_shards(path, int(etl.get_meta(conn, offset_key, 0)), shard_bytes)
+
+            pending = deque()
+            end = None
+            for shard in shards:
+                pending.append(pool.submit(process_shard, shard))
+                if len(pending) >= max_pending:
+                    result = pending.popleft().result()
+                    v, i = _write_shard(cur, dims, facts, detector, result)
+                    valid, invalid, end = valid + v, invalid + i, result[3]
+            while pending:
+                result = pending.popleft().result()
+                v, i = _write_shard(cur, dims, facts, detector, result)
+                valid, invalid, end = valid + v, invalid + i, result[3]
+
+            if end is not None:
+                etl.set_meta(conn, offset_key, end)
+            row = cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'stg_logs'").fetchone()
+            if row:
+                etl.set_meta(conn, "last_stg_row_id", row[0])
+            etl.save_detector(conn, detector)
+            conn.commit()
+            print(f"{path}: {len(shards)} shard(s)")
+
+    if valid or invalid:
+        etl.bump_load_version(conn)
+        conn.commit()
+    if profile == "bulk":
+        etl.finish_bulk_load(conn, index_sql)
+    conn.close()
+    print(f"Loaded into fact: {valid}, rejected rows: {invalid}")
+
+
+def expand_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        paths.extend(matches if matches else [pattern])
+    return [Path(p) for p in dict.fromkeys(paths)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ETL song song nhiều file log thô -> mini DWH")
+    parser.add_argument("inputs", nargs="*", default=[str(etl.CSV_PATH)], help="file hoặc glob log thô")
+    parser.add_argument("--workers", type=int, default=None, help="số process (mặc định = số CPU)")
+    parser.add_argument("--shard-mb", type=int, default=SHARD_BYTES >> 20, help="kích thước shard (MB)")
+    parser.add_argument("--full-refresh", action="store_true", help="xoá DWH và nạp lại toàn bộ")
+    parser.add_argument("--profile", choices=sorted(etl.PRAGMA_PROFILES), default="default")
+    args = parser.parse_args()
+
+    etl.init_dirs()
+    etl.init_db(full_refresh=args.full_refresh)
+    run_parallel(expand_inputs(args.inputs), args.workers, args.shard_mb << 20, args.profile)
+    etl.export_for_looker()
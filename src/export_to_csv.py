@@ -1,17 +1,15 @@
 from mitmproxy import http
-import csv, os
-from datetime import datetime
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from log_sink import get_sink  # noqa: E402
 
 LOG_PATH = "data/raw/log_parsed.csv"
 
-# Tạo file CSV nếu chưa có
-if not os.path.exists(LOG_PATH):
-    with open(LOG_PATH, "w", newline="", encoding="utf8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["time", "method", "url", "status", "mimeType", "wait_ms"])
+# Ghi theo lô ở thread nền (header tự tạo khi file chưa có) để hook không chặn event loop
+SINK = get_sink(LOG_PATH)
 
 def response(flow: http.HTTPFlow):
-    ts = datetime.utcnow().isoformat() + "Z"
     method = flow.request.method
     url = flow.request.pretty_url
     status = flow.response.status_code if flow.response else 0
@@ -21,6 +19,9 @@ def response(flow: http.HTTPFlow):
     if flow.response and flow.response.timestamp_start and flow.response.timestamp_end:
         wait_ms = (flow.response.timestamp_end - flow.response.timestamp_start) * 1000
 
-    with open(LOG_PATH, "a", newline="", encoding="utf8") as f:
-        writer = csv.writer(f)
-        writer.writerow([ts, method, url, status, mime, wait_ms])
+    SINK.write(method, url, status, mime, wait_ms)
+
+def done():
+    # mitmproxy tắt / reload addon: ghi nốt buffer. Không close sink dùng chung
+    # (addon nạp lại nhận đúng instance này); thread nền dừng ở atexit
+    SINK.flush()
@@ -0,0 +1,261 @@
+"""Đo thời gian / đếm theo stage cho ETL, ghi báo cáo mỗi lần chạy vào etl_runs.
+
+Dùng như logging: etl.py gọi start() đầu lần chạy và finish() cuối lần chạy;
+các chỗ khác chỉ cần `with timer("dq"):` / `count("rows_in", n)`. Khi không có
+run nào đang chạy (tắt bằng --no-instrument, hoặc module khác gọi thẳng hàm của
+etl) mọi hàm đều là no-op, timer() trả về 1 context rỗng dùng chung.
+
+Thời gian SQLite đo qua Connection / Cursor của connect(): mỗi execute /
+executemany / fetch* được bấm giờ, cộng vào mọi timer đang mở; phần còn lại
+của timer là thời gian Python. Duyệt cursor bằng vòng for không được tính.
+
+--profile-stage NAME: chạy mọi lần vào timer NAME dưới cProfile (file .prof,
+xem bằng `python -m pstats` / snakeviz) hoặc sampling profiler dựa trên
+SIGPROF (file .folded, dạng collapsed stack cho flamegraph.pl / speedscope).
+"""
+import cProfile
+import json
+import signal
+import sqlite3
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+
+SAMPLE_INTERVAL = 0.005   # giây giữa 2 mẫu của sampling profiler
+
+_run = None               # Run đang hoạt động
+_NULL = nullcontext()
+
+
+class StackSampler:
+    """Sampling profiler: mỗi SAMPLE_INTERVAL giây CPU ghi lại call stack của main thread"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def _sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{Path(code.co_filename).name}:{code.co_name}")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(names))] += 1
+
+    def enable(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+    def dump_stats(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+class Run:
+    """Timer + counter của 1 lần chạy ETL"""
+
+    def __init__(self, command, profile_stage=None, profiler="cprofile", profile_dir=None):
+        self.command = command
+        self.started_at = datetime.now(timezone.utc)
+        self.t0 = time.perf_counter()
+        self.timers = {}            # name -> [calls, seconds, sql_seconds]
+        self.counters = Counter()
+        self.notes = {}
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.profile_stage = profile_stage
+        self.profile_dir = profile_dir
+        self.profiler = None
+        if profile_stage:
+            self.profiler = StackSampler() if profiler == "sample" else cProfile.Profile()
+
+    @contextmanager
+    def timer(self, name):
+        profile = name == self.profile_stage
+        if profile:
+            self.profiler.enable()
+        # tạo entry lúc vào để báo cáo liệt kê stage ngoài trước stage con
+        entry = self.timers.setdefault(name, [0, 0.0, 0.0])
+        sql0 = self.sql_seconds
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            if profile:
+                self.profiler.disable()
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += self.sql_seconds - sql0
+
+    def save_profile(self):
+        """Ghi file profile của --profile-stage, trả về đường dẫn (None nếu stage không chạy)"""
+        if self.profiler is None or self.profile_stage not in self.timers:
+            return None
+        suffix = "folded" if isinstance(self.profiler, StackSampler) else "prof"
+        path = Path(self.profile_dir) / f"{self.started_at:%Y%m%dT%H%M%S}-{self.profile_stage}.{suffix}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.profiler.dump_stats(str(path))
+        return path
+
+    def report(self):
+        stages = {
+            name: {
+                "calls": calls,
+                "seconds": round(seconds, 4),
+                "sql_seconds": round(sql, 4),
+                "python_seconds": round(seconds - sql, 4),
+            }
+            for name, (calls, seconds, sql) in self.timers.items()
+        }
+        return {
+            "stages": stages,
+            "counters": dict(self.counters),
+            "sql": {"statements": self.sql_statements, "seconds": round(self.sql_seconds, 4)},
+            **self.notes,
+        }
+
+
+# ==== API dùng trong etl.py (no-op khi không có run) ====
+
+def start(command, **kwargs):
+    global _run
+    _run = Run(command, **kwargs)
+    return _run
+
+
+def timer(name):
+    return _NULL if _run is None else _run.timer(name)
+
+
+def count(name, n=1):
+    if _run is not None:
+        _run.counters[name] += int(n)
+
+
+def count_values(prefix, values):
+    """Đếm theo từng giá trị, VD count_values("dq", issues["issue_type"]) -> dq.invalid_url, ..."""
+    if _run is not None and len(values):
+        for value, n in values.value_counts().items():
+            _run.counters[f"{prefix}.{value}"] += int(n)
+
+
+def note(key, value):
+    """Thêm 1 mục (JSON được) vào báo cáo, VD thống kê cache của dim"""
+    if _run is not None:
+        _run.notes[key] = value
+
+
+def finish(db_path, status="ok", verbose=True):
+    """Kết thúc run hiện tại: ghi file profile, insert 1 dòng vào etl_runs. Trả về report"""
+    global _run
+    run, _run = _run, None
+    if run is None:
+        return None
+
+    seconds = time.perf_counter() - run.t0
+    report = run.report()
+    profile_path = run.save_profile()
+    if profile_path:
+        report["profile"] = str(profile_path)
+
+    try:
+        _save(db_path, run, status, seconds, report)
+    except sqlite3.Error as e:  # không để lỗi ghi báo cáo che lỗi gốc của lần chạy
+        print(f"! Không ghi được etl_runs: {e}")
+    if verbose:
+        print_report(report, seconds)
+    return report
+
+
+def _save(db_path, run, status, seconds, report):
+    counters = run.counters
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            """
+            INSERT INTO etl_runs (
+                started_at, finished_at, command, status, seconds, rows_in, rows_out, rejected,
+                sql_statements, sql_seconds, report
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                run.started_at.isoformat(timespec="seconds"),
+                datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                run.command, status, round(seconds, 4),
+                counters["rows_in"], counters["rows_out"], counters["rejected"],
+                run.sql_statements, round(run.sql_seconds, 4),
+                json.dumps(report, ensure_ascii=False),
+            ),
+        )
+
+
+def print_report(report, seconds):
+    print(f"Run: {seconds:.2f}s, {report['sql']['statements']} SQL statements "
+          f"({report['sql']['seconds']:.2f}s trong SQLite)")
+    for name, st in report["stages"].items():
+        print(
+            f"  {name:<16} calls={st['calls']:<6} {st['seconds']:>8.2f}s "
+            f"sql={st['sql_seconds']:>7.2f}s python={st['python_seconds']:>7.2f}s"
+        )
+    if report["counters"]:
+        print("  " + ", ".join(f"{k}={v}" for k, v in sorted(report["counters"].items())))
+    if "profile" in report:
+        print(f"  profile: {report['profile']}")
+
+
+# ==== Kết nối SQLite có bấm giờ ====
+
+def _timed(method):
+    def wrapper(self, *args, **kwargs):
+        if _run is None:
+            return method(self, *args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _run.sql_seconds += time.perf_counter() - t0
+            if method.__name__.startswith("execute"):
+                _run.sql_statements += 1
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+class TimedCursor(sqlite3.Cursor):
+    execute = _timed(sqlite3.Cursor.execute)
+    executemany = _timed(sqlite3.Cursor.executemany)
+    executescript = _timed(sqlite3.Cursor.executescript)
+    fetchone = _timed(sqlite3.Cursor.fetchone)
+    fetchmany = _timed(sqlite3.Cursor.fetchmany)
+    fetchall = _timed(sqlite3.Cursor.fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection có cursor bấm giờ. Connection.execute* của sqlite3 tạo cursor
+    thường ở tầng C nên phải đi qua self.cursor()."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    commit = _timed(sqlite3.Connection.commit)
+
+
+def connect(path):
+    """sqlite3.connect; có run đang chạy thì dùng TimedConnection để đếm / bấm giờ SQL"""
+    if _run is None:
+        return sqlite3.connect(path)
+    return sqlite3.connect(path, factory=TimedConnection)
@@ -0,0 +1,228 @@
+"""Aggregate của các panel dashboard, cộng dồn được (mergeable) theo watermark request_id.
+
+PanelState giữ đúng những gì panel cần dưới dạng count / sum: request theo
+phút × status_type, 4xx theo path, tấn công theo phút × category, DDSketch
+wait_ms theo path (sketches.py, cho mean và p50 / p95 / p99), cùng 500 request
+đầu cho bảng raw. update() cộng thêm
+1 lô fact, merge() gộp 2 state (VD tính song song theo shard); panels() dựng
+lại số liệu panel từ state, không đụng tới raw rows.
+
+Với DWH: from_dwh() khởi tạo từ rollup ETL đã giữ sẵn (cùng 1 snapshot đọc
+với watermark), refresh() chỉ đọc các fact có request_id > last_id trong
+những partition có fact mới, nên mỗi lần refresh tốn theo phần dữ liệu mới
+chứ không theo toàn bộ lịch sử.
+"""
+import threading
+from collections import Counter
+
+import pandas as pd
+
+from detection import BENIGN, classify_url
+from partitions import fact_source
+from sketches import DDSketch, loads, merge_into, quantile_frame
+
+RAW_ROWS    = 500
+DELTA_CHUNK = 200_000
+
+FACT_ROWS_QUERY = """
+SELECT f.request_id,
+       strftime('%Y-%m-%dT%H:%M:%fZ', f.event_ms / 1000.0, 'unixepoch') AS time,
+       u.url, u.path, s.status_code, s.status_type, m.method, mt.mime_type, f.wait_ms,
+       u.attack_category
+FROM {source} f
+JOIN dim_url    u ON f.url_id = u.url_id
+JOIN dim_status s ON f.status_id = s.status_id
+LEFT JOIN dim_method m  ON f.method_id = m.method_id
+LEFT JOIN dim_mime   mt ON f.mime_id = mt.mime_id
+WHERE f.request_id > ? AND f.request_id <= ?
+ORDER BY f.request_id
+"""
+
+RAW_COLUMNS = [
+    "request_id", "time", "url", "path", "status_code", "status_type", "method", "mime_type", "wait_ms",
+]
+
+
+class PanelState:
+    """count / sum / sketch cho các panel, cộng dồn theo lô fact"""
+
+    def __init__(self):
+        self.last_id = 0                  # watermark: request_id lớn nhất đã cộng
+        self.rows = 0
+        self.wait = [0, 0.0]              # [count, sum] wait_ms toàn bộ
+        self.minute_status = Counter()    # (phút, status_type) -> requests
+        self.path_4xx = Counter()         # path -> requests 4xx
+        self.path_wait = {}               # path -> DDSketch wait_ms
+        self.attacks = Counter()          # (phút, attack_category) -> requests
+        self.categories = {}              # url -> attack_category (classify_url 1 lần / URL)
+        self.raw = pd.DataFrame(columns=RAW_COLUMNS)
+        self.lock = threading.Lock()      # state dùng chung giữa các session Streamlit
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls().update(df)
+
+    def _attack_categories(self, df):
+        if "attack_category" in df.columns:
+            return df["attack_category"]
+        new = [url for url in df["url"].unique() if url not in self.categories]
+        self.categories.update((url, classify_url(url)) for url in new)
+        return df["url"].map(self.categories)
+
+    def update(self, df):
+        """Cộng 1 lô fact (cột như RAW_COLUMNS, time là datetime UTC). Trả về self"""
+        if df.empty:
+            return self
+        minute = df["time"].dt.floor("min")
+        self.minute_status.update(df.groupby([minute, "status_type"], observed=True).size().to_dict())
+
+        self.path_4xx.update(
+            df[df["status_type"] == "4xx"].groupby("path", observed=True).size().to_dict()
+        )
+        for path, waits in df.groupby("path", observed=True)["wait_ms"]:
+            merge_into(self.path_wait, {path: DDSketch().add(waits.to_numpy())})
+        self.wait[0] += int(df["wait_ms"].count())
+        self.wait[1] += float(df["wait_ms"].sum())
+
+        category = self._attack_categories(df)
+        attack = (category != BENIGN).to_numpy()
+        self.attacks.update(
+            df[attack].groupby([minute[attack], category[attack]], observed=True).size().to_dict()
+        )
+
+        if len(self.raw) < RAW_ROWS:
+            head = df[RAW_COLUMNS].head(RAW_ROWS - len(self.raw))
+            self.raw = head if self.raw.empty else pd.concat([self.raw, head], ignore_index=True)
+
+        self.rows += len(df)
+        self.last_id = max(self.last_id, int(df["request_id"].max()))
+        return self
+
+    def merge(self, other):
+        """Gộp state khác (VD của shard / khoảng thời gian khác) vào state này. Trả về self"""
+        self.minute_status.update(other.minute_status)
+        self.path_4xx.update(other.path_4xx)
+        merge_into(self.path_wait, {path: DDSketch().merge(sketch) for path, sketch in other.path_wait.items()})
+        self.wait = [self.wait[0] + other.wait[0], self.wait[1] + other.wait[1]]
+        self.attacks.update(other.attacks)
+        self.categories.update(other.categories)
+        raw = pd.concat([df for df in (self.raw, other.raw) if not df.empty] or [self.raw])
+        self.raw = raw.sort_values("request_id", kind="stable").head(RAW_ROWS).reset_index(drop=True)
+        self.rows += other.rows
+        self.last_id = max(self.last_id, other.last_id)
+        return self
+
+    # ==== DWH ====
+
+    @classmethod
+    def from_dwh(cls, conn):
+        """State cho toàn bộ DWH: rollup ETL giữ sẵn + tấn công / raw từ fact, cùng 1 snapshot"""
+        state = cls()
+        conn.execute("BEGIN")  # mọi SELECT dưới đây thấy cùng 1 lần commit của ETL
+        try:
+            state.last_id = conn.execute(
+                "SELECT COALESCE(MAX(max_request_id), 0) FROM fact_partitions"
+            ).fetchone()[0]
+
+            df = pd.read_sql_query("SELECT minute, status_type, requests FROM rollup_minute_status", conn)
+            keys = zip(pd.to_datetime(df["minute"], utc=True), df["status_type"])
+            state.minute_status = Counter(dict(zip(keys, df["requests"].tolist())))
+            state.rows = int(df["requests"].sum())
+
+            state.path_4xx = Counter(dict(conn.execute("SELECT path, requests FROM rollup_path_4xx")))
+            # sketch theo ngày phủ toàn bộ lịch sử; gộp các status_type
+            for path, text in conn.execute(
+                "SELECT key, sketch FROM sketch_bucket WHERE grain = 'day' AND kind = 'wait_ms'"
+            ):
+                merge_into(state.path_wait, {path: loads("wait_ms", text)})
+            count, total = conn.execute(
+                "SELECT COALESCE(SUM(wait_count), 0), TOTAL(wait_sum) FROM rollup_path_wait"
+            ).fetchone()
+            state.wait = [count, total]
+
+            # rollup không có theo URL -> tấn công đếm từ fact (1 lần, khi khởi tạo)
+            df = pd.read_sql_query(
+                "SELECT t.minute_ts AS minute, u.attack_category, COUNT(*) AS requests "
+                "FROM fact_requests f JOIN dim_time t ON f.time_id = t.time_id "
+                "JOIN dim_url u ON f.url_id = u.url_id "
+                "WHERE u.attack_category != ? AND f.request_id <= ? GROUP BY 1, 2",
+                conn, params=(BENIGN, state.last_id),
+            )
+            keys = zip(pd.to_datetime(df["minute"], utc=True), df["attack_category"])
+            state.attacks = Counter(dict(zip(keys, df["requests"].tolist())))
+
+            raw = pd.read_sql_query(
+                FACT_ROWS_QUERY.format(source=fact_source(conn)) + f" LIMIT {RAW_ROWS}",
+                conn, params=(0, state.last_id),
+            )
+            state.raw = raw.assign(time=pd.to_datetime(raw["time"], format="ISO8601", utc=True))[RAW_COLUMNS]
+        finally:
+            conn.execute("COMMIT")
+        return state
+
+    def refresh(self, conn, chunksize=DELTA_CHUNK):
+        """Cộng các fact mới (request_id > last_id) từ DWH. Trả về số fact mới"""
+        with self.lock:
+            hi = conn.execute("SELECT COALESCE(MAX(max_request_id), 0) FROM fact_partitions").fetchone()[0]
+            if hi <= self.last_id:
+                return 0
+            # chỉ partition có fact sau watermark; request_id là khoá chính nên WHERE là range seek
+            chunks = pd.read_sql_query(
+                FACT_ROWS_QUERY.format(source=fact_source(conn, after_id=self.last_id)),
+                conn, params=(self.last_id, hi), chunksize=chunksize,
+            )
+            n = 0
+            for chunk in chunks:
+                self.update(chunk.assign(time=pd.to_datetime(chunk["time"], format="ISO8601", utc=True)))
+                n += len(chunk)
+            # partition đã drop (retention) có thể làm hụt id; watermark vẫn tiến tới hi
+            self.last_id = max(self.last_id, hi)
+            return n
+
+    # ==== PANEL ====
+
+    def panels(self):
+        """Số liệu panel (cùng key với app.panels_from_frame, trừ df_anomalies)"""
+        with self.lock:
+            by_key = pd.Series(self.minute_status, dtype="int64")
+            path_4xx = pd.Series(self.path_4xx, dtype="int64")
+            df_slow = quantile_frame(self.path_wait)
+            attacks = pd.Series(self.attacks, dtype="int64")
+            raw = self.raw
+            rows, (wait_count, wait_sum) = self.rows, self.wait
+
+        if by_key.empty:
+            df_time = pd.DataFrame({"time": pd.to_datetime([], utc=True), "count": []})
+            by_status = pd.Series(dtype="int64")
+        else:
+            # resample để các phút không có request vẫn có điểm = 0
+            df_time = (
+                by_key.groupby(level=0).sum().sort_index()
+                      .resample("1min").sum()
+                      .rename_axis("time").reset_index(name="count")
+            )
+            by_status = by_key.groupby(level=1).sum().sort_index()
+
+        top_susp = path_4xx[path_4xx > 0].sort_values(ascending=False, kind="stable")
+
+        if attacks.empty:
+            df_attacks = pd.DataFrame(columns=["time", "attack_category", "count"])
+        else:
+            df_attacks = (
+                attacks.sort_index()
+                       .rename_axis(["time", "attack_category"])
+                       .reset_index(name="count")
+            )
+
+        return {
+            "total": rows,
+            "n_4xx": int(by_status.get("4xx", 0)),
+            "n_5xx": int(by_status.get("5xx", 0)),
+            "avg_wait": wait_sum / wait_count if wait_count else float("nan"),
+            "df_time": df_time,
+            "df_status": by_status.rename_axis("status_type").reset_index(name="count"),
+            "top_susp": top_susp.rename_axis("path").reset_index(name="count"),
+            "df_slow": df_slow,
+            "df_raw": raw,
+            "df_attacks": df_attacks,
+        }
@@ -0,0 +1,142 @@
+"""Ghi log request ra CSV theo lô, dùng chung cho các logger và addon mitmproxy.
+
+write() chỉ thêm 1 tuple vào buffer trong RAM rồi trả về ngay; 1 thread nền
+gom buffer và ghi ra file khi đủ `flush_rows` dòng hoặc sau `flush_interval`
+giây, mỗi lần là 1 lần open + 1 lần write thay vì open/close cho từng dòng.
+Buffer được ghi nốt khi process thoát (atexit) hoặc khi gọi close().
+
+Nhiều producer cùng ghi 1 file vẫn an toàn: trong 1 process dùng chung 1 sink
+(get_sink), giữa các process thì mỗi lần flush khoá file (flock) và ghi ở chế
+độ append, nên các dòng không bị xen lẫn.
+"""
+import atexit
+import csv
+import io
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ dựa vào chế độ append
+    fcntl = None
+
+LOG_PATH = Path("data/raw/log_parsed.csv")
+HEADER = ["time", "method", "url", "status", "mimeType", "wait_ms"]
+
+FLUSH_ROWS     = 1_000
+FLUSH_INTERVAL = 1.0
+
+
+class _Clock:
+    """Timestamp ISO UTC dạng 'YYYY-MM-DDTHH:MM:SS.ffffffZ'; phần tới giây chỉ
+    format lại khi sang giây mới.
+
+    (giây, prefix) là 1 tuple đọc / gán nguyên khối, nên nhiều producer gọi now()
+    cùng lúc không ghép prefix của giây này với phần lẻ của giây khác.
+    """
+
+    def __init__(self):
+        self.cached = (None, "")
+
+    def now(self):
+        t = time.time()
+        sec = int(t)
+        cached = self.cached
+        if cached[0] != sec:
+            cached = self.cached = (sec, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec)))
+        return f"{cached[1]}.{int((t - sec) * 1e6):06d}Z"
+
+
+class LogSink:
+    def __init__(self, path=LOG_PATH, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.clock = _Clock()
+
+        self._rows = []
+        self._lock = threading.Lock()        # bảo vệ buffer
+        self._write_lock = threading.Lock()  # 1 lần ghi file tại 1 thời điểm
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, method, url, status, mime, wait_ms, ts=None):
+        """Thêm 1 dòng log; không chạm tới đĩa"""
+        row = (ts or self.clock.now(), method, url, status, mime, wait_ms)
+        with self._lock:
+            self._rows.append(row)
+            n = len(self._rows)
+        if n >= self.flush_rows:
+            self._wake.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Ghi toàn bộ buffer hiện có ra file"""
+        with self._write_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+
+            text = io.StringIO()
+            csv.writer(text).writerows(rows)
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", newline="", encoding="utf8") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    # header chỉ ghi khi file còn rỗng (kiểm tra sau khi đã khoá)
+                    if f.seek(0, io.SEEK_END) == 0:
+                        csv.writer(f).writerow(HEADER)
+                    f.write(text.getvalue())
+                    f.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def close(self):
+        """Dừng thread nền và ghi nốt buffer (gọi nhiều lần không sao)"""
+        if not self._closed:
+            self._closed = True
+            self._wake.set()
+            self._thread.join()
+        self.flush()
+
+
+_SINKS = {}
+_SINKS_LOCK = threading.Lock()
+
+
+def get_sink(path=LOG_PATH, **kwargs):
+    """Sink dùng chung cho mỗi file trong 1 process; sink đã close() được thay bằng sink mới"""
+    key = Path(path).resolve()
+    with _SINKS_LOCK:
+        if key not in _SINKS or _SINKS[key]._closed:
+            _SINKS[key] = LogSink(path, **kwargs)
+        return _SINKS[key]
+
+
+class LazySink:
+    """Gọi get_sink ở lần write đầu tiên: module chỉ được import để lấy hằng số
+    (VD danh sách URL) không khởi thread nền hay tạo file log"""
+
+    def __init__(self, path=LOG_PATH, **kwargs):
+        self.path = path
+        self.kwargs = kwargs
+        self._sink = None
+
+    def write(self, *args, **kwargs):
+        sink = self._sink
+        if sink is None or sink._closed:
+            sink = self._sink = get_sink(self.path, **self.kwargs)
+        sink.write(*args, **kwargs)
@@ -0,0 +1,190 @@
+"""Fact chia partition theo ngày.
+
+Mỗi ngày (theo time_id, UTC) là 1 bảng fact_requests_YYYYMMDD cùng cấu trúc với
+fact_requests_template trong schema.sql, kèm bộ index riêng. Danh mục nằm ở
+bảng fact_partitions; view fact_requests = UNION ALL các partition còn giữ nên
+query cũ vẫn chạy được, còn query theo khoảng thời gian dùng fact_source() để
+chỉ đọc các partition liên quan.
+
+Xoá dữ liệu cũ = DROP TABLE 1 partition (retention.py), không cần DELETE lớn.
+SQLite giới hạn 500 vế cho 1 UNION ALL (lỗi chỉ hiện lúc query view), nên quá
+500 partition thì _union lồng thành UNION ALL của các subquery ≤500 vế.
+"""
+import re
+
+import pandas as pd
+
+TEMPLATE = "fact_requests_template"
+VIEW     = "fact_requests"
+# SQLITE_MAX_COMPOUND_SELECT mặc định
+MAX_COMPOUND = 500
+
+FACT_COLUMNS = [
+    "request_id", "event_ms", "time_id", "url_id", "status_id", "method_id", "mime_id", "wait_ms",
+]
+
+# Index theo pattern query của dashboard / điều tra (check_query_plans.py kiểm tra
+# các query này không quay về full scan)
+PARTITION_INDEXES = {
+    "time": "time_id",
+    "status_time": "status_id, time_id",
+    "url_status": "url_id, status_id",
+    # covering cho count/sum/min/max wait_ms theo path và điều tra 1 URL theo thời gian
+    "url_time_wait": "url_id, time_id, wait_ms",
+}
+
+
+def partition_name(day):
+    """epoch day -> 'fact_requests_YYYYMMDD'"""
+    return f"{VIEW}_{pd.Timestamp(day, unit='D'):%Y%m%d}"
+
+
+def live_partitions(conn, lo=None, hi=None, after_id=None):
+    """Tên các partition còn giữ, theo thứ tự ngày.
+
+    lo / hi: khoảng time_id (epoch minute) [lo, hi); after_id: chỉ partition có
+    request_id > after_id. None = không lọc theo tiêu chí đó.
+    """
+    rows = conn.execute(
+        """
+        SELECT name FROM fact_partitions
+        WHERE dropped_at IS NULL
+          AND (? IS NULL OR day >= ? / 1440)
+          AND (? IS NULL OR day <= (? - 1) / 1440)
+          AND (? IS NULL OR max_request_id > ?)
+        ORDER BY day
+        """,
+        (lo, lo, hi, hi, after_id, after_id),
+    )
+    return [name for (name,) in rows]
+
+
+def _union(names):
+    if len(names) <= MAX_COMPOUND:
+        return " UNION ALL ".join(f"SELECT * FROM {name}" for name in names)
+    # mỗi nhóm 500 partition là 1 subquery (quá 500 nhóm thì nhóm to hơn, tự lồng
+    # thêm 1 tầng); planner vẫn đẩy WHERE xuống từng partition
+    step = max(MAX_COMPOUND, -(-len(names) // MAX_COMPOUND))
+    return " UNION ALL ".join(
+        f"SELECT * FROM ({_union(names[i:i + step])})" for i in range(0, len(names), step)
+    )
+
+
+def fact_source(conn, lo=None, hi=None, after_id=None):
+    """Nguồn fact cho mệnh đề FROM, chỉ gồm các partition khớp bộ lọc (xem live_partitions).
+
+    Trả về tên bảng nếu chỉ có 1 partition, ngược lại là subquery UNION ALL trong
+    ngoặc; dùng như `FROM {source} f`.
+    """
+    names = live_partitions(conn, lo, hi, after_id)
+    if not names:
+        return TEMPLATE
+    if len(names) == 1:
+        return names[0]
+    return f"({_union(names)})"
+
+
+def refresh_view(conn):
+    """Tạo lại view fact_requests theo danh mục partition hiện tại"""
+    body = _union(live_partitions(conn)) or f"SELECT * FROM {TEMPLATE}"
+    conn.execute(f"DROP VIEW IF EXISTS {VIEW}")
+    conn.execute(f"CREATE VIEW {VIEW} AS {body}")
+
+
+def create_indexes(conn, name):
+    for suffix, columns in PARTITION_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{name}_{suffix} ON {name} ({columns})")
+
+
+def create_all_indexes(conn):
+    """Build index cho mọi partition còn giữ (sau bulk load)"""
+    for name in live_partitions(conn):
+        create_indexes(conn, name)
+
+
+def _partition_ddl(conn, name):
+    sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (TEMPLATE,)
+    ).fetchone()[0]
+    return re.sub(rf"^CREATE TABLE {TEMPLATE}\b", f"CREATE TABLE IF NOT EXISTS {name}", sql)
+
+
+def drop_partition(conn, name):
+    """DROP TABLE 1 partition (kèm index), đánh dấu trong danh mục. Gọi refresh_view sau đó"""
+    conn.execute(f"DROP TABLE IF EXISTS {name}")
+    conn.execute(
+        "UPDATE fact_partitions SET dropped_at = datetime('now') WHERE name = ?", (name,)
+    )
+
+
+class FactPartitions:
+    """Ghi fact vào partition theo ngày và cấp request_id tăng dần.
+
+    request_id tiếp tục từ max_request_id lớn nhất trong danh mục (kể cả partition
+    đã drop), nên watermark theo request_id (export Parquet) không bị lùi.
+    """
+
+    def __init__(self, cur, indexes=True):
+        """indexes=False: partition mới tạo chưa có index (bulk load, build sau bằng create_all_indexes)"""
+        self.cur = cur
+        self.indexes = indexes
+        max_id = cur.execute("SELECT MAX(max_request_id) FROM fact_partitions").fetchone()[0]
+        self.next_id = (max_id or 0) + 1
+        self.created = 0
+
+    def _ensure(self, day):
+        """Tạo partition nếu chưa có hoặc đã bị drop (dữ liệu đến trễ); trả về tên bảng"""
+        name = partition_name(day)
+        row = self.cur.execute("SELECT dropped_at FROM fact_partitions WHERE name = ?", (name,)).fetchone()
+        if row is not None and row[0] is None:
+            return name
+
+        self.cur.execute(_partition_ddl(self.cur, name))
+        if self.indexes:
+            create_indexes(self.cur, name)
+        # partition tạo lại sau khi drop: đếm lại từ đầu (file archive cũ vẫn còn trên đĩa),
+        # số dòng đã drop cộng vào compacted_rows để còn so được với rollup của ngày
+        self.cur.execute(
+            """
+            INSERT INTO fact_partitions (name, day, rows, compacted_rows) VALUES (?, ?, 0, 0)
+            ON CONFLICT (name) DO UPDATE SET
+                compacted_rows = COALESCE(compacted_rows, 0) + rows,
+                rows = 0, min_request_id = NULL, max_request_id = NULL,
+                archive_path = NULL, dropped_at = NULL
+            """,
+            (name, day),
+        )
+        refresh_view(self.cur)
+        self.created += 1
+        return name
+
+    def insert(self, facts):
+        """Insert các fact (DataFrame đủ FACT_COLUMNS trừ request_id, theo thứ tự nạp).
+
+        Trả về số dòng đã insert.
+        """
+        n = len(facts)
+        if not n:
+            return 0
+        facts = facts.assign(request_id=range(self.next_id, self.next_id + n))[FACT_COLUMNS]
+        self.next_id += n
+
+        placeholders = ", ".join("?" * len(FACT_COLUMNS))
+        for day, part in facts.groupby(facts["time_id"] // 1440, sort=True):
+            name = self._ensure(int(day))
+            rows = part.astype(object).where(part.notna(), None)
+            self.cur.executemany(
+                f"INSERT INTO {name} ({', '.join(FACT_COLUMNS)}) VALUES ({placeholders})",
+                rows.itertuples(index=False, name=None),
+            )
+            self.cur.execute(
+                """
+                UPDATE fact_partitions SET
+                    rows = rows + ?,
+                    min_request_id = COALESCE(min_request_id, ?),
+                    max_request_id = ?
+                WHERE name = ?
+                """,
+                (len(part), int(part["request_id"].iloc[0]), int(part["request_id"].iloc[-1]), name),
+            )
+        return n
@@ -0,0 +1,53 @@
+"""SQL các panel dashboard (app.py) đọc DWH.
+
+Tách khỏi app.py (import streamlit) để check_query_plans.py / tests kiểm tra
+query plan của đúng các câu dashboard chạy. Placeholder:
+{source} = partitions.fact_source(...), {marks} = "?, ?" theo số status_type chọn.
+Tham số: MINUTE_QUERY / ANOMALY_QUERY (phút_lo, phút_hi, *status_types) dạng
+'YYYY-MM-DD HH:MM'; ATTACKS_QUERY / RAW_QUERY (time_id_lo, time_id_hi, *status_types).
+"""
+from detection import BENIGN
+
+FACT_JOIN = """
+FROM {source} f
+JOIN dim_time   t ON f.time_id = t.time_id
+JOIN dim_url    u ON f.url_id = u.url_id
+JOIN dim_status s ON f.status_id = s.status_id
+LEFT JOIN dim_method m  ON f.method_id = m.method_id
+LEFT JOIN dim_mime   mt ON f.mime_id = mt.mime_id
+"""
+# slider bước 1 phút nên lọc thẳng time_id (epoch minute), dùng được index time_id của partition
+FACT_WHERE = "WHERE f.time_id >= ? AND f.time_id < ? AND s.status_type IN ({marks})"
+
+MINUTE_QUERY = """
+SELECT minute, status_type, requests FROM rollup_minute_status
+WHERE minute >= ? AND minute < ? AND status_type IN ({marks})
+"""
+
+ATTACKS_QUERY = f"""
+SELECT t.minute_ts AS minute,
+       u.attack_category, COUNT(*) AS count
+{FACT_JOIN} {FACT_WHERE} AND u.attack_category != '{BENIGN}'
+GROUP BY 1, 2
+"""
+
+RAW_QUERY = f"""
+SELECT f.request_id, strftime('%Y-%m-%dT%H:%M:%fZ', f.event_ms / 1000.0, 'unixepoch') AS time,
+       u.url, u.path, s.status_code, s.status_type, m.method, mt.mime_type, f.wait_ms
+{FACT_JOIN} {FACT_WHERE}
+ORDER BY f.request_id
+LIMIT 500
+"""
+
+# anomaly do ETL ghi sẵn (anomaly.py); chuỗi status_type chỉ lấy nhóm đang chọn
+ANOMALY_QUERY = """
+SELECT minute, dimension, key, count, baseline, zscore FROM anomalies
+WHERE minute >= ? AND minute < ?
+  AND (dimension != 'status_type' OR key IN ({marks}))
+ORDER BY minute, zscore DESC
+"""
+
+
+def marks(values):
+    """'?, ?, ...' cho mệnh đề IN theo số phần tử của values"""
+    return ", ".join("?" * len(values))
@@ -0,0 +1,157 @@
+"""Retention và compaction cho fact chia partition theo ngày (partitions.py).
+
+- compaction (--archive-after N): partition cũ hơn N ngày được ghi ra file nén
+  trong data/dwh/archive/ (Parquet zstd, không có pyarrow thì CSV gzip, cùng cột
+  với dwh_requests.csv) rồi DROP. Rollup đã được cộng dồn lúc nạp nên số liệu
+  dashboard theo phút / path vẫn còn; trước khi drop kiểm tra số dòng partition
+  (cộng dòng của các lần partition đó đã bị drop trước đây, compacted_rows) khớp
+  rollup_minute_status của ngày đó.
+- retention (--retention-days N): partition cũ hơn N ngày bị DROP luôn, không
+  archive. Mỗi partition là 1 DROP TABLE, không có DELETE lớn.
+
+"Cũ" tính theo ngày mới nhất đã nạp chứ không theo đồng hồ máy, để nạp bù log
+cũ hay log giả lập không bị xoá ngay. Trang trống sau khi drop được trả về OS
+bằng PRAGMA incremental_vacuum (DWH tạo từ schema.sql có auto_vacuum INCREMENTAL).
+
+    python src/retention.py --list
+    python src/retention.py --archive-after 30 --retention-days 90
+"""
+import argparse
+import gzip
+from pathlib import Path
+
+import pandas as pd
+
+import etl
+from partitions import drop_partition, refresh_view
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # archive bằng CSV gzip
+    pa = pq = None
+
+ARCHIVE_DIR = etl.DWH_DIR / "archive"
+ARCHIVE_CHUNK_SIZE = 500_000
+
+
+def list_partitions(conn):
+    return pd.read_sql_query(
+        "SELECT name, day, rows, compacted_rows, min_request_id, max_request_id, archive_path, dropped_at "
+        "FROM fact_partitions ORDER BY day",
+        conn,
+    )
+
+
+def expired_partitions(conn, keep_days):
+    """Partition còn giữ, cũ hơn keep_days ngày so với ngày mới nhất: [(name, day)]"""
+    return conn.execute(
+        """
+        SELECT name, day FROM fact_partitions
+        WHERE dropped_at IS NULL
+          AND day <= (SELECT MAX(day) FROM fact_partitions WHERE dropped_at IS NULL) - ?
+        ORDER BY day
+        """,
+        (keep_days,),
+    ).fetchall()
+
+
+def rollup_matches(conn, name, day):
+    """Số fact của ngày (partition hiện tại + phần đã drop trước đó) có khớp tổng
+    rollup_minute_status của ngày đó không"""
+    n_rows = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+    n_rows += conn.execute(
+        "SELECT COALESCE(compacted_rows, 0) FROM fact_partitions WHERE name = ?", (name,)
+    ).fetchone()[0]
+    first = pd.Timestamp(day, unit="D")
+    n_rollup = conn.execute(
+        "SELECT COALESCE(SUM(requests), 0) FROM rollup_minute_status WHERE minute >= ? AND minute < ?",
+        (f"{first:%Y-%m-%d} 00:00", f"{first + pd.Timedelta(days=1):%Y-%m-%d} 00:00"),
+    ).fetchone()[0]
+    return n_rows == n_rollup
+
+
+def archive_partition(conn, name, out_dir=ARCHIVE_DIR, chunksize=ARCHIVE_CHUNK_SIZE):
+    """Ghi raw fact (đã join dim) của 1 partition ra file nén, trả về đường dẫn"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    min_id = conn.execute(f"SELECT MIN(request_id) FROM {name}").fetchone()[0] or 0
+    # request_id đầu tiên trong tên file: partition tạo lại (dữ liệu trễ) không ghi đè file cũ
+    path = out_dir / f"{name}-{min_id:012d}.{'parquet' if pq is not None else 'csv.gz'}"
+
+    chunks = pd.read_sql_query(
+        etl.EXPORT_QUERY.format(source=name, where=""), conn, chunksize=chunksize
+    )
+    if pq is None:
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(f, index=False, header=i == 0)
+        return path
+
+    writer = schema = None
+    try:
+        for chunk in chunks:
+            chunk = chunk.assign(time=pd.to_datetime(chunk["time"], format="ISO8601", utc=True))
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(str(path), schema, compression="zstd")
+            writer.write_table(table.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
+
+
+def _finish(conn):
+    refresh_view(conn)
+    conn.commit()
+    # qua execute() sqlite3 chỉ step 1 lần = trả về 1 trang; executescript chạy hết
+    conn.executescript("PRAGMA incremental_vacuum;")
+
+
+def compact(conn, archive_after, out_dir=ARCHIVE_DIR):
+    """Archive rồi drop các partition cũ hơn archive_after ngày. Trả về danh sách partition đã drop"""
+    done = []
+    for name, day in expired_partitions(conn, archive_after):
+        if not rollup_matches(conn, name, day):
+            print(f"! {name}: số dòng không khớp rollup_minute_status, giữ lại partition")
+            continue
+        path = archive_partition(conn, name, out_dir)
+        conn.execute("UPDATE fact_partitions SET archive_path = ? WHERE name = ?", (str(path), name))
+        drop_partition(conn, name)
+        done.append(name)
+        print(f"- {name} -> {path}")
+    _finish(conn)
+    return done
+
+
+def apply_retention(conn, keep_days):
+    """Drop (không archive) các partition cũ hơn keep_days ngày. Trả về danh sách partition đã drop"""
+    done = []
+    for name, _ in expired_partitions(conn, keep_days):
+        drop_partition(conn, name)
+        done.append(name)
+        print(f"- drop {name}")
+    _finish(conn)
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retention / compaction cho fact chia partition theo ngày")
+    parser.add_argument("--list", action="store_true", help="in danh mục partition")
+    parser.add_argument("--archive-after", type=int, help="archive + drop partition cũ hơn N ngày")
+    parser.add_argument("--retention-days", type=int, help="drop (không archive) partition cũ hơn N ngày")
+    parser.add_argument("--archive-dir", type=Path, default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    conn = etl.connect()
+    if args.archive_after is not None:
+        print(f"Compaction: partition cũ hơn {args.archive_after} ngày")
+        compact(conn, args.archive_after, args.archive_dir)
+    if args.retention_days is not None:
+        print(f"Retention: partition cũ hơn {args.retention_days} ngày")
+        apply_retention(conn, args.retention_days)
+    if args.list or (args.archive_after is None and args.retention_days is None):
+        print(list_partitions(conn).to_string(index=False))
+    conn.close()
@@ -0,0 +1,95 @@
+"""Rollup phục vụ dashboard, được etl cập nhật incremental mỗi lần nạp fact.
+
+- rollup_minute_status: số request theo phút × status_type
+- rollup_path_4xx:      số request 4xx theo path
+- rollup_path_wait:     count/sum/min/max wait_ms theo path
+"""
+import numpy as np
+import pandas as pd
+
+UPSERT_MINUTE_STATUS = """
+INSERT INTO rollup_minute_status (minute, status_type, requests) VALUES (?, ?, ?)
+ON CONFLICT (minute, status_type) DO UPDATE SET requests = requests + excluded.requests
+"""
+
+UPSERT_PATH_4XX = """
+INSERT INTO rollup_path_4xx (path, requests) VALUES (?, ?)
+ON CONFLICT (path) DO UPDATE SET requests = requests + excluded.requests
+"""
+
+# MIN/MAX của SQLite trả NULL nếu 1 vế NULL -> COALESCE để bỏ qua path chưa có wait_ms
+UPSERT_PATH_WAIT = """
+INSERT INTO rollup_path_wait (path, requests, wait_count, wait_sum, wait_min, wait_max)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (path) DO UPDATE SET
+    requests   = requests + excluded.requests,
+    wait_count = wait_count + excluded.wait_count,
+    wait_sum   = wait_sum + excluded.wait_sum,
+    wait_min   = MIN(COALESCE(wait_min, excluded.wait_min), COALESCE(excluded.wait_min, wait_min)),
+    wait_max   = MAX(COALESCE(wait_max, excluded.wait_max), COALESCE(excluded.wait_max, wait_max))
+"""
+
+
+def _rows(frame):
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.itertuples(index=False, name=None)
+
+
+def update_rollups(cur, facts):
+    """Cộng dồn 1 lô fact vào các bảng rollup.
+
+    facts: DataFrame các fact vừa nạp, cần cột minute, status_type, path, wait_ms.
+    """
+    if facts.empty:
+        return
+
+    by_minute = facts.groupby(["minute", "status_type"]).size().reset_index()
+    cur.executemany(UPSERT_MINUTE_STATUS, _rows(by_minute))
+
+    by_path_4xx = facts[facts["status_type"] == "4xx"].groupby("path").size().reset_index()
+    cur.executemany(UPSERT_PATH_4XX, _rows(by_path_4xx))
+
+    by_path_wait = (
+        facts.groupby("path")["wait_ms"]
+        .agg(["size", "count", "sum", "min", "max"])
+        .reset_index()
+    )
+    cur.executemany(UPSERT_PATH_WAIT, _rows(by_path_wait))
+
+
+def rebuild_rollups(conn):
+    """Tính lại toàn bộ rollup từ fact_requests (DWH cũ chưa có rollup)"""
+    conn.executescript("""
+    DELETE FROM rollup_minute_status;
+    DELETE FROM rollup_path_4xx;
+    DELETE FROM rollup_path_wait;
+
+    INSERT INTO rollup_minute_status (minute, status_type, requests)
+    SELECT t.minute_ts, s.status_type, COUNT(*)
+    FROM fact_requests f
+    JOIN dim_time   t ON f.time_id = t.time_id
+    JOIN dim_status s ON f.status_id = s.status_id
+    GROUP BY 1, 2;
+
+    INSERT INTO rollup_path_4xx (path, requests)
+    SELECT u.path, COUNT(*)
+    FROM fact_requests f
+    JOIN dim_url    u ON f.url_id = u.url_id
+    JOIN dim_status s ON f.status_id = s.status_id
+    WHERE s.status_type = '4xx'
+    GROUP BY u.path;
+
+    INSERT INTO rollup_path_wait (path, requests, wait_count, wait_sum, wait_min, wait_max)
+    SELECT u.path, COUNT(*), COUNT(f.wait_ms), TOTAL(f.wait_ms), MIN(f.wait_ms), MAX(f.wait_ms)
+    FROM fact_requests f
+    JOIN dim_url u ON f.url_id = u.url_id
+    GROUP BY u.path;
+    """)
+
+
+def minute_key(minutes):
+    """Khoá phút 'YYYY-MM-DD HH:MM' từ Series epoch minute (time_id của dim_time);
+    chỉ format các phút distinct"""
+    codes, uniq = pd.factorize(minutes)
+    labels = pd.to_datetime(np.asarray(uniq, dtype="int64"), unit="m").strftime("%Y-%m-%d %H:%M")
+    return pd.Series(np.asarray(labels, dtype=object)[codes], index=minutes.index)
@@ -1,6 +1,9 @@
+-- auto_vacuum chỉ có tác dụng với DB mới: DROP partition xong trả trang trống
+-- về OS bằng PRAGMA incremental_vacuum (retention.py)
+PRAGMA auto_vacuum = INCREMENTAL;
+
 -- STAGING: log thô đã parse từ CSV
-DROP TABLE IF EXISTS stg_logs;
-CREATE TABLE stg_logs (
+CREATE TABLE IF NOT EXISTS stg_logs (
     row_id    INTEGER PRIMARY KEY AUTOINCREMENT,
     time      TEXT,
     method    TEXT,
@@ -11,50 +14,160 @@ CREATE TABLE stg_logs (
 );
 
 -- Bảng ghi lỗi chất lượng dữ liệu
-DROP TABLE IF EXISTS dq_issues;
-CREATE TABLE dq_issues (
+CREATE TABLE IF NOT EXISTS dq_issues (
     issue_id   INTEGER PRIMARY KEY AUTOINCREMENT,
     stg_row_id INTEGER,
     issue_type TEXT,
     detail     TEXT
 );
 
--- Dimension time
-DROP TABLE IF EXISTS dim_time;
-CREATE TABLE dim_time (
-    time_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    ts      TEXT UNIQUE,   -- original timestamp
-    date    TEXT,
-    hour    INTEGER,
-    minute  INTEGER
+-- Dimension time: 1 dòng mỗi phút, time_id chính là epoch minute (UTC)
+CREATE TABLE IF NOT EXISTS dim_time (
+    time_id   INTEGER PRIMARY KEY,   -- event_ms / 60000
+    minute_ts TEXT,                  -- 'YYYY-MM-DD HH:MM'
+    date      TEXT,
+    hour      INTEGER,
+    minute    INTEGER
 );
 
 -- Dimension url
-DROP TABLE IF EXISTS dim_url;
-CREATE TABLE dim_url (
+CREATE TABLE IF NOT EXISTS dim_url (
     url_id  INTEGER PRIMARY KEY AUTOINCREMENT,
-    url     TEXT UNIQUE,
+    url     TEXT,
     domain  TEXT,
     path    TEXT,
-    query   TEXT
+    query   TEXT,
+    attack_category TEXT   -- sqli / xss / lfi / ... / 'none' (detection.py)
 );
 
 -- Dimension status
-DROP TABLE IF EXISTS dim_status;
-CREATE TABLE dim_status (
+CREATE TABLE IF NOT EXISTS dim_status (
     status_id   INTEGER PRIMARY KEY AUTOINCREMENT,
-    status_code INTEGER UNIQUE,
+    status_code INTEGER,
     status_type TEXT          -- 2xx / 3xx / 4xx / 5xx
 );
 
--- Fact table
-DROP TABLE IF EXISTS fact_requests;
-CREATE TABLE fact_requests (
-    request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+-- Dimension method / mime: giá trị lặp lại hàng triệu lần, fact chỉ giữ id
+CREATE TABLE IF NOT EXISTS dim_method (
+    method_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    method    TEXT
+);
+
+CREATE TABLE IF NOT EXISTS dim_mime (
+    mime_id   INTEGER PRIMARY KEY AUTOINCREMENT,
+    mime_type TEXT
+);
+
+-- Natural key của dimension (chế độ bulk load drop rồi build lại sau khi nạp)
+CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_url_url ON dim_url (url);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_status_code ON dim_status (status_code);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_method_method ON dim_method (method);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_mime_mime_type ON dim_mime (mime_type);
+
+-- Fact table: chia partition theo ngày (partitions.py). Mỗi ngày 1 bảng
+-- fact_requests_YYYYMMDD tạo theo đúng cấu trúc bảng mẫu dưới đây (luôn rỗng),
+-- view fact_requests = UNION ALL các partition còn giữ.
+CREATE TABLE IF NOT EXISTS fact_requests_template (
+    request_id INTEGER PRIMARY KEY,   -- cấp tăng dần bởi partitions.FactPartitions
+    event_ms   INTEGER,   -- epoch milliseconds (UTC)
     time_id    INTEGER,
     url_id     INTEGER,
     status_id  INTEGER,
-    method     TEXT,
-    mime_type  TEXT,
+    method_id  INTEGER,   -- NULL nếu log không có method
+    mime_id    INTEGER,   -- NULL nếu log không có mimeType
     wait_ms    REAL
 );
+
+-- Danh mục partition; dòng của partition đã drop được giữ lại (dropped_at)
+CREATE TABLE IF NOT EXISTS fact_partitions (
+    name           TEXT PRIMARY KEY,   -- fact_requests_YYYYMMDD
+    day            INTEGER,            -- epoch day = time_id // 1440
+    rows           INTEGER,
+    compacted_rows INTEGER DEFAULT 0,  -- dòng của các lần partition trước đã drop (tạo lại do dữ liệu trễ)
+    min_request_id INTEGER,
+    max_request_id INTEGER,
+    archive_path   TEXT,               -- file nén raw fact (retention.py), NULL nếu chưa archive
+    dropped_at     TEXT                -- NULL = bảng còn trong DB
+);
+
+-- Điều tra theo path ("mọi request tới /.git/config trong 1 giờ qua")
+CREATE INDEX IF NOT EXISTS ix_dim_url_path ON dim_url (path);
+
+-- Metadata ETL: high-water mark cho chế độ incremental
+CREATE TABLE IF NOT EXISTS etl_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- Báo cáo mỗi lần chạy etl.py (instrument.py): thời gian / counter theo stage
+-- nằm trong report (JSON), các cột còn lại để lọc nhanh
+CREATE TABLE IF NOT EXISTS etl_runs (
+    run_id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at     TEXT NOT NULL,      -- ISO UTC
+    finished_at    TEXT,
+    command        TEXT,
+    status         TEXT,               -- ok / failed
+    seconds        REAL,
+    rows_in        INTEGER,            -- dòng staging đã xử lý
+    rows_out       INTEGER,            -- dòng vào fact
+    rejected       INTEGER,
+    sql_statements INTEGER,
+    sql_seconds    REAL,
+    report         TEXT
+);
+
+-- Rollup cho dashboard: etl cập nhật incremental mỗi lần nạp thêm fact
+CREATE TABLE IF NOT EXISTS rollup_minute_status (
+    minute      TEXT,      -- 'YYYY-MM-DD HH:MM'
+    status_type TEXT,
+    requests    INTEGER,
+    PRIMARY KEY (minute, status_type)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_path_4xx (
+    path     TEXT PRIMARY KEY,
+    requests INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS rollup_path_wait (
+    path       TEXT PRIMARY KEY,
+    requests   INTEGER,
+    wait_count INTEGER,    -- số request có wait_ms
+    wait_sum   REAL,
+    wait_min   REAL,
+    wait_max   REAL
+);
+
+-- Sketch top-K path / phân vị wait_ms theo giờ và ngày (sketches.py), merge được
+-- giữa các bucket; cập nhật cùng transaction với fact như rollup
+CREATE TABLE IF NOT EXISTS sketch_bucket (
+    grain       TEXT,      -- 'hour' / 'day'
+    bucket      TEXT,      -- 'YYYY-MM-DD HH' / 'YYYY-MM-DD'
+    status_type TEXT,
+    kind        TEXT,      -- top_path (Space-Saving) / wait_ms (DDSketch theo path)
+    key         TEXT,      -- path với wait_ms, '' với top_path
+    sketch      TEXT,      -- JSON
+    PRIMARY KEY (grain, bucket, status_type, kind, key)
+);
+
+-- Anomaly phát hiện bởi anomaly.py (cửa sổ trượt theo phút)
+CREATE TABLE IF NOT EXISTS anomalies (
+    anomaly_id  INTEGER PRIMARY KEY AUTOINCREMENT,
+    minute      TEXT,      -- 'YYYY-MM-DD HH:MM'
+    dimension   TEXT,      -- global / path / status_type / attack
+    key         TEXT,
+    count       INTEGER,
+    baseline    REAL,      -- mean của cửa sổ trước phút đó
+    zscore      REAL,
+    detected_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS ix_anomalies_minute ON anomalies(minute);
+
+-- Trạng thái detector (ring buffer mỗi chuỗi) để lần ETL sau chạy tiếp
+CREATE TABLE IF NOT EXISTS anomaly_state (
+    dimension TEXT,
+    key       TEXT,
+    state     TEXT,        -- JSON
+    PRIMARY KEY (dimension, key)
+);
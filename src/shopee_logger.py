@@ -1,10 +1,12 @@
-import csv
 import time
 from datetime import datetime
 from pathlib import Path
 import requests
 
+from log_sink import LazySink
+
 LOG_PATH = Path("data/raw/log_parsed.csv")
+SINK = LazySink(LOG_PATH)  # ghi theo lô ở thread nền, tự flush khi thoát; mở ở dòng đầu tiên
 COOKIE_PATH = Path("data/cookie/shopee_cookie.txt")
 
 USER_AGENT = (
@@ -41,23 +43,11 @@ def load_cookie():
     return cookie
 
 
-def ensure_header():
-    if not LOG_PATH.exists():
-        LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with LOG_PATH.open("w", newline="", encoding="utf8") as f:
-            w = csv.writer(f)
-            w.writerow(["time", "method", "url", "status", "mimeType", "wait_ms"])
-
-
 def log_request(method, url, status, mime, elapsed_ms):
-    ts = datetime.utcnow().isoformat() + "Z"
-    with LOG_PATH.open("a", newline="", encoding="utf8") as f:
-        w = csv.writer(f)
-        w.writerow([ts, method, url, status, mime, elapsed_ms])
+    SINK.write(method, url, status, mime, elapsed_ms)
 
 
 def main():
-    ensure_header()
 
     cookie = load_cookie()
     print("✔ Cookie loaded (rút gọn):", cookie[:50], "...")
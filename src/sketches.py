@@ -0,0 +1,376 @@
+"""Sketch xấp xỉ, cộng dồn được (mergeable), lưu vào DWH theo giờ / ngày.
+
+- SpaceSaving: top-K path (heavy hitter) với tối đa TOPK_CAPACITY counter;
+  count mỗi item là cận trên, count - error là cận dưới của số thật.
+- DDSketch: phân vị wait_ms (p50 / p95 / p99) với sai số tương đối <= DD_ALPHA;
+  count / sum / min / max giữ chính xác nên mean vẫn đúng như rollup. Tối đa
+  DD_MAX_BINS bucket (phủ giá trị trải ~1e17 lần), vượt thì gộp bucket thấp nhất.
+
+ETL cộng mỗi lô fact vào bảng sketch_bucket (cùng transaction với fact), theo
+bucket giờ và ngày × status_type: kind top_path (1 SpaceSaving, key '') và
+kind wait_ms (1 DDSketch mỗi path). Dashboard trả lời 1 khoảng thời gian bất kỳ
+bằng cách merge sketch các ngày / giờ trọn trong khoảng, chỉ phần giờ lẻ ở 2
+đầu (tối đa 2 × 59 phút) mới đọc fact -> chi phí theo số bucket chứ không theo
+số request trong khoảng.
+"""
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+from partitions import fact_source
+
+TOPK_CAPACITY = 64      # số counter của SpaceSaving (top-K chính xác khi số path <= con số này)
+DD_ALPHA      = 0.01    # sai số tương đối của DDSketch (1%)
+DD_MAX_BINS   = 2048    # số bucket tối đa của 1 DDSketch
+MIN_VALUE     = 1e-9    # wait_ms <= ngưỡng này đếm vào bucket 0
+QUANTILES     = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+# độ dài prefix của khoá phút 'YYYY-MM-DD HH:MM' -> khoá bucket
+GRAINS = {"hour": 13, "day": 10}
+
+UPSERT_SKETCH = """
+INSERT INTO sketch_bucket (grain, bucket, status_type, kind, key, sketch) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (grain, bucket, status_type, kind, key) DO UPDATE SET sketch = excluded.sketch
+"""
+
+
+class SpaceSaving:
+    """Top-K theo thuật toán Space-Saving (có trọng số), merge theo Agarwal et al."""
+
+    __slots__ = ("capacity", "counts", "errors")
+
+    def __init__(self, capacity=TOPK_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}    # item -> count ước lượng (>= số thật)
+        self.errors = {}    # item -> sai số tối đa của count
+
+    def _floor(self):
+        """Count nhỏ nhất khi đã đầy counter: item không có mặt có thể đã xuất hiện tới chừng này lần"""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def add(self, counts):
+        """Cộng {item: số lần}; item lớn trước để item nhỏ mới là thứ bị thay"""
+        for item, n in sorted(counts.items(), key=lambda kv: -kv[1]):
+            if item in self.counts:
+                self.counts[item] += n
+            elif len(self.counts) < self.capacity:
+                self.counts[item] = n
+                self.errors[item] = 0
+            else:
+                victim = min(self.counts, key=self.counts.get)
+                floor = self.counts.pop(victim)
+                del self.errors[victim]
+                self.counts[item] = floor + n
+                self.errors[item] = floor
+        return self
+
+    def merge(self, other):
+        floor, other_floor = self._floor(), other._floor()
+        counts, errors = {}, {}
+        for item in self.counts.keys() | other.counts.keys():
+            counts[item] = self.counts.get(item, floor) + other.counts.get(item, other_floor)
+            errors[item] = self.errors.get(item, floor) + other.errors.get(item, other_floor)
+        keep = sorted(counts, key=lambda item: (-counts[item], item))[:self.capacity]
+        self.counts = {item: counts[item] for item in keep}
+        self.errors = {item: errors[item] for item in keep}
+        return self
+
+    def top(self, n=10):
+        """[(item, count, error)] theo count giảm dần"""
+        items = sorted(self.counts, key=lambda item: (-self.counts[item], item))[:n]
+        return [(item, self.counts[item], self.errors[item]) for item in items]
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "items": [list(row) for row in self.top(len(self.counts))]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["capacity"])
+        for item, count, error in data["items"]:
+            sketch.counts[item] = count
+            sketch.errors[item] = error
+        return sketch
+
+
+class DDSketch:
+    """Histogram bucket log: giá trị v > 0 vào bucket ceil(log_gamma(v)), gamma = (1+a)/(1-a)"""
+
+    __slots__ = ("alpha", "log_gamma", "offset", "bins", "zeros", "count", "sum", "min", "max")
+
+    def __init__(self, alpha=DD_ALPHA):
+        self.alpha = alpha
+        self.log_gamma = math.log((1 + alpha) / (1 - alpha))
+        self.offset = 0                          # index bucket của bins[0]
+        self.bins = np.zeros(0, dtype="int64")
+        self.zeros = 0                           # số giá trị <= MIN_VALUE
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _cover(self, lo, hi):
+        """Mở rộng bins để phủ index [lo, hi].
+
+        Quá DD_MAX_BINS thì giữ các bucket cao nhất, bucket thấp hơn gộp vào bucket
+        thấp nhất còn giữ (chỉ phân vị thấp mất độ chính xác). Index < offset khi
+        cộng vào phải kẹp lên offset (_put).
+        """
+        if len(self.bins):
+            lo, hi = min(lo, self.offset), max(hi, self.offset + len(self.bins) - 1)
+        lo = max(lo, hi - DD_MAX_BINS + 1)
+        if (lo, hi - lo + 1) == (self.offset, len(self.bins)):
+            return
+        bins = np.zeros(hi - lo + 1, dtype="int64")
+        if len(self.bins):
+            self._put(bins, lo, self.offset, self.bins)
+        self.offset, self.bins = lo, bins
+
+    @staticmethod
+    def _put(bins, offset, src_offset, src):
+        """bins[i - offset] += src[i - src_offset], index dưới offset dồn vào bins[0]"""
+        start = src_offset - offset
+        if start >= 0:
+            bins[start:start + len(src)] += src
+        else:
+            bins[0] += src[:-start].sum()
+            rest = src[-start:]
+            bins[:len(rest)] += rest
+
+    def add(self, values):
+        """Thêm mảng giá trị (NaN bỏ qua, giống COUNT(wait_ms))"""
+        v = np.asarray(values, dtype="float64")
+        v = v[~np.isnan(v)]
+        if not len(v):
+            return self
+        self.count += len(v)
+        self.sum += float(v.sum())
+        self.min = min(self.min, float(v.min()))
+        self.max = max(self.max, float(v.max()))
+
+        pos = v[v > MIN_VALUE]
+        self.zeros += len(v) - len(pos)
+        if len(pos):
+            idx = np.ceil(np.log(pos) / self.log_gamma).astype("int64")
+            self._cover(int(idx.min()), int(idx.max()))
+            self.bins += np.bincount(np.maximum(idx, self.offset) - self.offset, minlength=len(self.bins))
+        return self
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError(f"Không merge được DDSketch alpha={self.alpha} với alpha={other.alpha}")
+        if len(other.bins):
+            self._cover(other.offset, other.offset + len(other.bins) - 1)
+            self._put(self.bins, self.offset, other.offset, other.bins)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return self.min
+        i = int(np.searchsorted(np.cumsum(self.bins), rank - self.zeros, side="right"))
+        value = 2 * math.exp((self.offset + i) * self.log_gamma) / (1 + math.exp(self.log_gamma))
+        return min(max(value, self.min), self.max)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+    def to_dict(self):
+        return {
+            "alpha": self.alpha, "count": self.count, "sum": self.sum,
+            "min": self.min if self.count else None, "max": self.max if self.count else None,
+            "zeros": self.zeros, "offset": self.offset, "bins": self.bins.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["alpha"])
+        sketch.count, sketch.sum, sketch.zeros = data["count"], data["sum"], data["zeros"]
+        if data["count"]:
+            sketch.min, sketch.max = data["min"], data["max"]
+        sketch.offset = data["offset"]
+        sketch.bins = np.array(data["bins"], dtype="int64")
+        return sketch
+
+
+KINDS = {"top_path": SpaceSaving, "wait_ms": DDSketch}
+
+
+def dumps(sketch):
+    return json.dumps(sketch.to_dict(), separators=(",", ":"))
+
+
+def loads(kind, text):
+    return KINDS[kind].from_dict(json.loads(text))
+
+
+def merge_into(target, sketches):
+    """Merge dict {khoá: sketch} vào target (sketch của target bị sửa tại chỗ)"""
+    for key, sketch in sketches.items():
+        if key in target:
+            target[key].merge(sketch)
+        else:
+            target[key] = sketch
+    return target
+
+
+# ==== Dựng sketch từ fact ====
+
+def sketch_frame(facts, by=()):
+    """Sketch của 1 lô fact (cột status_type, path, wait_ms + các cột trong by).
+
+    Trả về {(*by, status_type, kind, key): sketch}.
+    """
+    out = {}
+    keys = [*by, "status_type"]
+    for group, paths in facts.groupby(keys, observed=True)["path"]:
+        out[(*group, "top_path", "")] = SpaceSaving().add(paths.value_counts().to_dict())
+    for group, waits in facts.groupby([*keys, "path"], observed=True)["wait_ms"]:
+        out[(*group[:-1], "wait_ms", group[-1])] = DDSketch().add(waits.to_numpy())
+    return out
+
+
+def _roll_up(hourly):
+    """Sketch theo ngày = merge các sketch giờ của ngày đó (không đọc lại fact)"""
+    daily = {}
+    for (bucket, *rest), sketch in hourly.items():
+        key = (bucket[:GRAINS["day"]], *rest)
+        if key not in daily:
+            daily[key] = KINDS[rest[1]]().merge(sketch)
+        else:
+            daily[key].merge(sketch)
+    return daily
+
+
+def update_sketches(cur, facts):
+    """Cộng 1 lô fact vào sketch_bucket (giờ + ngày) giống update_rollups.
+
+    facts: DataFrame cần cột minute ('YYYY-MM-DD HH:MM'), status_type, path, wait_ms.
+    """
+    if facts.empty:
+        return
+    hourly = sketch_frame(facts.assign(bucket=facts["minute"].str.slice(0, GRAINS["hour"])), by=["bucket"])
+    for grain, new in (("hour", hourly), ("day", _roll_up(hourly))):
+        buckets = sorted({key[0] for key in new})
+        marks = ", ".join("?" * len(buckets))
+        for bucket, status_type, kind, key, text in cur.execute(
+            f"SELECT bucket, status_type, kind, key, sketch FROM sketch_bucket "
+            f"WHERE grain = ? AND bucket IN ({marks})",
+            (grain, *buckets),
+        ).fetchall():
+            sketch = new.get((bucket, status_type, kind, key))
+            if sketch is not None:
+                new[(bucket, status_type, kind, key)] = loads(kind, text).merge(sketch)
+        cur.executemany(
+            UPSERT_SKETCH,
+            ((grain, *key, dumps(sketch)) for key, sketch in new.items()),
+        )
+
+
+REBUILD_QUERY = """
+SELECT t.minute_ts AS minute, s.status_type, u.path, f.wait_ms
+FROM fact_requests f
+JOIN dim_time   t ON f.time_id = t.time_id
+JOIN dim_url    u ON f.url_id = u.url_id
+JOIN dim_status s ON f.status_id = s.status_id
+"""
+
+
+def rebuild_sketches(conn, chunksize=500_000):
+    """Tính lại sketch_bucket từ fact_requests hiện có (DWH tạo trước khi có sketch)"""
+    conn.execute("DELETE FROM sketch_bucket")
+    cur = conn.cursor()
+    for chunk in pd.read_sql_query(REBUILD_QUERY, conn, chunksize=chunksize):
+        update_sketches(cur, chunk)
+
+
+# ==== Truy vấn theo khoảng thời gian ====
+
+def _bucket(minutes, grain):
+    return pd.Timestamp(minutes * 60, unit="s").strftime("%Y-%m-%d %H:%M")[:GRAINS[grain]]
+
+
+def cover(lo, hi):
+    """Tách [lo, hi) (epoch minute) thành khoảng bucket ngày / giờ trọn và phần phút lẻ.
+
+    Trả về ([(grain, bucket_lo, bucket_hi)], [(phút_lo, phút_hi)]), bucket_hi không tính.
+    """
+    h0, h1 = -(-lo // 60) * 60, hi // 60 * 60
+    if h0 >= h1:
+        return [], [(lo, hi)] if lo < hi else []
+    edges = [(a, b) for a, b in ((lo, h0), (h1, hi)) if a < b]
+
+    d0, d1 = -(-h0 // 1440) * 1440, h1 // 1440 * 1440
+    if d0 < d1:
+        spans = [("day", d0, d1), ("hour", h0, d0), ("hour", d1, h1)]
+    else:
+        spans = [("hour", h0, h1)]
+    ranges = [(grain, _bucket(a, grain), _bucket(b, grain)) for grain, a, b in spans if a < b]
+    return ranges, edges
+
+
+EDGE_QUERY = """
+SELECT s.status_type, u.path, f.wait_ms
+FROM {source} f
+JOIN dim_url    u ON f.url_id = u.url_id
+JOIN dim_status s ON f.status_id = s.status_id
+WHERE f.time_id >= ? AND f.time_id < ? AND s.status_type IN ({marks})
+"""
+
+BUCKET_QUERY = """
+SELECT status_type, kind, key, sketch FROM sketch_bucket
+WHERE grain = ? AND bucket >= ? AND bucket < ? AND status_type IN ({marks})
+"""
+
+
+def range_sketches(conn, lo, hi, status_types):
+    """Sketch đã merge cho [lo, hi) (epoch minute): {(status_type, kind, key): sketch}"""
+    status_types = list(status_types)
+    marks = ", ".join("?" * len(status_types))
+    ranges, edges = cover(lo, hi)
+    out = {}
+    for grain, b_lo, b_hi in ranges:
+        rows = conn.execute(BUCKET_QUERY.format(marks=marks), (grain, b_lo, b_hi, *status_types))
+        for status_type, kind, key, text in rows:
+            merge_into(out, {(status_type, kind, key): loads(kind, text)})
+    for e_lo, e_hi in edges:
+        facts = pd.read_sql_query(
+            EDGE_QUERY.format(source=fact_source(conn, e_lo, e_hi), marks=marks),
+            conn, params=(e_lo, e_hi, *status_types),
+        )
+        merge_into(out, sketch_frame(facts))
+    return out
+
+
+def merge_status(sketches, kind, status_types=None):
+    """Gộp các status_type: {key: sketch} của 1 kind"""
+    out = {}
+    for (status_type, k, key), sketch in sketches.items():
+        if k == kind and (status_types is None or status_type in status_types):
+            merge_into(out, {key: KINDS[kind]().merge(sketch)})
+    return out
+
+
+def top_frame(top, n=10):
+    """DataFrame path / count / error từ 1 SpaceSaving (None = chưa có dữ liệu)"""
+    rows = top.top(n) if top is not None else []
+    return pd.DataFrame(rows, columns=["path", "count", "error"])
+
+
+def quantile_frame(waits, n=10):
+    """Top n path theo p95 wait_ms: path, wait_ms (mean), p50, p95, p99"""
+    rows = [
+        (path, sketch.mean, *(sketch.quantile(q) for q in QUANTILES.values()))
+        for path, sketch in waits.items() if sketch.count
+    ]
+    df = pd.DataFrame(rows, columns=["path", "wait_ms", *QUANTILES])
+    return df.sort_values(["p95", "path"], ascending=[False, True], kind="stable").head(n).reset_index(drop=True)
@@ -0,0 +1,268 @@
+"""Sinh log giả lập số lượng lớn (10M–100M dòng) để load-test ETL và dashboard.
+
+Cùng tỉ lệ normal / error / attack, phân phối status và wait_ms gauss như
+attack_logger.simulate_event, nhưng sinh theo lô bằng NumPy:
+
+- số request mỗi phút theo đường cong ngày đêm (thấp nhất ~3h, cao nhất ~15h)
+- chèn các đợt burst: vài phút traffic tăng --burst-factor lần, phần tăng
+  thêm là request tấn công
+- timestamp tăng dần như log thật, ghi ra CSV (.csv / .csv.gz / .csv.zst)
+  hoặc Parquet theo từng lô nên RAM chỉ phụ thuộc --batch-rows
+- --bad-ratio: tỉ lệ dòng lỗi, chia đều các loại mà DQ của etl.py bắt (time
+  rỗng / sai định dạng, URL không phải http, status không phải số / ngoài 100–599)
+- cùng --seed và tham số -> cùng file
+
+    python src/synth_logs.py --rows 10000000 --out data/raw/synth_10m.csv
+    python src/synth_logs.py --size 2GB --days 7 --out data/raw/synth.parquet
+"""
+import argparse
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from attack_logger import ATTACK_URLS, ERROR_URLS, NORMAL_URLS
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # không có pyarrow: CSV ghi bằng pandas, không ghi được Parquet
+    pa = pa_csv = pq = None
+
+BATCH_ROWS = 1_000_000
+START      = "2025-11-25T00:00:00"
+MIME       = "text/html; charset=utf-8"
+
+# Giống simulate_event: (tỉ lệ cộng dồn, URL, status, mean/std wait_ms)
+KINDS = [
+    (0.6, NORMAL_URLS, [200, 200, 200, 301], 180, 60),
+    (0.8, ERROR_URLS, [403, 404, 404, 500], 250, 100),
+    (1.0, ATTACK_URLS, [200, 400, 403, 404, 500], 350, 150),
+]
+ATTACK = 2
+
+# loại dòng lỗi -> (cột, giá trị lỗi), mỗi loại ứng với 1 rule DQ của etl.py
+BAD_VALUES = {
+    "missing_time": ("time", ""),
+    "invalid_time": ("time", "25/11/2025 10:00"),
+    "invalid_url": ("url", "ftp://shopee.vn/"),
+    "invalid_status": ("status", "abc"),
+    "status_out_of_range": ("status", "999"),
+}
+
+
+def _table(values_per_kind, dtype):
+    """List các list độ dài khác nhau -> (mảng 2D pad, độ dài từng hàng) để chọn vector hoá"""
+    width = max(len(v) for v in values_per_kind)
+    table = np.empty((len(values_per_kind), width), dtype=dtype)
+    for i, values in enumerate(values_per_kind):
+        table[i, :len(values)] = values
+    return table, np.array([len(v) for v in values_per_kind])
+
+
+URL_TABLE, URL_LEN = _table([k[1] for k in KINDS], object)
+STATUS_TABLE, STATUS_LEN = _table([k[2] for k in KINDS], np.int16)
+WAIT_MEAN = np.array([k[3] for k in KINDS], dtype=np.float64)
+WAIT_STD = np.array([k[4] for k in KINDS], dtype=np.float64)
+KIND_CUM = np.array([k[0] for k in KINDS])
+
+
+def minute_profile(rng, minutes, bursts, burst_minutes, burst_factor):
+    """Cường độ tương đối mỗi phút + cờ phút burst"""
+    hour = (np.arange(minutes) % 1440) / 60
+    intensity = 1 + 0.8 * np.sin(2 * np.pi * (hour - 9) / 24)
+    intensity *= rng.lognormal(0, 0.1, minutes)
+
+    is_burst = np.zeros(minutes, dtype=bool)
+    for start in rng.integers(0, max(minutes - burst_minutes, 1), bursts):
+        is_burst[start:start + burst_minutes] = True
+    intensity[is_burst] *= burst_factor
+    return intensity / intensity.sum(), is_burst
+
+
+def make_batch(rng, minute_idx, in_burst, start_us, burst_factor):
+    """Sinh các dòng cho 1 lô; minute_idx đã sắp tăng dần"""
+    n = len(minute_idx)
+    kind = np.searchsorted(KIND_CUM, rng.random(n), side="right")
+    # phần traffic tăng thêm trong phút burst là tấn công
+    kind[in_burst & (rng.random(n) < 1 - 1 / burst_factor)] = ATTACK
+
+    url = URL_TABLE[kind, (rng.random(n) * URL_LEN[kind]).astype(np.int64)]
+    status = STATUS_TABLE[kind, (rng.random(n) * STATUS_LEN[kind]).astype(np.int64)]
+    wait_ms = np.maximum(10, np.abs(rng.normal(WAIT_MEAN[kind], WAIT_STD[kind])))
+
+    offset_us = minute_idx * 60_000_000 + rng.integers(0, 60_000_000, n)
+    offset_us.sort()  # mỗi lô gồm trọn các phút nên sort trong lô là đủ
+
+    return pd.DataFrame({
+        "time": (start_us + offset_us).astype("datetime64[us]"),
+        "method": "GET",
+        "url": url,
+        "status": status,
+        "mimeType": MIME,
+        "wait_ms": wait_ms,
+    })
+
+
+def corrupt(df, rng, ratio):
+    """Thay ~ratio số dòng bằng giá trị lỗi (chia đều các loại trong BAD_VALUES).
+
+    time và status chuyển sang chuỗi (time theo to_log_format) để chứa được giá trị lỗi.
+    """
+    bad = np.flatnonzero(rng.random(len(df)) < ratio)
+    df = to_log_format(df).assign(status=df["status"].astype(str))
+    kinds = rng.integers(0, len(BAD_VALUES), len(bad))
+    for i, (column, value) in enumerate(BAD_VALUES.values()):
+        df.iloc[bad[kinds == i], df.columns.get_loc(column)] = value
+    return df
+
+
+def batches(rows, seed=None, start=START, days=1, bursts=5, burst_minutes=5, burst_factor=20,
+            batch_rows=BATCH_ROWS, bad_ratio=0.0):
+    """Generator các DataFrame theo thứ tự thời gian, tổng cộng `rows` dòng"""
+    rng = np.random.default_rng(seed)
+    minutes = int(days * 1440)
+    p, is_burst = minute_profile(rng, minutes, bursts, burst_minutes, burst_factor)
+    counts = rng.multinomial(rows, p)
+    cum = np.cumsum(counts)
+    start_us = np.datetime64(start, "us").astype(np.int64)
+
+    lo = 0
+    while lo < minutes:
+        # cắt lô theo ranh giới phút, mỗi lô ~batch_rows dòng
+        done = cum[lo - 1] if lo else 0
+        hi = max(int(np.searchsorted(cum, done + batch_rows, side="right")), lo + 1)
+        minute_idx = np.repeat(np.arange(lo, hi), counts[lo:hi])
+        if len(minute_idx):
+            df = make_batch(rng, minute_idx, is_burst[minute_idx], start_us, burst_factor)
+            yield corrupt(df, rng, bad_ratio) if bad_ratio else df
+        lo = hi
+
+
+def parse_size(text):
+    """'500MB', '2GB', '1048576' -> số byte"""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMG]?)B?", text.strip().upper())
+    if not m:
+        raise argparse.ArgumentTypeError(f"Kích thước không hợp lệ: {text}")
+    return int(float(m.group(1)) * 1024 ** " KMG".index(m.group(2) or " "))
+
+
+def to_log_format(df):
+    """time -> chuỗi ISO có hậu tố Z như các logger ghi vào log_parsed.csv"""
+    if not pd.api.types.is_datetime64_any_dtype(df["time"]):  # đã format (corrupt)
+        return df
+    ts = np.datetime_as_string(df["time"].to_numpy(), unit="us")
+    return df.assign(time=np.char.add(ts, "Z"))
+
+
+def rows_for_size(size, seed=None, **kwargs):
+    """Ước lượng số dòng cho file CSV khoảng `size` byte từ 1 lô mẫu"""
+    sample = to_log_format(next(batches(20_000, seed, batch_rows=20_000, **kwargs)))
+    row_bytes = len(sample.to_csv(index=False, header=False).encode()) / len(sample)
+    return int(size / row_bytes)
+
+
+def _csv_writer(path):
+    """Trả về (write(df, first), close) ghi CSV theo lô, nén theo đuôi file"""
+    compression = {".gz": "gzip", ".zst": "zstd"}.get(path.suffix)
+    if pa is None:
+        if compression:
+            raise RuntimeError("Cần pyarrow để ghi CSV nén")
+        f = open(path, "w", newline="", encoding="utf8")
+        return lambda df, first: to_log_format(df).to_csv(f, index=False, header=first), f.close
+
+    sink = pa.CompressedOutputStream(str(path), compression) if compression else pa.OSFile(str(path), "wb")
+    state = {}
+
+    def write(df, first):
+        table = pa.Table.from_pandas(to_log_format(df), preserve_index=False)
+        if first:
+            # Arrow quote cả header; ETL đọc header bằng split(",") nên tự ghi header trần
+            sink.write((",".join(table.column_names) + "\n").encode())
+            options = pa_csv.WriteOptions(include_header=False)
+            state["writer"] = pa_csv.CSVWriter(sink, table.schema, write_options=options)
+        state["writer"].write_table(table)
+
+    def close():
+        if "writer" in state:
+            state["writer"].close()
+        sink.close()
+
+    return write, close
+
+
+def _parquet_writer(path):
+    if pq is None:
+        raise RuntimeError("Cần cài package 'pyarrow' để ghi Parquet")
+    state = {}
+
+    def write(df, first):
+        df = df.assign(
+            # có dòng lỗi thì time đã là chuỗi (corrupt), giữ nguyên
+            time=(df["time"].dt.tz_localize("UTC")
+                  if pd.api.types.is_datetime64_any_dtype(df["time"]) else df["time"]),
+            method=df["method"].astype("category"),
+            mimeType=df["mimeType"].astype("category"),
+        )
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if first:
+            state["writer"] = pq.ParquetWriter(str(path), table.schema, compression="zstd")
+        state["writer"].write_table(table)
+
+    def close():
+        if "writer" in state:
+            state["writer"].close()
+
+    return write, close
+
+
+def generate(out, rows, fmt=None, **kwargs):
+    """Ghi `rows` dòng ra `out` (csv / parquet, mặc định suy từ đuôi file). Trả về số dòng"""
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    fmt = fmt or ("parquet" if out.suffix == ".parquet" else "csv")
+    write, close = (_parquet_writer if fmt == "parquet" else _csv_writer)(out)
+
+    n = 0
+    try:
+        for i, df in enumerate(batches(rows, **kwargs)):
+            write(df, i == 0)
+            n += len(df)
+    finally:
+        close()
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sinh log giả lập số lượng lớn cho load-test")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--rows", type=int, help="số dòng cần sinh")
+    target.add_argument("--size", type=parse_size, help="kích thước CSV mong muốn, VD 500MB, 2GB")
+    parser.add_argument("--out", type=Path, default=Path("data/raw/synth_logs.csv"),
+                        help=".csv, .csv.gz, .csv.zst hoặc .parquet")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="mặc định suy từ đuôi file")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--start", default=START, help="thời điểm bắt đầu (UTC, ISO)")
+    parser.add_argument("--days", type=float, default=1, help="số ngày log trải ra")
+    parser.add_argument("--bursts", type=int, default=5, help="số đợt burst chèn vào")
+    parser.add_argument("--burst-minutes", type=int, default=5, help="độ dài mỗi đợt burst (phút)")
+    parser.add_argument("--burst-factor", type=float, default=20, help="traffic trong burst tăng bao nhiêu lần")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="số dòng mỗi lô ghi")
+    parser.add_argument("--bad-ratio", type=float, default=0.0, help="tỉ lệ dòng lỗi cho DQ, VD 0.01")
+    args = parser.parse_args()
+
+    kwargs = dict(
+        seed=args.seed, start=args.start, days=args.days, bursts=args.bursts,
+        burst_minutes=args.burst_minutes, burst_factor=args.burst_factor, bad_ratio=args.bad_ratio,
+    )
+    rows = args.rows if args.rows is not None else rows_for_size(args.size, **kwargs)
+
+    t0 = time.perf_counter()
+    n = generate(args.out, rows, args.format, batch_rows=args.batch_rows, **kwargs)
+    elapsed = time.perf_counter() - t0
+    size = args.out.stat().st_size
+    print(f"Generated {n} rows ({size / 1e6:.1f} MB) in {elapsed:.1f}s "
+          f"-> {args.out} ({n / elapsed:,.0f} rows/s, {size / 1e6 / elapsed:.0f} MB/s)")
@@ -0,0 +1,110 @@
+"""collector.py chạy với stub HTTP server local (aiohttp) có delay / status điều khiển được"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+web = pytest.importorskip("aiohttp.web")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from collector import collect  # noqa: E402
+
+
+class Stub:
+    """Server 127.0.0.1: GET /?delay=<ms>&status=<code>; ghi lại số request đang xử lý và thời điểm tới"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.arrivals = []
+
+    async def handle(self, request):
+        self.arrivals.append(time.monotonic())
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(float(request.query.get("delay", 0)) / 1000)
+            return web.Response(text="ok", status=int(request.query.get("status", 200)))
+        finally:
+            self.in_flight -= 1
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/", self.handle)
+        # client bỏ request (timeout) thì handler cũng bị huỷ, cleanup không phải chờ
+        self.runner = web.AppRunner(app, handler_cancellation=True)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+class Sink:
+    """Thay LogSink: giữ các dòng trong RAM"""
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, method, url, status, mime, wait_ms):
+        self.rows.append((url, status, mime, wait_ms))
+
+
+def run(urls_of, **kwargs):
+    """Chạy collect() với stub server; urls_of(stub) -> danh sách URL. Trả về (stub, sink, statuses)"""
+    async def main():
+        sink = Sink()
+        async with Stub() as stub:
+            statuses = await collect(urls_of(stub), sink=sink, **kwargs)
+        return stub, sink, statuses
+
+    return asyncio.run(main())
+
+
+def test_concurrency_limit():
+    stub, _, statuses = run(
+        lambda s: [f"{s.url}?delay=100"] * 20, concurrency=4, rate=1000, burst=1000,
+    )
+    assert statuses == {200: 20}
+    assert 2 <= stub.max_in_flight <= 4
+
+
+def test_rate_limit_per_host():
+    rate, burst = 10, 2
+    stub, _, statuses = run(lambda s: [s.url] * 22, concurrency=8, rate=rate, burst=burst)
+    assert statuses == {200: 22}
+    arrivals = sorted(stub.arrivals)
+    # burst request đầu tiên đi ngay, phần còn lại đều theo tốc độ rate
+    assert arrivals[-1] - arrivals[0] >= (22 - burst) / rate * 0.9
+    for i, t in enumerate(arrivals):
+        in_window = sum(1 for u in arrivals[i:] if u - t < 1.0)
+        assert in_window <= rate + burst
+
+
+def test_stalled_endpoint_times_out():
+    _, sink, statuses = run(
+        lambda s: [f"{s.url}?delay=5000", f"{s.url}?status=503"], timeout=0.3, rate=1000, burst=1000,
+    )
+    assert statuses == {0: 1, 503: 1}
+    (_, status, mime, wait_ms), = [row for row in sink.rows if "delay" in row[0]]
+    assert (status, mime) == (0, "timeout")
+    assert 250 <= wait_ms < 1000
+
+
+def test_wait_ms_matches_injected_delay():
+    delays = [50, 150, 300] * 4
+    _, sink, statuses = run(
+        lambda s: [f"{s.url}?delay={d}" for d in delays], concurrency=3, rate=1000, burst=1000,
+    )
+    assert statuses == {200: len(delays)}
+    for url, _, _, wait_ms in sink.rows:
+        delay = int(url.rsplit("=", 1)[1])
+        # không tính thời gian xếp hàng chờ slot: chỉ lệch cỡ overhead của request local
+        assert delay <= wait_ms < delay + 100
@@ -0,0 +1,22 @@
+"""Query dashboard / điều tra không được full scan partition fact, rollup hay sketch"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from check_query_plans import FULL_SCAN, check, connect_schema  # noqa: E402
+
+
+def test_queries_use_indexes():
+    conn = connect_schema()
+    try:
+        assert check(conn, verbose=False) == []
+    finally:
+        conn.close()
+
+
+def test_full_scan_detected():
+    assert FULL_SCAN.match("SCAN fact_requests_20251126")
+    assert FULL_SCAN.match("SCAN sketch_bucket")
+    assert FULL_SCAN.match("SCAN anomalies")
+    assert not FULL_SCAN.match("SCAN u USING COVERING INDEX ix_dim_url_path")